@@ -15,6 +15,8 @@
 #__END_LICENSE__
 
 
+import threading
+
 from geocamUtil import anyjson as json
 
 
@@ -59,4 +61,123 @@ class DotDict(dict):
         if name in dir(self):
             super(DotDict, self).__delattr__(name)
         else:
-            del self[name]
\ No newline at end of file
+            del self[name]
+
+
+_conversionLock = threading.Lock()
+
+
+def convertToDotDictLazy(struct):
+    """
+    Like convertToDotDictRecurse(), but only converts the top level of
+    *struct* up front. Nested dicts are converted when they are first
+    accessed, see LazyDotDict. *struct* itself is not modified.
+    """
+    if isinstance(struct, DotDict):
+        return struct
+    elif isinstance(struct, dict):
+        return LazyDotDict(struct)
+    elif isinstance(struct, list):
+        return [convertToDotDictLazy(elt) for elt in struct]
+    else:
+        return struct
+
+
+class LazyDotDict(DotDict):
+    """
+    A DotDict whose nested dicts and lists are converted by
+    convertToDotDictLazy() the first time they are read, so the cost
+    of conversion is paid only for the parts of a large structure that
+    are actually used. Converted values are stored back, so reading the
+    same field twice returns the same object and changes to it stick.
+
+    Values stored after construction are returned as they are, like
+    with DotDict. Note that dict(lazyDotDict) and json.dumps() see the
+    unconverted values, which compare and serialize the same.
+
+    Conversion is done under a lock, so a LazyDotDict can be read from
+    several threads at once (e.g. by threaded ZmqSubscriber handlers).
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        # keys whose values may still need conversion
+        object.__setattr__(self, '_unconverted', set(dict.iterkeys(self)))
+
+    def __getitem__(self, key):
+        unconverted = self._unconverted
+        if unconverted and key in unconverted:
+            with _conversionLock:
+                value = dict.__getitem__(self, key)
+                if key in unconverted:
+                    value = convertToDotDictLazy(value)
+                    dict.__setitem__(self, key, value)
+                    # discard only after storing, so that readers that
+                    # don't find key in unconverted get the new value
+                    unconverted.discard(key)
+                return value
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._unconverted.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._unconverted.discard(key)
+        dict.__delitem__(self, key)
+
+    def __reduce__(self):
+        return (LazyDotDict, (dict(self),))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(dict.iterkeys(self))
+        return key, self.pop(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def clear(self):
+        self._unconverted.clear()
+        dict.clear(self)
+
+    def copy(self):
+        # iteritems() converts every value first, so that the copy
+        # shares nested values with self as DotDict.copy() does
+        result = LazyDotDict()
+        dict.update(result, self.iteritems())
+        return result
+
+    def iteritems(self):
+        for key in dict.keys(self):
+            yield key, self[key]
+
+    def itervalues(self):
+        for key in dict.keys(self):
+            yield self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
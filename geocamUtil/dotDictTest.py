@@ -0,0 +1,94 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import sys
+import copy
+import pickle
+import unittest
+import threading
+
+from geocamUtil import anyjson as json
+from geocamUtil.dotDict import DotDict, LazyDotDict, convertToDotDictRecurse, convertToDotDictLazy
+
+JSON_STRING = '{"a": {"b": {"c": 1}, "d": [{"e": 2}, 3]}, "f": "foo"}'
+
+
+class DotDictTest(unittest.TestCase):
+    def test_lazy(self):
+        struct = json.loads(JSON_STRING)
+        lazy = convertToDotDictLazy(struct)
+        self.assertTrue(isinstance(lazy, LazyDotDict))
+        self.assertEqual(lazy, convertToDotDictRecurse(json.loads(JSON_STRING)))
+
+        # nested values are converted on access, and only once
+        self.assertTrue(type(dict.__getitem__(lazy, 'a')) is dict)
+        self.assertTrue(isinstance(lazy.a, DotDict))
+        self.assertTrue(lazy.a is lazy['a'])
+        self.assertEqual(lazy.a.b.c, 1)
+        self.assertEqual(lazy.a.d[0].e, 2)
+        self.assertEqual(lazy.get('f'), 'foo')
+
+        # changes to converted values stick, and the input is untouched
+        lazy.a.b.c = 5
+        self.assertEqual(lazy.a.b.c, 5)
+        self.assertEqual(struct['a']['b']['c'], 1)
+
+        # stored values are returned as they are
+        raw = {'x': 1}
+        lazy.g = raw
+        self.assertTrue(lazy.g is raw)
+
+    def test_containers(self):
+        lazy = convertToDotDictLazy(json.loads(JSON_STRING))
+        self.assertTrue(all(isinstance(v, DotDict) for k, v in lazy.iteritems() if k == 'a'))
+        copied = lazy.copy()
+        self.assertTrue(isinstance(copied, LazyDotDict))
+        self.assertTrue(copied.a is lazy.a)
+        self.assertEqual(json.loads(repr(lazy)), json.loads(JSON_STRING))
+        for restored in (pickle.loads(pickle.dumps(lazy, 2)), copy.deepcopy(lazy)):
+            self.assertEqual(restored, lazy)
+            self.assertEqual(restored.a.d[0].e, 2)
+        self.assertTrue(isinstance(lazy.pop('a'), DotDict))
+        self.assertEqual(lazy.keys(), ['f'])
+
+    def test_threads(self):
+        # every thread must see each nested value converted, and the
+        # same converted object
+        numKeys = 200
+        checkInterval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for _i in xrange(20):
+                lazy = convertToDotDictLazy(dict([(k, {'v': k}) for k in xrange(numKeys)]))
+                results = []
+
+                def readAll():
+                    results.append([lazy[k] for k in xrange(numKeys)])
+                threads = [threading.Thread(target=readAll) for _j in xrange(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                for values in results:
+                    for k, value in enumerate(values):
+                        self.assertTrue(isinstance(value, DotDict))
+                        self.assertTrue(value is results[0][k])
+        finally:
+            sys.setcheckinterval(checkInterval)
+
+
+if __name__ == '__main__':
+    unittest.main()
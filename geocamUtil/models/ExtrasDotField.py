@@ -18,7 +18,7 @@ import json
 from django.db import models
 from django.core.exceptions import ValidationError
 
-from geocamUtil.dotDict import DotDict, convertToDotDictRecurse
+from geocamUtil.dotDict import DotDict, convertToDotDictLazy
 
 
 class ExtrasDotField(models.TextField):
@@ -45,13 +45,13 @@ class ExtrasDotField(models.TextField):
         '''
         if value == '':
             return DotDict()
-        elif type(value) == DotDict:
+        elif isinstance(value, DotDict):
             return value
         else:
             theDotDict = DotDict()
             try:
                 jsonStruct = json.loads(value)
-                theDotDict = convertToDotDictRecurse(jsonStruct)
+                theDotDict = convertToDotDictLazy(jsonStruct)
                 assert isinstance(theDotDict, DotDict), 'expected a DotDict object, found a %s' % type(theDotDict).__name__
                 for key in theDotDict.iterkeys():
                     assert type(key) in (unicode, str), 'expected unicode or str keys, found a %s' % type(key).__name__
@@ -20,6 +20,7 @@
 from geocamUtil.models.timestampDescriptorTest import TimestampDescriptorTest
 from geocamUtil.MultiSettingsTest import MultiSettingsTest
 from geocamUtil.anyjsonTest import AnyJsonTest
+from geocamUtil.dotDictTest import DotDictTest
 from geocamUtil.models.UuidFieldTest import UuidFieldTest
 from geocamUtil.models.ExtrasFieldTest import ExtrasFieldTest
 from geocamUtil.models.jsonFieldTest import JsonFieldTest
@@ -28,6 +29,18 @@ from geocamUtil.InstallerTest import InstallerTest
 from geocamUtil.storeTest import StoreTest
 from geocamUtil.icons.rotateTest import IconsRotateTest
 from geocamUtil.icons.svgTest import IconsSvgTest
+from geocamUtil.zmqUtil.utilTest import LogParserTest, LogReaderTest, MergeLogRecordsTest
+from geocamUtil.zmqUtil.logWriterTest import LogWriterTest
+from geocamUtil.zmqUtil.zmqCentralTest import ZmqCentralTest
+from geocamUtil.zmqUtil.attachmentStoreTest import AttachmentStoreTest
+from geocamUtil.zmqUtil.topicStatsTest import TopicStatsTest
+from geocamUtil.zmqUtil.logFilterTest import PrefixTrieTest, LogFilterTest
+from geocamUtil.zmqUtil.publisherTest import PublisherTest
+from geocamUtil.zmqUtil.subscriberTest import SubscriberTest
+from geocamUtil.zmqUtil.codecTest import CodecTest
+from geocamUtil.zmqUtil.zmqStatLogsTest import ZmqStatLogsTest
+from geocamUtil.zmqUtil.zmqSortLogsTest import ZmqSortLogsTest
+from geocamUtil.zmqUtil.zmqGrepTest import ZmqGrepTest
 
 # commandsTest is destructive and should only be run in the example site for geocamUtil
 from geocamUtil.management import commandUtil
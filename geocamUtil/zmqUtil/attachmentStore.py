@@ -0,0 +1,153 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import hashlib
+import tempfile
+import mimetypes
+
+from geocamUtil import anyjson as json
+from geocamUtil.zmqUtil.util import formatMessageBody
+
+ATTACHMENTS_DIR = 'attachments'
+STORE_REF_PREFIX = 'cas:'
+
+
+def getFileMode():
+    """
+    Returns the mode that open() would give a new file under the
+    current umask.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0666 & ~umask
+
+
+class AttachmentStore(object):
+    """
+    A content-addressed store for the attachments of logged messages,
+    kept in the 'attachments' subdirectory of the message log directory.
+
+    Each attachment is stored once, named by the SHA-1 hash of its
+    contents, in a two-level fan-out directory tree like
+    'attachments/3f/a2/3fa2...'. The attachment list of a message
+    (filenames, content types and hashes) is itself stored as a JSON
+    manifest, and the message log record points to the manifest with
+    the reference 'cas:<manifestHash>'.
+
+    For older logs, references in the form 'attachments/<date>/...'
+    point to a directory holding one file per attachment. Those can be
+    read but not written.
+    """
+
+    def __init__(self, logDir):
+        self.logDir = logDir
+        self.rootDir = os.path.join(logDir, ATTACHMENTS_DIR)
+        self.fileMode = getFileMode()
+
+    def getPath(self, digest):
+        return os.path.join(self.rootDir, digest[0:2], digest[2:4], digest)
+
+    def put(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.getPath(digest)
+        if not os.path.exists(path):
+            parentDir = os.path.dirname(path)
+            if not os.path.exists(parentDir):
+                os.makedirs(parentDir)
+            # write then rename so readers never see a partial file
+            fd, tmpPath = tempfile.mkstemp(dir=parentDir, prefix='.tmp')
+            # mkstemp() files are private, make it readable like open() would
+            os.fchmod(fd, self.fileMode)
+            os.write(fd, data)
+            os.close(fd)
+            os.rename(tmpPath, path)
+        return digest
+
+    def get(self, digest):
+        return open(self.getPath(digest), 'rb').read()
+
+    def storeAttachments(self, attachments):
+        """
+        Stores the attachments of a message, as returned by
+        parseMessageBody(), and returns a reference to them for the
+        message log.
+        """
+        attachmentData = []
+        for i, attachment in enumerate(attachments):
+            data = attachment.get_payload(decode=True)
+            if data is None:
+                data = ''
+            attachmentData.append({'filename': attachment.get_filename() or ('attachment%d' % i),
+                                   'contentType': attachment.get_content_type(),
+                                   'data': data})
+        return self.storeAttachmentData(attachmentData)
+
+    def storeAttachmentData(self, attachments):
+        """
+        Like storeAttachments(), but *attachments* is a list of dicts
+        with 'filename', 'contentType' and 'data' fields, as returned by
+        parseMultipartMessage(). 'data' can be any buffer.
+        """
+        manifest = [{'filename': attachment['filename'],
+                     'contentType': attachment['contentType'],
+                     'hash': self.put(attachment['data'])}
+                    for attachment in attachments]
+        manifestDigest = self.put(json.dumps(manifest, sort_keys=True))
+        return STORE_REF_PREFIX + manifestDigest
+
+    def loadAttachments(self, ref):
+        """
+        Returns the attachments for a message log reference as a list
+        of dicts with 'filename', 'contentType' and 'data' fields.
+        """
+        if ref.startswith(STORE_REF_PREFIX):
+            manifest = json.loads(self.get(ref[len(STORE_REF_PREFIX):]))
+            return [{'filename': entry['filename'].encode('utf-8'),
+                     'contentType': entry['contentType'].encode('utf-8'),
+                     'data': self.get(entry['hash'])}
+                    for entry in manifest]
+        else:
+            attachmentDir = os.path.join(self.logDir, ref)
+            result = []
+            for filename in sorted(os.listdir(attachmentDir)):
+                contentType = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                result.append({'filename': filename,
+                               'contentType': contentType,
+                               'data': open(os.path.join(attachmentDir, filename), 'rb').read()})
+            return result
+
+    def getFullMessage(self, rec):
+        """
+        Returns the message for a LogRecord as it was originally sent,
+        with its attachments.
+        """
+        if not rec.hasAttachments():
+            return rec.msg
+        topic, jsonText = rec.msg.split(':', 1)
+        return '%s:%s' % (topic,
+                          formatMessageBody(jsonText,
+                                            self.loadAttachments(rec.attachmentsPath)))
+
+
+def getLogAttachmentStore(logPath):
+    """
+    Returns the AttachmentStore for the message log at *logPath*, or
+    for the current directory if *logPath* is '-' (stdin).
+    """
+    if logPath == '-':
+        return AttachmentStore('.')
+    return AttachmentStore(os.path.dirname(os.path.abspath(logPath)))
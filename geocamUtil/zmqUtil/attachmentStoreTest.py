@@ -0,0 +1,114 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import shutil
+import unittest
+import tempfile
+
+import zmq
+
+from geocamUtil.zmqUtil.util import (parseMessage,
+                                     LogRecord,
+                                     formatMultipartMessage,
+                                     parseMultipartMessage,
+                                     joinMultipartMessage)
+from geocamUtil.zmqUtil.attachmentStore import AttachmentStore
+
+thisDir = os.path.dirname(__file__)
+TEST_MESSAGE = ('dds.Resolve.RESOLVE_CAM_ProcessedImage:'
+                + open(os.path.join(thisDir, 'exampleMessageWithAttachment.txt'), 'rb').read())
+
+
+def countFiles(rootDir):
+    return sum([len(files) for _dirPath, _dirs, files in os.walk(rootDir)])
+
+
+class AttachmentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp('-attachmentStoreTestDir')
+        self.store = AttachmentStore(self.tempDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_dedup(self):
+        parsed = parseMessage(TEST_MESSAGE)
+        ref1 = self.store.storeAttachments(parsed['attachments'])
+        ref2 = self.store.storeAttachments(parseMessage(TEST_MESSAGE)['attachments'])
+        self.assertEqual(ref1, ref2)
+        # one attachment plus one manifest
+        self.assertEqual(countFiles(self.store.rootDir), 2)
+
+    def test_fileMode(self):
+        oldUmask = os.umask(022)
+        try:
+            digest = AttachmentStore(self.store.logDir).put('data')
+        finally:
+            os.umask(oldUmask)
+        self.assertEqual(os.stat(self.store.getPath(digest)).st_mode & 0777, 0644)
+
+    def test_roundTrip(self):
+        parsed = parseMessage(TEST_MESSAGE)
+        ref = self.store.storeAttachments(parsed['attachments'])
+        rec = LogRecord(0, ref, ':'.join((parsed['topic'], parsed['json'])))
+        reparsed = parseMessage(self.store.getFullMessage(rec))
+        self.assertEqual(reparsed['topic'], parsed['topic'])
+        self.assertEqual(reparsed['json'], parsed['json'])
+        self.assertEqual([a.get_filename() for a in reparsed['attachments']],
+                         [a.get_filename() for a in parsed['attachments']])
+        self.assertEqual([a.get_payload(decode=True) for a in reparsed['attachments']],
+                         [a.get_payload(decode=True) for a in parsed['attachments']])
+
+    def test_multipart(self):
+        parsed = parseMessage(TEST_MESSAGE)
+        attachments = [{'filename': a.get_filename(),
+                        'contentType': a.get_content_type(),
+                        'data': a.get_payload(decode=True)}
+                       for a in parsed['attachments']]
+        frames = [zmq.Frame(f) for f in formatMultipartMessage(parsed['topic'],
+                                                               parsed['json'],
+                                                               attachments)]
+        reparsed = parseMultipartMessage(frames)
+        self.assertEqual(reparsed['topic'], parsed['topic'])
+        self.assertTrue(isinstance(reparsed['attachments'][0]['data'], memoryview))
+
+        # the same attachments stored from either wire format dedup
+        ref1 = self.store.storeAttachments(parsed['attachments'])
+        ref2 = self.store.storeAttachmentData(reparsed['attachments'])
+        self.assertEqual(ref1, ref2)
+
+        rejoined = parseMessage(joinMultipartMessage(frames))
+        self.assertEqual(rejoined['json'], parsed['json'])
+        self.assertEqual([a.get_payload(decode=True) for a in rejoined['attachments']],
+                         [a['data'] for a in attachments])
+
+    def test_noAttachments(self):
+        rec = LogRecord(0, '-', 'a.b:{}')
+        self.assertEqual(self.store.getFullMessage(rec), 'a.b:{}')
+
+    def test_legacyDirectory(self):
+        ref = os.path.join('attachments', '2012-07-13', '10-00-00.000000', 'a.b', '1234abcd')
+        os.makedirs(os.path.join(self.tempDir, ref))
+        open(os.path.join(self.tempDir, ref, 'foo.jpg'), 'wb').write('xyz')
+        attachments = self.store.loadAttachments(ref)
+        self.assertEqual(attachments, [{'filename': 'foo.jpg',
+                                        'contentType': 'image/jpeg',
+                                        'data': 'xyz'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Compares encode and decode throughput and encoded size of the message
+body codecs (see codec.py) for typical message shapes.
+"""
+
+import time
+
+from geocamUtil.zmqUtil.codec import CODECS, encodeBody, decodeBody
+from geocamUtil.dotDict import convertToDotDictLazy
+
+MESSAGE_SHAPES = [
+    ('heartbeat', {'module': 'resolveBridge',
+                   'timestamp': '1342172466000000',
+                   'host': 'ops1',
+                   'pub': 'tcp://127.0.0.1:50123'}),
+    ('position', {'module': 'trackBridge',
+                  'timestamp': '1342172466000000',
+                  'lat': 37.4108, 'lon': -122.0646, 'alt': 3.52,
+                  'heading': 271.4, 'speed': 0.83}),
+    ('djangoModel', {'module': 'plrpExplorer',
+                     'timestamp': '1342172466000000',
+                     'data': {'model': 'plrpExplorer.resolvesample',
+                              'pk': 12345,
+                              'fields': {'name': 'RESOLVE sample 12345',
+                                         'timestamp': '2012-07-13T10:00:00.000Z',
+                                         'lat': 37.4108, 'lon': -122.0646,
+                                         'depth': 0.25, 'operator': 'jdoe',
+                                         'notes': 'nominal', 'flags': [1, 4, 9]}}}),
+    ('sensorArray', {'module': 'rawBridge',
+                     'timestamp': '1342172466000000',
+                     'values': [0.001 * i for i in xrange(256)]}),
+]
+
+
+def timeIt(func, arg, minSeconds):
+    n = 0
+    start = time.time()
+    while True:
+        for _i in xrange(100):
+            func(arg)
+        n += 100
+        elapsed = time.time() - start
+        if elapsed >= minSeconds:
+            return n / elapsed
+
+
+def benchmark(minSeconds):
+    print '%-12s %-8s %8s %12s %12s %16s' % ('shape', 'codec', 'bytes',
+                                             'encode/s', 'decode/s', 'decode+dotdict/s')
+    for shapeName, obj in MESSAGE_SHAPES:
+        for codecName, codec in sorted(CODECS.iteritems()):
+            if not codec.isAvailable():
+                print '%-12s %-8s (not available)' % (shapeName, codecName)
+                continue
+            body = encodeBody(obj, codec)
+            encodeRate = timeIt(lambda o: encodeBody(o, codec), obj, minSeconds)
+            decodeRate = timeIt(decodeBody, body, minSeconds)
+            dotDictRate = timeIt(lambda b: convertToDotDictLazy(decodeBody(b)), body, minSeconds)
+            print ('%-12s %-8s %8d %12d %12d %16d'
+                   % (shapeName, codecName, len(body), encodeRate, decodeRate, dotDictRate))
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog')
+    parser.add_option('-s', '--seconds',
+                      default=0.5, type='float',
+                      help='Minimum time to spend on each measurement [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+    benchmark(opts.seconds)
+
+
+if __name__ == '__main__':
+    main()
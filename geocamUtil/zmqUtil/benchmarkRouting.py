@@ -0,0 +1,91 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+"""
+Compares the cost of ZmqSubscriber.routeMessage() with the prefix trie
+dispatch index against the old linear scan of all subscribed
+prefixes, as the number of subscriptions grows.
+"""
+
+import time
+
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+
+from geocamUtil.zmqUtil.subscriber import ZmqSubscriber
+
+SUBSCRIPTION_COUNTS = (1, 10, 100, 1000)
+NUM_TOPICS = 50
+
+
+def linearRouteMessage(handlers, msg):
+    # routing as done before the dispatch index, for comparison
+    colonIndex = msg.find(':')
+    topic = msg[:(colonIndex + 1)]
+    body = msg[(colonIndex + 1):]
+    handled = 0
+    for topicPrefix, registry in handlers.iteritems():
+        if topic.startswith(topicPrefix):
+            for handler in registry.itervalues():
+                handler(topic[:-1], body)
+                handled = 1
+    return handled
+
+
+def timeIt(func, msgs, minSeconds):
+    n = 0
+    start = time.time()
+    while True:
+        for msg in msgs:
+            func(msg)
+        n += len(msgs)
+        elapsed = time.time() - start
+        if elapsed >= minSeconds:
+            return n / elapsed
+
+
+def benchmark(minSeconds):
+    context = zmq.Context()
+    print '%8s %14s %14s %8s' % ('subs', 'linear msg/s', 'trie msg/s', 'speedup')
+    for numSubs in SUBSCRIPTION_COUNTS:
+        subscriber = ZmqSubscriber('benchmarkRouting')
+        subscriber.stream = ZMQStream(context.socket(zmq.SUB))
+        for i in xrange(numSubs):
+            subscriber.subscribeRaw('bridge%d.sensor%d:' % (i % 10, i), lambda topic, body: None)
+        msgs = ['bridge%d.sensor%d:{"value": 1}' % (i % 10, i % numSubs)
+                for i in xrange(NUM_TOPICS)]
+        linearRate = timeIt(lambda msg: linearRouteMessage(subscriber.handlers, msg),
+                            msgs, minSeconds)
+        trieRate = timeIt(subscriber.routeMessage, msgs, minSeconds)
+        print '%8d %14d %14d %7.1fx' % (numSubs, linearRate, trieRate, trieRate / linearRate)
+        subscriber.stream.close()
+    context.term()
+
+
+def main():
+    import optparse
+    parser = optparse.OptionParser('usage: %prog')
+    parser.add_option('-s', '--seconds',
+                      default=0.5, type='float',
+                      help='Minimum time to spend on each measurement [%default]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('expected no args')
+    benchmark(opts.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import re
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # pylint: disable=C0103
+
+from geocamUtil import anyjson as json
+
+# a JSON message body never starts with a NUL byte. bodies in other
+# encodings start with CODEC_MARKER followed by a one-character codec
+# id, so receivers can decode any body without knowing how the
+# publisher was configured.
+CODEC_MARKER = '\x00'
+
+# top-level fields that ZmqPublisher stamps on each message. JSON
+# bodies start with them, so receivers can read them with
+# getEnvelopeFields() without parsing the whole body.
+ENVELOPE_FIELDS = ('seq', 'module', 'timestamp')
+ENVELOPE_FIELD_REGEX = re.compile(r' ?"(seq|module|timestamp)": ?(\d+|"(?:[^"\\]|\\.)*"|null) ?(,|\})')
+
+
+class JsonCodec(object):
+    """
+    Plain text JSON, with no marker. This is the default.
+    """
+    name = 'json'
+    codecId = None
+
+    def isAvailable(self):
+        return True
+
+    def encode(self, obj):
+        return json.dumps(obj)
+
+    def decode(self, text):
+        return json.loads(text)
+
+
+class MsgpackCodec(object):
+    """
+    MessagePack, a compact binary encoding of the JSON data model.
+    Requires the optional msgpack module. Like JSON, it decodes strings
+    as unicode and tuples as lists.
+    """
+    name = 'msgpack'
+    codecId = 'm'
+
+    def isAvailable(self):
+        return msgpack is not None
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=False)
+
+    def decode(self, text):
+        return msgpack.unpackb(text, raw=False)
+
+
+CODECS = {}
+CODECS_BY_ID = {}
+
+
+def registerCodec(codec):
+    CODECS[codec.name] = codec
+    if codec.codecId is not None:
+        CODECS_BY_ID[codec.codecId] = codec
+
+
+registerCodec(JsonCodec())
+registerCodec(MsgpackCodec())
+
+
+def getCodec(name):
+    codec = CODECS.get(name, None)
+    if codec is None:
+        raise ValueError('unknown codec "%s", expected one of %s'
+                         % (name, ', '.join(sorted(CODECS.keys()))))
+    if not codec.isAvailable():
+        raise ValueError('codec "%s" is not available, is the %s module installed?'
+                         % (name, name))
+    return codec
+
+
+def encodeJsonBody(obj):
+    """
+    Encodes *obj* as JSON. If it is a dict, any envelope fields (see
+    ENVELOPE_FIELDS) come first.
+    """
+    if not isinstance(obj, dict):
+        return json.dumps(obj)
+    envelope = []
+    rest = None
+    for field in ENVELOPE_FIELDS:
+        if field in obj:
+            if rest is None:
+                rest = dict(obj)
+            envelope.append('"%s": %s' % (field, json.dumps(rest.pop(field))))
+    if rest is None:
+        return json.dumps(obj)
+    if not rest:
+        return '{%s}' % ', '.join(envelope)
+    return '{%s, %s' % (', '.join(envelope), json.dumps(rest)[1:])
+
+
+def encodeBody(obj, codec=None):
+    """
+    Encodes *obj* as a message body using *codec* (default JSON),
+    marking the body with the codec id.
+    """
+    if codec is None or codec.codecId is None:
+        return encodeJsonBody(obj)
+    return ''.join((CODEC_MARKER, codec.codecId, codec.encode(obj)))
+
+
+def decodeBody(body):
+    """
+    Decodes a message body encoded by encodeBody() with any codec.
+    """
+    if not body.startswith(CODEC_MARKER):
+        return json.loads(body)
+    codec = CODECS_BY_ID.get(body[1:2], None)
+    if codec is None:
+        raise ValueError('message body has unknown codec id %r' % body[1:2])
+    if not codec.isAvailable():
+        raise ValueError('can\'t decode message body, codec "%s" is not available' % codec.name)
+    return codec.decode(body[2:])
+
+
+def parseEnvelopeValue(text):
+    if text.startswith('"'):
+        if '\\' in text:
+            return json.loads(text)
+        return text[1:-1]
+    if text == 'null':
+        return None
+    return int(text)
+
+
+def getEnvelopeFields(msg, start=0):
+    """
+    Returns a dict of the envelope fields (see ENVELOPE_FIELDS) of the
+    message body that starts at offset *start* of *msg*. Only top-level
+    fields are returned: for a JSON body, only those in the run of
+    envelope fields at its start, as written by encodeBody(); for a
+    body in another codec, those of the decoded object. Returns an
+    empty dict if the body can't be decoded.
+    """
+    if msg.startswith(CODEC_MARKER, start):
+        try:
+            obj = decodeBody(msg[start:])
+        except ValueError:
+            return {}
+        if not isinstance(obj, dict):
+            return {}
+        return dict([(field, obj[field]) for field in ENVELOPE_FIELDS if field in obj])
+
+    result = {}
+    if not msg.startswith('{', start):
+        return result
+    pos = start + 1
+    while True:
+        match = ENVELOPE_FIELD_REGEX.match(msg, pos)
+        if match is None:
+            break
+        result[match.group(1)] = parseEnvelopeValue(match.group(2))
+        if match.group(3) == '}':
+            break
+        pos = match.end()
+    return result
@@ -0,0 +1,60 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import unittest
+
+from geocamUtil.zmqUtil import codec
+from geocamUtil.zmqUtil.codec import getCodec, encodeBody, decodeBody, getEnvelopeFields
+
+TEST_OBJ = {'module': 'test',
+            'timestamp': '1342172466000000',
+            'pos': [37.41, -122.06, 3.5],
+            'status': {'ok': True, 'count': 12, 'note': None}}
+
+
+class CodecTest(unittest.TestCase):
+    def test_json(self):
+        body = encodeBody(TEST_OBJ)
+        self.assertEqual(body[0], '{')
+        self.assertEqual(decodeBody(body), TEST_OBJ)
+
+    @unittest.skipIf(codec.msgpack is None, 'msgpack module not installed')
+    def test_msgpack(self):
+        body = encodeBody(TEST_OBJ, getCodec('msgpack'))
+        self.assertEqual(body[:2], '\x00m')
+        decoded = decodeBody(body)
+        self.assertEqual(decoded, TEST_OBJ)
+        # strings decode as unicode, as with JSON
+        self.assertTrue(isinstance(decoded['module'], unicode))
+
+    def test_envelope(self):
+        obj = dict(TEST_OBJ, seq=3, status={'seq': 9, 'timestamp': '0'})
+        body = encodeBody(obj)
+        self.assertTrue(body.startswith('{"seq": 3, "module": "test", "timestamp": '))
+        self.assertEqual(decodeBody(body), obj)
+        self.assertEqual(getEnvelopeFields('a:' + body, 2),
+                         {'seq': 3, 'module': 'test', 'timestamp': '1342172466000000'})
+        self.assertEqual(getEnvelopeFields('{"x": {"seq": 1}, "seq": 2}'), {})
+        self.assertEqual(getEnvelopeFields('{"module": "a\\"b"}'), {'module': 'a"b'})
+        self.assertEqual(encodeBody({'seq': 1}), '{"seq": 1}')
+
+    def test_errors(self):
+        self.assertRaises(ValueError, getCodec, 'foo')
+        self.assertRaises(ValueError, decodeBody, '\x00?abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import logging
+import threading
+import Queue
+
+DEFAULT_HANDLER_THREADS = 4
+DEFAULT_HANDLER_QUEUE_SIZE = 1000
+
+
+class HandlerPool(object):
+    """
+    Runs message handlers on a pool of worker threads, so that a slow
+    handler (a database write, image processing) doesn't hold up the
+    ioloop and the handlers of other topics.
+
+    Each worker has its own queue, and submit() picks the worker by
+    hashing an ordering key, so handler calls with the same key run in
+    the order they were submitted. Each queue holds at most
+    *queueSize* calls. When it is full, submit() blocks the caller,
+    which stops the ioloop from reading more messages until the
+    workers catch up.
+    """
+
+    def __init__(self, numThreads=DEFAULT_HANDLER_THREADS,
+                 queueSize=DEFAULT_HANDLER_QUEUE_SIZE,
+                 name='HandlerPool'):
+        self.queues = [Queue.Queue(queueSize) for _i in xrange(numThreads)]
+        self.numBlocked = 0
+        self.numErrors = 0
+        self.threads = []
+        for i, queue in enumerate(self.queues):
+            thread = threading.Thread(target=self.run, args=(queue,),
+                                      name='%s-%d' % (name, i))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, handler, *args):
+        """
+        Queues the call handler(*args) on the worker for *key*.
+        """
+        queue = self.queues[hash(key) % len(self.queues)]
+        if queue.full():
+            self.numBlocked += 1
+        queue.put((handler, args))
+
+    def run(self, queue):
+        while True:
+            item = queue.get()
+            try:
+                if item is None:
+                    break
+                handler, args = item
+                try:
+                    handler(*args)
+                except:  # pylint: disable=W0702
+                    self.numErrors += 1
+                    logging.exception('HandlerPool: error in handler %s', handler)
+            finally:
+                queue.task_done()
+
+    def join(self):
+        """
+        Waits until all queued handler calls have finished.
+        """
+        for queue in self.queues:
+            queue.join()
+
+    def stop(self):
+        """
+        Runs the queued handler calls and stops the workers.
+        """
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def getStats(self):
+        return {'queued': sum([queue.qsize() for queue in self.queues]),
+                'blocked': self.numBlocked,
+                'errors': self.numErrors}
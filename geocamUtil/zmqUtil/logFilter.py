@@ -0,0 +1,142 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+from geocamUtil.zmqUtil.prefixTrie import PrefixTrie
+
+MAX_CACHED_TOPICS = 10000
+
+
+def parseRateSpec(spec):
+    """
+    Parses a '<topicPrefix>:<number>' option value. Message topics can't
+    contain ':', so the last ':' always separates the number.
+    """
+    try:
+        prefix, number = spec.rsplit(':', 1)
+        number = float(number)
+    except ValueError:
+        raise ValueError('"%s" is not in the format "<topicPrefix>:<number>"' % spec)
+    if number <= 0:
+        raise ValueError('number in "%s" must be positive' % spec)
+    return prefix, number
+
+
+class LogRule(object):
+    def __init__(self):
+        self.include = None
+        self.keepEvery = None
+        self.minIntervalUs = None
+
+
+class TopicFilter(object):
+    __slots__ = ('include', 'keepEvery', 'minIntervalUs', 'count', 'lastLogged')
+
+    def __init__(self, include, keepEvery, minIntervalUs):
+        self.include = include
+        self.keepEvery = keepEvery
+        self.minIntervalUs = minIntervalUs
+        self.count = 0
+        self.lastLogged = None
+
+
+class LogFilter(object):
+    """
+    Decides which messages zmqCentral writes to the message log, based
+    on rules keyed by topic prefix:
+
+     * *include* and *exclude* list prefixes of topics to log or not.
+       The rule with the longest matching prefix wins, so you can
+       exclude 'dds' but include 'dds.Resolve'. If there are any
+       include rules, topics that match no rule are not logged.
+
+     * *decimate* is a list of (prefix, n) pairs: log only one of every
+       n messages on each matching topic.
+
+     * *maxRate* is a list of (prefix, hz) pairs: log at most hz
+       messages per second on each matching topic.
+
+    Decimation is tracked separately for each topic, so decimating
+    'dds.Raw' keeps every nth message of each 'dds.Raw.*' stream. The
+    rules are stored in a PrefixTrie and the rules that apply to a
+    topic are resolved once and cached.
+    """
+
+    def __init__(self, include=(), exclude=(), decimate=(), maxRate=()):
+        self.rules = PrefixTrie()
+        for prefix in include:
+            self.getRule(prefix).include = True
+        for prefix in exclude:
+            self.getRule(prefix).include = False
+        for prefix, n in decimate:
+            self.getRule(prefix).keepEvery = int(n)
+        for prefix, hz in maxRate:
+            self.getRule(prefix).minIntervalUs = 1e6 / hz
+        self.defaultInclude = not include
+        self.topicFilters = {}
+        self.numLogged = 0
+        self.numDropped = 0
+
+    def __nonzero__(self):
+        return len(self.rules) > 0
+
+    def getRule(self, prefix):
+        rule = self.rules.get(prefix)
+        if rule is None:
+            rule = LogRule()
+            self.rules.add(prefix, rule)
+        return rule
+
+    def getTopicFilter(self, topic):
+        include = self.defaultInclude
+        keepEvery = None
+        minIntervalUs = None
+        # matches come shortest first, so longer prefixes override
+        for _prefix, rule in self.rules.iterMatches(topic):
+            if rule.include is not None:
+                include = rule.include
+            if rule.keepEvery is not None:
+                keepEvery = rule.keepEvery
+            if rule.minIntervalUs is not None:
+                minIntervalUs = rule.minIntervalUs
+        return TopicFilter(include, keepEvery, minIntervalUs)
+
+    def shouldLog(self, topic, timestamp):
+        """
+        Returns True if the message on *topic* received at *timestamp*
+        (microseconds) should be logged.
+        """
+        f = self.topicFilters.get(topic, None)
+        if f is None:
+            f = self.getTopicFilter(topic)
+            if len(self.topicFilters) >= MAX_CACHED_TOPICS:
+                self.topicFilters.clear()
+            self.topicFilters[topic] = f
+
+        result = f.include
+        if result and f.keepEvery is not None:
+            result = (f.count % f.keepEvery == 0)
+            f.count += 1
+        if result and f.minIntervalUs is not None:
+            if f.lastLogged is not None and timestamp - f.lastLogged < f.minIntervalUs:
+                result = False
+            else:
+                f.lastLogged = timestamp
+
+        if result:
+            self.numLogged += 1
+        else:
+            self.numDropped += 1
+        return result
@@ -0,0 +1,88 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import unittest
+
+from geocamUtil.zmqUtil.prefixTrie import PrefixTrie
+from geocamUtil.zmqUtil.logFilter import LogFilter, parseRateSpec
+
+
+class PrefixTrieTest(unittest.TestCase):
+    def test_matches(self):
+        trie = PrefixTrie()
+        trie.add('dds', 1)
+        trie.add('dds.Raw', 2)
+        trie.add('gps', 3)
+        self.assertEqual(len(trie), 3)
+        self.assertEqual(list(trie.iterMatches('dds.Raw.CAM')),
+                         [('dds', 1), ('dds.Raw', 2)])
+        self.assertEqual(list(trie.iterMatches('dd')), [])
+        self.assertEqual(trie.getLongestMatch('dds.Raw.CAM'), 2)
+        self.assertEqual(trie.getLongestMatch('dds.Resolve'), 1)
+        self.assertEqual(trie.getLongestMatch('ddx', 'none'), 'none')
+
+        trie.add('', 0)
+        self.assertEqual(list(trie.iterMatches('gps.fix')), [('', 0), ('gps', 3)])
+
+    def test_remove(self):
+        trie = PrefixTrie()
+        trie.add('dds', 1)
+        trie.add('dds.Raw', 2)
+        trie.remove('dds.Raw')
+        self.assertEqual(trie.get('dds.Raw'), None)
+        self.assertEqual(trie.get('dds'), 1)
+        self.assertEqual(trie.root.keys(), ['d'])
+        self.assertRaises(KeyError, trie.remove, 'dds.Raw')
+        trie.remove('dds')
+        self.assertEqual(trie.root, {})
+        self.assertEqual(len(trie), 0)
+
+
+class LogFilterTest(unittest.TestCase):
+    def test_includeExclude(self):
+        f = LogFilter(exclude=['dds'], include=['dds.Resolve'])
+        self.assertTrue(f.shouldLog('dds.Resolve.CAM', 0))
+        self.assertFalse(f.shouldLog('dds.Raw.CAM', 0))
+        # with include rules, unmatched topics are dropped
+        self.assertFalse(f.shouldLog('gps.fix', 0))
+        self.assertEqual((f.numLogged, f.numDropped), (1, 2))
+
+        f = LogFilter(exclude=['dds.Raw'])
+        self.assertTrue(f.shouldLog('gps.fix', 0))
+        self.assertFalse(f.shouldLog('dds.Raw.CAM', 0))
+
+    def test_decimate(self):
+        f = LogFilter(decimate=[('dds', 3)], exclude=['dds.Raw'])
+        logged = [f.shouldLog('dds.Resolve.%d' % (i % 2), 0) for i in xrange(12)]
+        # each topic is decimated separately
+        self.assertEqual(logged.count(True), 4)
+        self.assertEqual(logged[:2], [True, True])
+        self.assertFalse(f.shouldLog('dds.Raw.CAM', 0))
+
+    def test_maxRate(self):
+        f = LogFilter(maxRate=[parseRateSpec('gps:2')])
+        logged = [f.shouldLog('gps.fix', i * 100000) for i in xrange(20)]
+        self.assertEqual(logged.count(True), 4)
+        self.assertTrue(f.shouldLog('imu', 0))
+
+    def test_parseRateSpec(self):
+        self.assertEqual(parseRateSpec('dds.Raw:10'), ('dds.Raw', 10.0))
+        self.assertRaises(ValueError, parseRateSpec, 'dds.Raw')
+        self.assertRaises(ValueError, parseRateSpec, 'dds.Raw:0')
+
+
+if __name__ == '__main__':
+    unittest.main()
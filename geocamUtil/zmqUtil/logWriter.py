@@ -0,0 +1,299 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import time
+import zlib
+import logging
+import datetime
+import threading
+
+from geocamUtil.zmqUtil.util import (DEFAULT_INDEX_EVERY_RECORDS,
+                                     DEFAULT_INDEX_EVERY_SECONDS,
+                                     RECORD_SENTINEL,
+                                     BLOCK_SENTINEL,
+                                     getIndexPath,
+                                     LogIndexWriter,
+                                     TopicIndex)
+
+DEFAULT_FLUSH_BYTES = 65536
+DEFAULT_FLUSH_MSECS = 200
+DEFAULT_BLOCK_BYTES = 256 * 1024
+DEFAULT_BLOCK_MSECS = 5000
+DEFAULT_COMPRESS_LEVEL = 6
+FSYNC_CHOICES = ('none', 'flush', 'rotate')
+US_PER_HOUR = 3600 * 1000000
+
+
+def getSegmentTimeText(dt):
+    return dt.strftime('%Y-%m-%d-%H-%M-%S')
+
+
+class LogWriter(object):
+    """
+    LogWriter writes message log records without blocking the caller on
+    disk I/O. Records passed to write() are buffered in memory and
+    written out in batches by a background thread, whenever
+    *flushBytes* bytes are pending or every *flushMsecs* milliseconds.
+
+    *fsync* controls when the log is forced to disk: 'none' leaves it
+    to the OS, 'flush' syncs after every batch, and 'rotate' syncs when
+    a segment is closed.
+
+    If *pathTemplate* contains '%s', the log is split into segments
+    named by their start time, and a 'latest' symlink points to the
+    current segment. A new segment is started when the current one
+    reaches *rotateBytes* bytes (if nonzero) or, if *rotateHourly* is
+    set, when the hour of the record timestamp changes.
+
+    If *compress* is set, records are grouped into zlib-compressed
+    blocks of about *blockBytes* bytes of raw data (see LogParser). A
+    block is also ended after *blockMsecs* milliseconds so that readers
+    of a live log don't fall too far behind, even if no more records
+    arrive. Each block can be decompressed on its own, so index entries
+    point at blocks, and size-based rotation happens between blocks.
+
+    Each segment gets a sidecar index (see LogReader) unless
+    *indexEveryRecords* is 0, along with a topic index (see TopicIndex)
+    that is written when the segment is closed.
+    """
+
+    def __init__(self, logDir, pathTemplate,
+                 flushBytes=DEFAULT_FLUSH_BYTES,
+                 flushMsecs=DEFAULT_FLUSH_MSECS,
+                 fsync='none',
+                 rotateBytes=0,
+                 rotateHourly=False,
+                 compress=False,
+                 compressLevel=DEFAULT_COMPRESS_LEVEL,
+                 blockBytes=DEFAULT_BLOCK_BYTES,
+                 blockMsecs=DEFAULT_BLOCK_MSECS,
+                 indexEveryRecords=DEFAULT_INDEX_EVERY_RECORDS,
+                 indexEverySeconds=DEFAULT_INDEX_EVERY_SECONDS):
+        if fsync not in FSYNC_CHOICES:
+            raise ValueError('fsync must be one of %s' % ', '.join(FSYNC_CHOICES))
+        if (rotateBytes or rotateHourly) and '%s' not in pathTemplate:
+            raise ValueError('log rotation requires "%%s" in log path template "%s"' % pathTemplate)
+        self.logDir = logDir
+        self.pathTemplate = pathTemplate
+        self.flushBytes = flushBytes
+        self.flushMsecs = flushMsecs
+        self.fsync = fsync
+        self.rotateBytes = rotateBytes
+        self.rotateHourly = rotateHourly
+        self.compress = compress
+        self.compressLevel = compressLevel
+        self.blockBytes = blockBytes
+        self.blockMsecs = blockMsecs
+        self.indexEveryRecords = indexEveryRecords
+        self.indexEverySeconds = indexEverySeconds
+
+        self.path = None
+        self.segmentFile = None
+        self.segmentOffset = 0
+        self.segmentHour = None
+        self.index = None
+        self.topicIndex = None
+
+        # record data not yet written to the segment. in compressed
+        # mode this is the current block.
+        self.chunks = []
+        self.chunkBytes = 0
+        self.chunkStartTimestamp = None
+        self.blockStartTime = None
+
+        self.cond = threading.Condition()
+        self.pending = []
+        self.pendingBytes = 0
+        self.stopping = False
+        self.thread = None
+
+    def start(self, timestamp):
+        if not os.path.exists(self.logDir):
+            os.makedirs(self.logDir)
+        self.openSegment(timestamp)
+        self.thread = threading.Thread(target=self.run, name='LogWriter')
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def write(self, timestamp, attachmentDir, msg):
+        """
+        Queues a record to be written. Safe to call from any thread.
+        """
+        with self.cond:
+            self.pending.append((timestamp, attachmentDir, msg))
+            self.pendingBytes += len(msg)
+            if self.pendingBytes >= self.flushBytes:
+                self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.stopping and self.pendingBytes < self.flushBytes:
+                    self.cond.wait(self.flushMsecs / 1000.0)
+                batch = self.pending
+                self.pending = []
+                self.pendingBytes = 0
+                stopping = self.stopping
+            if batch:
+                try:
+                    self.writeBatch(batch)
+                except:  # pylint: disable=W0702
+                    logging.exception('LogWriter: error writing %d records to %s',
+                                      len(batch), self.path)
+            elif self.isBlockStale():
+                # no new records, so writeBatch() won't end the block
+                try:
+                    self.writeChunks()
+                    self.flushSegment(self.fsync == 'flush')
+                except:  # pylint: disable=W0702
+                    logging.exception('LogWriter: error writing block to %s', self.path)
+            if stopping:
+                break
+
+    def writeBatch(self, batch):
+        for timestamp, attachmentDir, msg in batch:
+            header = '%s %d %d %s ' % (RECORD_SENTINEL, timestamp, len(msg), attachmentDir)
+            recordLength = len(header) + len(msg) + 1
+            if self.needsRotate(timestamp, recordLength):
+                self.rotate(timestamp)
+            if self.index:
+                # in compressed mode, segmentOffset is the start of the
+                # current block
+                self.index.add(timestamp, self.segmentOffset)
+            if self.topicIndex is not None:
+                self.topicIndex.add(msg[:msg.find(':')], timestamp)
+            if not self.chunks:
+                self.chunkStartTimestamp = timestamp
+                self.blockStartTime = time.time()
+            self.chunks.append(header)
+            self.chunks.append(msg)
+            self.chunks.append('\n')
+            self.chunkBytes += recordLength
+            if not self.compress:
+                self.segmentOffset += recordLength
+            elif self.chunkBytes >= self.blockBytes:
+                self.writeChunks()
+
+        if not self.compress or self.isBlockStale():
+            self.writeChunks()
+        self.flushSegment(self.fsync == 'flush')
+
+    def isBlockStale(self):
+        return (self.compress and self.chunks
+                and time.time() - self.blockStartTime >= self.blockMsecs / 1000.0)
+
+    def writeChunks(self):
+        if self.chunks:
+            data = ''.join(self.chunks)
+            if self.compress:
+                compressed = zlib.compress(data, self.compressLevel)
+                header = ('%s %d %d %d '
+                          % (BLOCK_SENTINEL, self.chunkStartTimestamp, len(compressed), len(data)))
+                data = ''.join((header, compressed, '\n'))
+                self.segmentOffset += len(data)
+            self.segmentFile.write(data)
+            self.chunks = []
+            self.chunkBytes = 0
+        self.blockStartTime = time.time()
+
+    def needsRotate(self, timestamp, recordLength):
+        if self.segmentOffset == 0 and not self.chunks:
+            return False
+        if self.rotateBytes:
+            if self.compress:
+                # the compressed size of the current block isn't known
+                # yet, so compressed segments are split between blocks
+                if self.segmentOffset >= self.rotateBytes:
+                    return True
+            elif self.segmentOffset + recordLength > self.rotateBytes:
+                return True
+        if self.rotateHourly and timestamp // US_PER_HOUR != self.segmentHour:
+            return True
+        return False
+
+    def getSegmentPath(self, timestamp):
+        if '%s' not in self.pathTemplate:
+            return os.path.join(self.logDir, self.pathTemplate)
+        timeText = getSegmentTimeText(datetime.datetime.utcfromtimestamp(timestamp / 1e6))
+        path = os.path.join(self.logDir, self.pathTemplate % timeText)
+        n = 1
+        while self.segmentFile is not None and os.path.exists(path):
+            # size-based rotation can start several segments per second.
+            # the suffix keeps segment names in time order when sorted.
+            path = os.path.join(self.logDir, self.pathTemplate % ('%s_%03d' % (timeText, n)))
+            n += 1
+        return path
+
+    def openSegment(self, timestamp):
+        self.path = self.getSegmentPath(timestamp)
+        self.segmentFile = open(self.path, 'a')
+        self.segmentOffset = os.path.getsize(self.path)
+        self.segmentHour = timestamp // US_PER_HOUR
+        self.blockStartTime = time.time()
+        if self.indexEveryRecords > 0:
+            self.index = LogIndexWriter(open(getIndexPath(self.path), 'a'),
+                                        self.indexEveryRecords,
+                                        self.indexEverySeconds)
+            if self.segmentOffset == 0:
+                self.topicIndex = TopicIndex()
+            else:
+                # appending to an existing segment. without an up-to-date
+                # topic index for it, we can't write a complete one.
+                self.topicIndex = TopicIndex.read(self.path)
+        if '%s' in self.pathTemplate:
+            latestPath = os.path.join(self.logDir, self.pathTemplate % 'latest')
+            tmpPath = latestPath + '.tmp'
+            if os.path.lexists(tmpPath):
+                os.unlink(tmpPath)
+            os.symlink(os.path.basename(self.path), tmpPath)
+            os.rename(tmpPath, latestPath)
+        logging.info('LogWriter: writing to %s', self.path)
+
+    def flushSegment(self, sync):
+        self.segmentFile.flush()
+        if self.index:
+            self.index.flush()
+        if sync:
+            os.fsync(self.segmentFile.fileno())
+
+    def closeSegment(self):
+        self.writeChunks()
+        self.flushSegment(self.fsync != 'none')
+        self.segmentFile.close()
+        if self.index:
+            self.index.close()
+            self.index = None
+        if self.topicIndex is not None:
+            self.topicIndex.write(self.path, os.path.getsize(self.path))
+            self.topicIndex = None
+
+    def rotate(self, timestamp):
+        self.closeSegment()
+        self.openSegment(timestamp)
+
+    def close(self):
+        """
+        Writes any pending records and closes the log.
+        """
+        if self.thread is None:
+            return
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join()
+        self.thread = None
+        self.closeSegment()
@@ -0,0 +1,127 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import glob
+import time
+import shutil
+import unittest
+import tempfile
+
+from geocamUtil.zmqUtil.util import LogParser, LogReader
+from geocamUtil.zmqUtil.logWriter import LogWriter, US_PER_HOUR
+
+START_TIMESTAMP = 1342170000000000
+TEMPLATE = 'messages-%s.txt'
+
+
+class LogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp('-logWriterTestDir')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def writeRecords(self, writer, timestamps):
+        writer.start(timestamps[0])
+        for i, timestamp in enumerate(timestamps):
+            writer.write(timestamp, '-', 'test.topic:{"i": %d}' % i)
+        writer.close()
+
+    def readAll(self):
+        result = []
+        for path in sorted(glob.glob(os.path.join(self.tempDir, 'messages-2*.txt'))):
+            result.append([rec.timestamp for rec in LogParser(open(path, 'rb'))])
+        return result
+
+    def test_single(self):
+        timestamps = [START_TIMESTAMP + i for i in xrange(1000)]
+        self.writeRecords(LogWriter(self.tempDir, TEMPLATE, flushBytes=100), timestamps)
+        self.assertEqual(self.readAll(), [timestamps])
+        latest = os.path.join(self.tempDir, TEMPLATE % 'latest')
+        reader = LogReader(latest)
+        self.assertEqual(len(list(reader.range(timestamps[10], timestamps[20]))), 10)
+        reader.close()
+
+    def test_rotateBytes(self):
+        timestamps = [START_TIMESTAMP + i for i in xrange(100)]
+        self.writeRecords(LogWriter(self.tempDir, TEMPLATE, rotateBytes=1000), timestamps)
+        segments = self.readAll()
+        self.assertTrue(len(segments) > 1)
+        self.assertEqual(sum(segments, []), timestamps)
+        for path in glob.glob(os.path.join(self.tempDir, 'messages-2*.txt')):
+            self.assertTrue(os.path.getsize(path) <= 1000)
+
+    def test_rotateHourly(self):
+        timestamps = [START_TIMESTAMP + i * US_PER_HOUR / 4 for i in xrange(10)]
+        self.writeRecords(LogWriter(self.tempDir, TEMPLATE, rotateHourly=True), timestamps)
+        segments = self.readAll()
+        self.assertEqual(sum(segments, []), timestamps)
+        for segment in segments:
+            self.assertEqual(len(set([t // US_PER_HOUR for t in segment])), 1)
+
+    def test_compress(self):
+        timestamps = [START_TIMESTAMP + i for i in xrange(1000)]
+        self.writeRecords(LogWriter(self.tempDir, TEMPLATE, compress=True, blockBytes=1000),
+                          timestamps)
+        self.assertEqual(self.readAll(), [timestamps])
+        latest = os.path.join(self.tempDir, TEMPLATE % 'latest')
+        reader = LogReader(latest)
+        self.assertEqual([rec.msg for rec in reader.range(timestamps[10], timestamps[20])],
+                         ['test.topic:{"i": %d}' % i for i in xrange(10, 20)])
+        reader.close()
+
+    def test_compressRotate(self):
+        timestamps = [START_TIMESTAMP + i for i in xrange(1000)]
+        self.writeRecords(LogWriter(self.tempDir, TEMPLATE, compress=True, blockBytes=1000,
+                                    rotateBytes=2000),
+                          timestamps)
+        segments = self.readAll()
+        self.assertTrue(len(segments) > 1)
+        self.assertEqual(sum(segments, []), timestamps)
+
+    def test_compressRotateHourly(self):
+        # all records fit in the first block
+        timestamps = [START_TIMESTAMP + i * US_PER_HOUR / 4 for i in xrange(10)]
+        self.writeRecords(LogWriter(self.tempDir, TEMPLATE, compress=True, rotateHourly=True),
+                          timestamps)
+        segments = self.readAll()
+        self.assertEqual(sum(segments, []), timestamps)
+        for segment in segments:
+            self.assertEqual(len(set([t // US_PER_HOUR for t in segment])), 1)
+
+    def test_compressIdle(self):
+        # a block is written after blockMsecs even if no more records
+        # arrive
+        writer = LogWriter(self.tempDir, TEMPLATE, flushMsecs=20, compress=True, blockMsecs=100)
+        writer.start(START_TIMESTAMP)
+        for i in xrange(5):
+            writer.write(START_TIMESTAMP + i, '-', 'test.topic:{"i": %d}' % i)
+        try:
+            deadline = time.time() + 5
+            while self.readAll() != [range(START_TIMESTAMP, START_TIMESTAMP + 5)]:
+                self.assertTrue(time.time() < deadline, 'block was not written')
+                time.sleep(0.05)
+        finally:
+            writer.close()
+
+    def test_rotateNeedsTemplate(self):
+        self.assertRaises(ValueError,
+                          lambda: LogWriter(self.tempDir, 'messages.txt', rotateHourly=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
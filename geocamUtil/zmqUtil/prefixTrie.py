@@ -0,0 +1,120 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+# key under which a trie node stores its value. node children are keyed
+# by single characters, so the empty string can't collide with them.
+VALUE_KEY = ''
+
+
+class PrefixTrie(object):
+    """
+    A character trie mapping string prefixes to values. Use it to find
+    all of the stored prefixes that match a string (such as a message
+    topic) in time proportional to the length of the string, no matter
+    how many prefixes are stored.
+
+    Example usage:
+
+    trie = PrefixTrie()
+    trie.add('dds', 1)
+    trie.add('dds.Raw', 2)
+    list(trie.iterMatches('dds.Raw.CAM'))  # [('dds', 1), ('dds.Raw', 2)]
+    trie.getLongestMatch('dds.Resolve')    # 1
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, prefix, value):
+        """
+        Stores *value* for *prefix*, replacing any previous value.
+        """
+        node = self.root
+        for c in prefix:
+            child = node.get(c, None)
+            if child is None:
+                child = {}
+                node[c] = child
+            node = child
+        if VALUE_KEY not in node:
+            self.size += 1
+        node[VALUE_KEY] = value
+
+    def get(self, prefix, default=None):
+        """
+        Returns the value stored for exactly *prefix*.
+        """
+        node = self.root
+        for c in prefix:
+            node = node.get(c, None)
+            if node is None:
+                return default
+        return node.get(VALUE_KEY, default)
+
+    def remove(self, prefix):
+        """
+        Removes the value stored for *prefix*. Raises KeyError if there
+        is none.
+        """
+        path = [self.root]
+        for c in prefix:
+            node = path[-1].get(c, None)
+            if node is None:
+                raise KeyError(prefix)
+            path.append(node)
+        del path[-1][VALUE_KEY]  # raises KeyError if there is no value
+        self.size -= 1
+
+        # prune nodes that no longer lead to a value
+        for i in xrange(len(prefix), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][prefix[i - 1]]
+
+    def iterMatches(self, key):
+        """
+        Yields (prefix, value) for each stored prefix of *key*, shortest
+        prefix first.
+        """
+        node = self.root
+        if VALUE_KEY in node:
+            yield '', node[VALUE_KEY]
+        i = 0
+        for c in key:
+            node = node.get(c, None)
+            if node is None:
+                return
+            i += 1
+            if VALUE_KEY in node:
+                yield key[:i], node[VALUE_KEY]
+
+    def getLongestMatch(self, key, default=None):
+        """
+        Returns the value stored for the longest stored prefix of *key*.
+        """
+        result = default
+        node = self.root
+        for c in key:
+            if VALUE_KEY in node:
+                result = node[VALUE_KEY]
+            node = node.get(c, None)
+            if node is None:
+                return result
+        return node.get(VALUE_KEY, result)
@@ -20,18 +20,28 @@
 
 import logging
 import re
+import datetime
+import itertools
+from collections import OrderedDict
 
 import zmq
 from zmq.eventloop.zmqstream import ZMQStream
 from zmq.eventloop import ioloop
 
 from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
 
 from geocamUtil import anyjson as json
 from geocamUtil.zmqUtil.util import (getTimestamp,
                                      parseEndpoint,
                                      getShortHostName,
-                                     DEFAULT_CENTRAL_SUBSCRIBE_PORT)
+                                     formatMultipartMessage,
+                                     DEFAULT_CENTRAL_SUBSCRIBE_PORT,
+                                     DEFAULT_HIGH_WATER_MARK)
+from geocamUtil.zmqUtil.prefixTrie import PrefixTrie
+from geocamUtil.zmqUtil.logFilter import parseRateSpec
+from geocamUtil.zmqUtil.delayBox import DelayBox
+from geocamUtil.zmqUtil.codec import getCodec, encodeBody, encodeJsonBody
 
 PUBLISHER_OPT_DEFAULTS = {'centralHost': '127.0.0.1',
                           'moduleName': None,
@@ -39,9 +49,23 @@ PUBLISHER_OPT_DEFAULTS = {'centralHost': '127.0.0.1',
                           % DEFAULT_CENTRAL_SUBSCRIBE_PORT,
                           'publishEndpoint': 'tcp://127.0.0.1:random',
                           'heartbeatPeriodMsecs': 5000,
-                          # 'highWaterMark': 100
+                          'highWaterMark': DEFAULT_HIGH_WATER_MARK,
+                          'batchMsecs': 0,
+                          'batchMessages': 1000,
+                          'batchBytes': 65536,
+                          'conflate': None,
+                          'codec': None,
+                          'djangoCacheSize': 0
                           }
 
+# DelayBox wakes up numBuckets times per conflation interval. don't
+# wake up more often than this.
+MIN_CONFLATE_WAKEUP_MSECS = 20
+MAX_CACHED_TOPICS = 10000
+
+# sendDjangoMany() serializes and sends model instances in chunks
+DJANGO_CHUNK_SIZE = 500
+
 
 class ZmqPublisher(object):
     def __init__(self,
@@ -51,7 +75,14 @@ class ZmqPublisher(object):
                  centralSubscribeEndpoint=PUBLISHER_OPT_DEFAULTS['centralSubscribeEndpoint'],
                  publishEndpoint=PUBLISHER_OPT_DEFAULTS['publishEndpoint'],
                  heartbeatPeriodMsecs=PUBLISHER_OPT_DEFAULTS['heartbeatPeriodMsecs'],
-                 # highWaterMark=PUBLISHER_OPT_DEFAULTS['highWaterMark']
+                 highWaterMark=PUBLISHER_OPT_DEFAULTS['highWaterMark'],
+                 batchMsecs=PUBLISHER_OPT_DEFAULTS['batchMsecs'],
+                 batchMessages=PUBLISHER_OPT_DEFAULTS['batchMessages'],
+                 batchBytes=PUBLISHER_OPT_DEFAULTS['batchBytes'],
+                 conflate=PUBLISHER_OPT_DEFAULTS['conflate'],
+                 codec=PUBLISHER_OPT_DEFAULTS['codec'],
+                 djangoCacheSize=PUBLISHER_OPT_DEFAULTS['djangoCacheSize'],
+                 djangoModifiedField='modified'
                  ):
         self.moduleName = moduleName
         self.centralHost = centralHost
@@ -66,12 +97,51 @@ class ZmqPublisher(object):
         self.publishEndpoint = parseEndpoint(publishEndpoint,
                                              defaultPort='random')
         self.heartbeatPeriodMsecs = heartbeatPeriodMsecs
-        #self.highWaterMark = highWaterMark
+        self.highWaterMark = highWaterMark
+
+        # batched mode: if batchMsecs is nonzero, messages are queued
+        # and sent together when batchMessages messages or batchBytes
+        # bytes are pending, or batchMsecs after the first one.
+        self.batchMsecs = batchMsecs
+        self.batchMessages = batchMessages
+        self.batchBytes = batchBytes
+        self.pending = []
+        self.pendingBytes = 0
+        self.flushTimeout = None
 
         self.pubStream = None
         self.heartbeatTimer = None
+        self.heartbeatFields = {}
+
+        # next sequence number for each topic: see getNextSeq()
+        self.seqNumbers = {}
+
+        # conflation: see conflate()
+        self.conflateRules = PrefixTrie()
+        self.conflateBoxes = {}
+        self.topicConflateBoxes = {}
+        self.conflatedBodies = {}
+        for spec in conflate or []:
+            topicPrefix, intervalMsecs = parseRateSpec(spec)
+            self.conflate(topicPrefix, intervalMsecs)
+
+        # codecs for sendJson(): see setCodec()
+        self.codecRules = PrefixTrie()
+        self.topicCodecs = {}
+        for spec in codec or []:
+            try:
+                topicPrefix, codecName = spec.rsplit(':', 1)
+            except ValueError:
+                raise ValueError('"%s" is not in the format "<topicPrefix>:<codec>"' % spec)
+            self.setCodec(topicPrefix, codecName)
 
-        self.serializer = serializers.get_serializer('json')()
+        self.serializer = serializers.get_serializer('python')()
+        self.djangoEncoder = DjangoJSONEncoder()
+
+        # cache of serialized model instances: see sendDjangoMany()
+        self.djangoCacheSize = djangoCacheSize
+        self.djangoModifiedField = djangoModifiedField
+        self.djangoCache = OrderedDict()
 
     @classmethod
     def addOptions(cls, parser, defaultModuleName):
@@ -96,11 +166,39 @@ class ZmqPublisher(object):
                               default=PUBLISHER_OPT_DEFAULTS['heartbeatPeriodMsecs'],
                               type='int',
                               help='Period for sending heartbeats to central [%default]')
-        #if not parser.has_option('--highWaterMark'):
-        #    parser.add_option('--highWaterMark',
-        #                      default=PUBLISHER_OPT_DEFAULTS['highWaterMark'],
-        #                      type='int',
-        #                      help='High-water mark for publish socket (see 0MQ docs) [%default]')
+        if not parser.has_option('--highWaterMark'):
+            parser.add_option('--highWaterMark',
+                              default=PUBLISHER_OPT_DEFAULTS['highWaterMark'],
+                              type='int',
+                              help='High-water mark for publish and subscribe sockets (see 0MQ docs) [%default]')
+        if not parser.has_option('--batchMsecs'):
+            parser.add_option('--batchMsecs',
+                              default=PUBLISHER_OPT_DEFAULTS['batchMsecs'],
+                              type='int',
+                              help='Batch outgoing messages, sending each batch within N msecs, or 0 to send immediately [%default]')
+        if not parser.has_option('--batchMessages'):
+            parser.add_option('--batchMessages',
+                              default=PUBLISHER_OPT_DEFAULTS['batchMessages'],
+                              type='int',
+                              help='With --batchMsecs, send a batch once N messages are pending [%default]')
+        if not parser.has_option('--batchBytes'):
+            parser.add_option('--batchBytes',
+                              default=PUBLISHER_OPT_DEFAULTS['batchBytes'],
+                              type='int',
+                              help='With --batchMsecs, send a batch once N bytes are pending [%default]')
+        if not parser.has_option('--codec'):
+            parser.add_option('--codec',
+                              action='append',
+                              help='Encode sendJson() messages on topics matching a prefix with a compact codec such as msgpack (format "<topicPrefix>:<codec>"; can specify multiple times)')
+        if not parser.has_option('--djangoCacheSize'):
+            parser.add_option('--djangoCacheSize',
+                              default=PUBLISHER_OPT_DEFAULTS['djangoCacheSize'],
+                              type='int',
+                              help='Number of serialized Django model instances to cache, or 0 to disable [%default]')
+        if not parser.has_option('--conflate'):
+            parser.add_option('--conflate',
+                              action='append',
+                              help='Send only the latest message on each topic matching a prefix, at most once per N msecs (format "<topicPrefix>:<N>"; can specify multiple times)')
 
     @classmethod
     def getOptionValues(cls, opts):
@@ -111,36 +209,303 @@ class ZmqPublisher(object):
                 result[key] = val
         return result
 
+    def addHeartbeatField(self, name, getValue):
+        """
+        Adds field *name* to heartbeats, with the value returned by
+        calling *getValue*. zmqCentral reports heartbeat fields through
+        its 'info' RPC method. For example,
+        addHeartbeatField('subscriber', subscriber.getStats) lets
+        zmqCentral detect when this module's subscriber falls behind.
+        """
+        self.heartbeatFields[name] = getValue
+
     def heartbeat(self):
         logging.debug('ZmqPublisher: heartbeat')
-        self.sendJson('central.heartbeat.%s' % self.moduleName,
-                      {'host': getShortHostName(),
-                       'pub': self.publishEndpoint})
+        params = {'host': getShortHostName(),
+                  'pub': self.publishEndpoint}
+        for name, getValue in self.heartbeatFields.iteritems():
+            params[name] = getValue()
+        self.sendJson('central.heartbeat.%s' % self.moduleName, params)
 
-    def sendRaw(self, topic, body):
-        self.pubStream.send('%s:%s' % (topic, body))
+    def queueMessage(self, msg, size):
+        self.pending.append(msg)
+        self.pendingBytes += size
+        if not self.batchMsecs:
+            return
+        if len(self.pending) >= self.batchMessages or self.pendingBytes >= self.batchBytes:
+            self.sendPending()
+        elif self.flushTimeout is None:
+            self.flushTimeout = (ioloop.IOLoop.instance()
+                                 .add_timeout(datetime.timedelta(milliseconds=self.batchMsecs),
+                                              self.sendPending))
+
+    def flush(self):
+        """
+        Sends any messages queued in batched mode, along with the latest
+        pending body of each conflated topic (see conflate()). Call this
+        before exiting so queued messages aren't lost.
+        """
+        if self.conflatedBodies:
+            # the DelayBox jobs for these topics find nothing to send
+            conflatedBodies = self.conflatedBodies
+            self.conflatedBodies = {}
+            for topic, body in conflatedBodies.iteritems():
+                msg = '%s:%s' % (topic, body)
+                self.pending.append(msg)
+                self.pendingBytes += len(msg)
+        self.sendPending()
+
+    def sendPending(self):
+        if self.flushTimeout is not None:
+            ioloop.IOLoop.instance().remove_timeout(self.flushTimeout)
+            self.flushTimeout = None
+        if not self.pending:
+            return
+        # send directly on the socket; a PUB socket never blocks, so
+        # going through the ZMQStream send queue would only add an
+        # ioloop round trip per message
         self.pubStream.flush()
+        sock = self.pubStream.socket
+        for msg in self.pending:
+            if isinstance(msg, list):
+                sock.send_multipart(msg, copy=False)
+            else:
+                sock.send(msg)
+        self.pending = []
+        self.pendingBytes = 0
+
+    def conflate(self, topicPrefix, intervalMsecs):
+        """
+        Conflates messages on topics starting with *topicPrefix*: for
+        each topic, only the latest body passed to sendRaw() (or
+        sendJson() etc.) is kept, and it is sent at most once every
+        *intervalMsecs*. Use this for state topics where only the newest
+        value matters. Messages may be delayed by up to *intervalMsecs*.
+
+        Pending messages are sent by a DelayBox per interval, which
+        spreads topics across its buckets and flushes each bucket once
+        per interval.
+        """
+        intervalMsecs = int(intervalMsecs)
+        box = self.conflateBoxes.get(intervalMsecs, None)
+        if box is None:
+            numBuckets = max(1, min(50, intervalMsecs // MIN_CONFLATE_WAKEUP_MSECS))
+            box = DelayBox(self.sendConflated,
+                           maxDelaySeconds=intervalMsecs / 1000.0,
+                           numBuckets=numBuckets)
+            self.conflateBoxes[intervalMsecs] = box
+            if self.pubStream is not None:
+                box.start()
+        self.conflateRules.add(topicPrefix, box)
+        self.topicConflateBoxes.clear()
+
+    def getConflateBox(self, topic):
+        try:
+            return self.topicConflateBoxes[topic]
+        except KeyError:
+            box = self.conflateRules.getLongestMatch(topic)
+            if len(self.topicConflateBoxes) >= MAX_CACHED_TOPICS:
+                self.topicConflateBoxes.clear()
+            self.topicConflateBoxes[topic] = box
+            return box
+
+    def sendConflated(self, topic):
+        body = self.conflatedBodies.pop(topic, None)
+        if body is not None:
+            self.sendRawNow(topic, body)
+
+    def sendRaw(self, topic, body):
+        if self.conflateBoxes:
+            box = self.getConflateBox(topic)
+            if box is not None:
+                self.conflatedBodies[topic] = body
+                box.addJob(topic)
+                return
+        self.sendRawNow(topic, body)
+
+    def sendRawNow(self, topic, body):
+        msg = '%s:%s' % (topic, body)
+        if self.batchMsecs:
+            self.queueMessage(msg, len(msg))
+        else:
+            self.pubStream.send(msg)
+            self.pubStream.flush()
+
+    def sendMany(self, topic, bodies):
+        """
+        Sends a message on *topic* for each of *bodies*. Unlike calling
+        sendRaw() in a loop, all the messages are sent in one pass even
+        if batched mode is off.
+        """
+        for body in bodies:
+            self.queueRaw(topic, body)
+        if not self.batchMsecs:
+            self.sendPending()
+
+    def queueRaw(self, topic, body):
+        if self.conflateBoxes and self.getConflateBox(topic) is not None:
+            self.sendRaw(topic, body)
+        else:
+            msg = '%s:%s' % (topic, body)
+            self.queueMessage(msg, len(msg))
+
+    def sendMultipart(self, topic, body, attachments=None):
+        """
+        Sends a message in the multipart wire format (see
+        formatMultipartMessage()). This avoids MIME-encoding the
+        attachments, and zmqCentral can handle the message without
+        copying them. *attachments* is a list of dicts with 'filename',
+        'contentType' and 'data' fields.
+        """
+        frames = formatMultipartMessage(topic, body, attachments)
+        if self.batchMsecs:
+            self.queueMessage(frames, sum([len(frame) for frame in frames]))
+        else:
+            self.pubStream.send_multipart(frames, copy=False)
+            self.pubStream.flush()
+
+    def setCodec(self, topicPrefix, codecName):
+        """
+        Makes sendJson() encode messages on topics starting with
+        *topicPrefix* using the codec named *codecName* (see codec.py).
+        The body is marked with the codec, and ZmqSubscriber.subscribeJson()
+        decodes any codec, so subscribers need no configuration.
+        """
+        self.codecRules.add(topicPrefix, getCodec(codecName))
+        self.topicCodecs.clear()
+
+    def getTopicCodec(self, topic):
+        try:
+            return self.topicCodecs[topic]
+        except KeyError:
+            codec = self.codecRules.getLongestMatch(topic)
+            if len(self.topicCodecs) >= MAX_CACHED_TOPICS:
+                self.topicCodecs.clear()
+            self.topicCodecs[topic] = codec
+            return codec
+
+    def getNextSeq(self, topic):
+        """
+        Returns the next sequence number for *topic*, or None if the
+        topic is conflated (see conflate()), since conflation skips
+        messages on purpose.
+        """
+        if self.conflateBoxes and self.getConflateBox(topic) is not None:
+            return None
+        seq = self.seqNumbers.get(topic, 0)
+        self.seqNumbers[topic] = seq + 1
+        return seq
 
     def sendJson(self, topic, obj):
         if isinstance(obj, dict):
             obj.setdefault('module', self.moduleName)
             obj.setdefault('timestamp', str(getTimestamp()))
-        self.sendRaw(topic, json.dumps(obj))
+            if 'seq' not in obj:
+                seq = self.getNextSeq(topic)
+                if seq is not None:
+                    # stamp a copy, so that a dict reused across sends
+                    # gets a new seq each time
+                    obj = dict(obj, seq=seq)
+        if self.codecRules:
+            self.sendRaw(topic, encodeBody(obj, self.getTopicCodec(topic)))
+        else:
+            self.sendRaw(topic, encodeJsonBody(obj))
 
     def sendDjango(self, modelInstance, topic=None, topicSuffix=None):
-        dataText = self.serializer.serialize([modelInstance])
-        data = json.loads(dataText)[0]
-        if topic is None:
-            topic = data['model'].encode('utf-8')
-            if topicSuffix is not None:
-                topic += topicSuffix
-        self.sendJson(topic, {'data': data})
+        self.sendDjangoMany([modelInstance], topic, topicSuffix)
+
+    def sendDjangoMany(self, modelInstances, topic=None, topicSuffix=None):
+        """
+        Sends a message for each of *modelInstances*, which can be a
+        queryset or any iterable, as sendDjango() does. Instances are
+        serialized and sent in chunks, and querysets are read with
+        iterator(), so memory use stays bounded for large querysets.
+
+        If the publisher has a nonzero *djangoCacheSize*, the serialized
+        form of each instance is cached, keyed by its model, pk and the
+        value of its *djangoModifiedField* field. Instances without
+        that field are not cached.
+        """
+        if hasattr(modelInstances, 'iterator'):
+            modelInstances = modelInstances.iterator()
+        instanceIter = iter(modelInstances)
+        while True:
+            chunk = list(itertools.islice(instanceIter, DJANGO_CHUNK_SIZE))
+            if not chunk:
+                break
+            for modelInstance, dataText in zip(chunk, self.serializeDjango(chunk)):
+                instanceTopic = topic
+                if instanceTopic is None:
+                    instanceTopic = str(modelInstance._meta.label_lower)
+                    if topicSuffix is not None:
+                        instanceTopic += topicSuffix
+                self.queueRaw(instanceTopic, self.getDjangoBody(instanceTopic, dataText))
+            if not self.batchMsecs:
+                self.sendPending()
+
+    def getDjangoCacheKey(self, modelInstance):
+        modified = getattr(modelInstance, self.djangoModifiedField, None)
+        if modified is None:
+            return None
+        return (modelInstance._meta.label_lower, modelInstance.pk, modified)
+
+    def serializeDjango(self, modelInstances):
+        """
+        Returns the JSON text of the serialized form of each of
+        *modelInstances*, using the cache where possible.
+        """
+        result = [None] * len(modelInstances)
+        keys = [None] * len(modelInstances)
+        misses = []
+        for i, modelInstance in enumerate(modelInstances):
+            if self.djangoCacheSize:
+                key = self.getDjangoCacheKey(modelInstance)
+                keys[i] = key
+                dataText = self.djangoCache.pop(key, None)
+                if dataText is not None:
+                    # re-insert to mark as most recently used
+                    self.djangoCache[key] = dataText
+                    result[i] = dataText
+                    continue
+            misses.append(i)
+
+        if misses:
+            # the python serializer produces dicts directly, so each
+            # instance is encoded to JSON only once
+            serialized = self.serializer.serialize([modelInstances[i] for i in misses])
+            for i, data in zip(misses, serialized):
+                dataText = self.djangoEncoder.encode(data)
+                result[i] = dataText
+                if keys[i] is not None:
+                    self.djangoCache[keys[i]] = dataText
+                    if len(self.djangoCache) > self.djangoCacheSize:
+                        self.djangoCache.popitem(last=False)
+        return result
+
+    def getDjangoBody(self, topic, dataText):
+        codec = self.getTopicCodec(topic) if self.codecRules else None
+        seq = self.getNextSeq(topic)
+        if codec is None or codec.codecId is None:
+            # splice in the serialized data rather than re-encoding it.
+            # the envelope fields come first, as in encodeJsonBody().
+            if seq is None:
+                seqText = ''
+            else:
+                seqText = '"seq": %d, ' % seq
+            return ('{%s"module": %s, "timestamp": "%s", "data": %s}'
+                    % (seqText, json.dumps(self.moduleName), getTimestamp(), dataText))
+        obj = {'data': json.loads(dataText),
+               'module': self.moduleName,
+               'timestamp': str(getTimestamp())}
+        if seq is not None:
+            obj['seq'] = seq
+        return encodeBody(obj, codec)
 
     def start(self):
         pubSocket = self.context.socket(zmq.PUB)
         self.pubStream = ZMQStream(pubSocket)
         # self.pubStream.setsockopt(zmq.IDENTITY, self.moduleName)
-        # self.pubStream.setsockopt(zmq.HWM, self.highWaterMark)
+        self.pubStream.setsockopt(zmq.SNDHWM, self.highWaterMark)
         self.pubStream.connect(self.centralSubscribeEndpoint)
         logging.info('zmq.publisher: connected to central at %s', self.centralSubscribeEndpoint)
 
@@ -155,3 +520,6 @@ class ZmqPublisher(object):
                                                       self.heartbeatPeriodMsecs)
         self.heartbeatTimer.start()
         self.heartbeat()
+
+        for box in self.conflateBoxes.itervalues():
+            box.start()
@@ -0,0 +1,163 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import unittest
+
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+
+from geocamUtil import anyjson as json
+from geocamUtil.zmqUtil import codec
+from geocamUtil.zmqUtil.codec import decodeBody
+from geocamUtil.zmqUtil.publisher import ZmqPublisher
+
+TEST_ENDPOINT = 'inproc://publisherTest'
+
+
+class PublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.sub = self.context.socket(zmq.SUB)
+        self.sub.setsockopt(zmq.SUBSCRIBE, '')
+        self.sub.bind(TEST_ENDPOINT)
+        self.publisher = None
+
+    def tearDown(self):
+        if self.publisher:
+            self.publisher.pubStream.close()
+        self.sub.close(linger=0)
+        self.context.term()
+
+    def getPublisher(self, **kwargs):
+        publisher = ZmqPublisher('publisherTest', context=self.context, **kwargs)
+        sock = self.context.socket(zmq.PUB)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(TEST_ENDPOINT)
+        # messages sent before the subscription reaches the PUB socket
+        # are dropped, so wait for a probe message to get through
+        while True:
+            sock.send('probe:')
+            if self.sub.poll(10):
+                break
+        self.receiveAll()
+        publisher.pubStream = ZMQStream(sock)
+        self.publisher = publisher
+        return publisher
+
+    def receiveAll(self):
+        result = []
+        while self.sub.poll(100):
+            result.append(self.sub.recv_multipart())
+        return result
+
+    def test_batched(self):
+        publisher = self.getPublisher(batchMsecs=10000, batchMessages=3)
+        publisher.sendRaw('a', '1')
+        publisher.sendMultipart('b', '2')
+        self.assertEqual(self.receiveAll(), [])
+        publisher.sendRaw('a', '3')
+        self.assertEqual(self.receiveAll(), [['a:1'], ['b:', '2'], ['a:3']])
+
+        publisher.sendRaw('a', '4')
+        publisher.flush()
+        self.assertEqual(self.receiveAll(), [['a:4']])
+        self.assertEqual(publisher.flushTimeout, None)
+
+    def test_sendMany(self):
+        publisher = self.getPublisher()
+        publisher.sendMany('a', ['1', '2', '3'])
+        self.assertEqual(self.receiveAll(), [['a:1'], ['a:2'], ['a:3']])
+
+    def test_conflate(self):
+        publisher = self.getPublisher(conflate=['state.:1000'])
+        publisher.sendRaw('state.a', '1')
+        publisher.sendRaw('state.b', '2')
+        publisher.sendMany('state.a', ['3', '4'])
+        publisher.sendRaw('event.c', '5')
+        self.assertEqual(self.receiveAll(), [['event.c:5']])
+
+        publisher.conflateBoxes[1000].sync()
+        self.assertEqual(sorted(self.receiveAll()), [['state.a:4'], ['state.b:2']])
+        publisher.conflateBoxes[1000].sync()
+        self.assertEqual(self.receiveAll(), [])
+
+        # flush() sends pending conflated bodies right away
+        publisher.sendRaw('state.a', '6')
+        publisher.flush()
+        self.assertEqual(self.receiveAll(), [['state.a:6']])
+        publisher.conflateBoxes[1000].sync()
+        self.assertEqual(self.receiveAll(), [])
+
+    @unittest.skipIf(codec.msgpack is None, 'msgpack module not installed')
+    def test_codec(self):
+        publisher = self.getPublisher(codec=['pos.:msgpack'])
+        publisher.sendJson('pos.a', {'x': 1})
+        publisher.sendJson('status.b', {'x': 2})
+        (posMsg,), (statusMsg,) = self.receiveAll()
+        self.assertTrue(posMsg.startswith('pos.a:\x00m'))
+        self.assertTrue(statusMsg.startswith('status.b:{'))
+        self.assertEqual(decodeBody(posMsg.split(':', 1)[1])['x'], 1)
+
+    def test_sendDjangoMany(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        # use the 'model' field as the modification key, since
+        # ContentType has no modification timestamp
+        publisher = self.getPublisher(djangoCacheSize=1, djangoModifiedField='model')
+        instances = [ContentType(pk=i, app_label='a', model='m%d' % i) for i in xrange(3)]
+        publisher.sendDjangoMany(instances, topicSuffix='.new')
+        messages = [msg for (msg,) in self.receiveAll()]
+        self.assertEqual(len(messages), 3)
+        topic, body = messages[2].split(':', 1)
+        self.assertEqual(topic, 'contenttypes.contenttype.new')
+        obj = json.loads(body)
+        self.assertEqual(obj['module'], 'publisherTest')
+        self.assertEqual(obj['data'], {'model': 'contenttypes.contenttype',
+                                       'pk': 2,
+                                       'fields': {'app_label': 'a', 'model': 'm2'}})
+        self.assertEqual(publisher.djangoCache.keys(),
+                         [('contenttypes.contenttype', 2, 'm2')])
+
+        # changing the modification key invalidates the cached form
+        instances[2].app_label = 'b'
+        publisher.sendDjango(instances[2])
+        ((msg,),) = self.receiveAll()
+        self.assertEqual(json.loads(msg.split(':', 1)[1])['data']['fields']['app_label'], 'a')
+        instances[2].model = 'm2x'
+        publisher.sendDjango(instances[2])
+        ((msg,),) = self.receiveAll()
+        self.assertEqual(json.loads(msg.split(':', 1)[1])['data']['fields']['app_label'], 'b')
+
+    def test_seq(self):
+        publisher = self.getPublisher(conflate=['state.:1000'])
+        for topic in ('a', 'a', 'b', 'a', 'state.x'):
+            publisher.sendJson(topic, {})
+        publisher.conflateBoxes[1000].sync()
+        seqs = [(msg.split(':', 1)[0], json.loads(msg.split(':', 1)[1]).get('seq', None))
+                for (msg,) in self.receiveAll()]
+        self.assertEqual(seqs, [('a', 0), ('a', 1), ('b', 0), ('a', 2), ('state.x', None)])
+
+        # a dict reused across sends gets a new seq each time
+        obj = {'x': 1}
+        for _i in xrange(3):
+            publisher.sendJson('c', obj)
+        self.assertEqual([json.loads(msg.split(':', 1)[1])['seq'] for (msg,) in self.receiveAll()],
+                         [0, 1, 2])
+        self.assertTrue('seq' not in obj)
+
+
+if __name__ == '__main__':
+    unittest.main()
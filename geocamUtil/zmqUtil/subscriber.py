@@ -18,20 +18,38 @@
 
 import logging
 import sys
+import time
 import zmq
 from zmq.eventloop.zmqstream import ZMQStream
 
 from django.core import serializers
 
-from geocamUtil import anyjson as json
-from geocamUtil.zmqUtil.util import parseEndpoint, DEFAULT_CENTRAL_PUBLISH_PORT, LogParser
-from geocamUtil.models.ExtrasDotField import convertToDotDictRecurse
+from geocamUtil.zmqUtil.util import (parseEndpoint,
+                                     DEFAULT_CENTRAL_PUBLISH_PORT,
+                                     LogParser,
+                                     mergeLogRecords,
+                                     LoadMeter,
+                                     hasBacklog,
+                                     joinMultipartMessage,
+                                     DEFAULT_HIGH_WATER_MARK)
+from geocamUtil.zmqUtil.attachmentStore import getLogAttachmentStore
+from geocamUtil.zmqUtil.codec import decodeBody, getEnvelopeFields
+from geocamUtil.zmqUtil.prefixTrie import PrefixTrie
+from geocamUtil.zmqUtil.handlerPool import (HandlerPool,
+                                            DEFAULT_HANDLER_THREADS,
+                                            DEFAULT_HANDLER_QUEUE_SIZE)
+from geocamUtil.dotDict import convertToDotDictLazy
+
+MAX_CACHED_TOPICS = 10000
 
 SUBSCRIBER_OPT_DEFAULTS = {'centralHost': '127.0.0.1',
                            'moduleName': None,
                            'centralPublishEndpoint': 'tcp://{centralHost}:%d'
                            % DEFAULT_CENTRAL_PUBLISH_PORT,
-                           'replay': None}
+                           'replay': None,
+                           'highWaterMark': DEFAULT_HIGH_WATER_MARK,
+                           'handlerThreads': DEFAULT_HANDLER_THREADS,
+                           'handlerQueueSize': DEFAULT_HANDLER_QUEUE_SIZE}
 
 
 class ZmqSubscriber(object):
@@ -40,7 +58,12 @@ class ZmqSubscriber(object):
                  centralHost=SUBSCRIBER_OPT_DEFAULTS['centralHost'],
                  context=None,
                  centralPublishEndpoint=SUBSCRIBER_OPT_DEFAULTS['centralPublishEndpoint'],
-                 replay=None):
+                 replay=None,
+                 highWaterMark=SUBSCRIBER_OPT_DEFAULTS['highWaterMark'],
+                 trackSequence=True,
+                 gapCallback=None,
+                 handlerThreads=SUBSCRIBER_OPT_DEFAULTS['handlerThreads'],
+                 handlerQueueSize=SUBSCRIBER_OPT_DEFAULTS['handlerQueueSize']):
         self.moduleName = moduleName
         self.centralHost = centralHost
 
@@ -55,10 +78,34 @@ class ZmqSubscriber(object):
         if self.replayPaths is None:
             self.replayPaths = []
 
+        self.highWaterMark = highWaterMark
+
+        # topicPrefix -> {handlerIndex: handler}. the registries are
+        # also indexed by prefix in handlerTrie, and the registries
+        # matching each topic seen are cached in topicRegistries.
         self.handlers = {}
+        self.handlerTrie = PrefixTrie()
+        self.topicRegistries = {}
         self.counter = 0
-        self.deserializer = serializers.get_deserializer('json')
+        self.deserializer = serializers.get_deserializer('python')
+        # decoded forms of the message being routed, see getDecoded()
+        self.deliveryCache = None
         self.stream = None
+        self.loadMeter = LoadMeter()
+
+        # gap detection: see checkSequence()
+        self.trackSequence = trackSequence
+        self.gapCallback = gapCallback
+        self.lastSeq = {}
+        self.numLost = 0
+        self.numGaps = 0
+        self.numResets = 0
+
+        # worker threads for handlers subscribed with threaded=True,
+        # started on first use. see wrapHandler().
+        self.handlerThreads = handlerThreads
+        self.handlerQueueSize = handlerQueueSize
+        self.handlerPool = None
 
     @classmethod
     def addOptions(cls, parser, defaultModuleName):
@@ -78,6 +125,21 @@ class ZmqSubscriber(object):
             parser.add_option('--replay',
                               action='append',
                               help='Replay specified message log (can specify multiple times), or use - to read from stdin')
+        if not parser.has_option('--highWaterMark'):
+            parser.add_option('--highWaterMark',
+                              default=SUBSCRIBER_OPT_DEFAULTS['highWaterMark'],
+                              type='int',
+                              help='High-water mark for publish and subscribe sockets (see 0MQ docs) [%default]')
+        if not parser.has_option('--handlerThreads'):
+            parser.add_option('--handlerThreads',
+                              default=SUBSCRIBER_OPT_DEFAULTS['handlerThreads'],
+                              type='int',
+                              help='Number of threads for handlers subscribed with threaded=True [%default]')
+        if not parser.has_option('--handlerQueueSize'):
+            parser.add_option('--handlerQueueSize',
+                              default=SUBSCRIBER_OPT_DEFAULTS['handlerQueueSize'],
+                              type='int',
+                              help='Max queued messages per handler thread before the subscriber blocks [%default]')
 
     @classmethod
     def getOptionValues(cls, opts):
@@ -90,6 +152,7 @@ class ZmqSubscriber(object):
 
     def start(self):
         sock = self.context.socket(zmq.SUB)
+        sock.setsockopt(zmq.RCVHWM, self.highWaterMark)
         self.stream = ZMQStream(sock)
         # causes problems with multiple instances
         #self.stream.setsockopt(zmq.IDENTITY, self.moduleName)
@@ -98,44 +161,191 @@ class ZmqSubscriber(object):
         self.stream.on_recv(self.routeMessages)
 
     def routeMessages(self, messages):
+        startTime = time.time()
+        if len(messages) > 1:
+            # multipart wire format, see formatMultipartMessage()
+            messages = [joinMultipartMessage(messages)]
         for msg in messages:
+            if self.trackSequence:
+                self.checkSequence(msg)
             self.routeMessage(msg)
+        self.loadMeter.add(startTime, time.time(), backlogged=hasBacklog(self.stream))
+
+    def getStats(self):
+        """
+        Returns load stats for the period since the last call (see
+        LoadMeter). Pass this to ZmqPublisher.addHeartbeatField() to
+        report them to zmqCentral.
+        """
+        result = self.loadMeter.getStats()
+        result['gaps'] = self.numGaps
+        result['resets'] = self.numResets
+        if self.handlerPool:
+            result['handlerPool'] = self.handlerPool.getStats()
+        return result
+
+    def checkSequence(self, msg):
+        """
+        Checks the sequence number that ZmqPublisher stamps on JSON
+        messages, which counts up separately for each (module, topic).
+        Only the top-level 'seq' and 'module' envelope fields are used
+        (see getEnvelopeFields()), never fields nested in the data.
+        A jump forward means messages were lost, for example to a
+        high-water mark or a reconnect: the loss is counted and
+        gapCallback(module, topic, firstMissingSeq, numLost) is called.
+        A jump back means the publisher restarted.
+        """
+        colonIndex = msg.find(':')
+        fields = getEnvelopeFields(msg, colonIndex + 1)
+        seq = fields.get('seq', None)
+        if not isinstance(seq, (int, long)):
+            return
+        module = fields.get('module', None)
+        topic = msg[:colonIndex]
+        key = (module, topic)
+        lastSeq = self.lastSeq.get(key, None)
+        self.lastSeq[key] = seq
+        if lastSeq is None or seq == lastSeq + 1:
+            return
+        if seq > lastSeq:
+            numLost = seq - lastSeq - 1
+            self.numLost += numLost
+            self.numGaps += 1
+            self.loadMeter.addDropped(numLost)
+            if self.gapCallback:
+                self.gapCallback(module, topic, lastSeq + 1, numLost)
+        else:
+            self.numResets += 1
 
     def routeMessage(self, msg):
         colonIndex = msg.find(':')
         topic = msg[:(colonIndex + 1)]
         body = msg[(colonIndex + 1):]
 
+        registries = self.topicRegistries.get(topic, None)
+        if registries is None:
+            registries = self.getTopicRegistries(topic)
+
         handled = 0
-        for topicPrefix, registry in self.handlers.iteritems():
-            if topic.startswith(topicPrefix):
+        parentCache = self.deliveryCache
+        self.deliveryCache = {}
+        try:
+            for registry in registries:
                 for handler in registry.itervalues():
                     handler(topic[:-1], body)
                     handled = 1
+        finally:
+            self.deliveryCache = parentCache
 
         return handled
 
-    def subscribeRaw(self, topicPrefix, handler):
-        topicRegistry = self.handlers.setdefault(topicPrefix, {})
-        if not topicRegistry:
+    def getTopicRegistries(self, topic):
+        """
+        Returns the handler registries for all subscribed prefixes that
+        match *topic*, and caches the result. The cache is cleared when
+        a prefix is subscribed or unsubscribed.
+        """
+        registries = tuple([registry
+                            for _topicPrefix, registry in self.handlerTrie.iterMatches(topic)])
+        if len(self.topicRegistries) >= MAX_CACHED_TOPICS:
+            self.topicRegistries.clear()
+        self.topicRegistries[topic] = registries
+        return registries
+
+    def wrapHandler(self, handler, threaded, orderKey):
+        """
+        If *threaded* is set, returns a handler that runs *handler* on
+        the handler thread pool instead of the ioloop. Calls with the
+        same ordering key run in order; the key is orderKey(topic, arg)
+        if given, or the topic.
+        """
+        if not threaded:
+            return handler
+        if self.handlerPool is None:
+            self.handlerPool = HandlerPool(self.handlerThreads,
+                                           self.handlerQueueSize,
+                                           name='%s-handler' % self.moduleName)
+        handlerPool = self.handlerPool
+
+        if orderKey is None:
+            def threadedHandler(topic, arg):
+                handlerPool.submit(topic, handler, topic, arg)
+        else:
+            def threadedHandler(topic, arg):
+                handlerPool.submit(orderKey(topic, arg), handler, topic, arg)
+        return threadedHandler
+
+    def subscribeRaw(self, topicPrefix, handler, threaded=False, orderKey=None):
+        """
+        Calls handler(topic, body) for messages whose topic starts with
+        *topicPrefix*. Returns an id to pass to unsubscribe().
+
+        Handlers run on the ioloop unless *threaded* is set, in which
+        case they run on a pool of handlerThreads worker threads, in
+        order for each topic, or for each key returned by
+        orderKey(topic, body). Decoded message objects are shared
+        between threads and must be treated as read-only.
+        """
+        handler = self.wrapHandler(handler, threaded, orderKey)
+        topicRegistry = self.handlers.get(topicPrefix, None)
+        if topicRegistry is None:
             logging.info('zmq.subscriber: subscribe %s', topicPrefix)
             self.stream.setsockopt(zmq.SUBSCRIBE, topicPrefix)
+            topicRegistry = {}
+            self.handlers[topicPrefix] = topicRegistry
+            self.handlerTrie.add(topicPrefix, topicRegistry)
+            self.topicRegistries.clear()
         handlerId = (topicPrefix, self.counter)
         topicRegistry[self.counter] = handler
         self.counter += 1
         return handlerId
 
-    def subscribeJson(self, topicPrefix, handler):
+    def getDecoded(self, kind, body, decode):
+        """
+        Returns decode(body), computing it at most once per message
+        routed: handlers matching the same message share the result
+        through deliveryCache, so they must treat it as read-only.
+        """
+        cache = self.deliveryCache
+        if cache is None:
+            return decode(body)
+        try:
+            return cache[kind]
+        except KeyError:
+            result = decode(body)
+            cache[kind] = result
+            return result
+
+    def decodeDotDict(self, body):
+        return convertToDotDictLazy(self.getDecoded('obj', body, decodeBody))
+
+    def decodeDjango(self, body):
+        obj = self.getDecoded('obj', body, decodeBody)
+        return list(self.deserializer([obj['data']]))[0].object
+
+    def subscribeJson(self, topicPrefix, handler, threaded=False, orderKey=None):
+        """
+        Calls handler(topic, obj) with the message body decoded as a
+        DotDict. All handlers matching a message get the same object.
+        See subscribeRaw() for *threaded* and *orderKey*.
+        """
+        handler = self.wrapHandler(handler, threaded, orderKey)
+
         def jsonHandler(topicPrefix, body):
-            return handler(topicPrefix, convertToDotDictRecurse(json.loads(body)))
+            return handler(topicPrefix, self.getDecoded('dotDict', body, self.decodeDotDict))
         return self.subscribeRaw(topicPrefix, jsonHandler)
 
-    def subscribeDjango(self, topicPrefix, handler):
+    def subscribeDjango(self, topicPrefix, handler, threaded=False, orderKey=None):
+        """
+        Calls handler(topic, instance) with the Django model instance
+        sent by ZmqPublisher.sendDjango(). All handlers matching a
+        message get the same instance. See subscribeRaw() for
+        *threaded* and *orderKey*.
+        """
+        handler = self.wrapHandler(handler, threaded, orderKey)
+
         def djangoHandler(topicPrefix, body):
-            obj = json.loads(body)
-            dataText = json.dumps([obj['data']])
-            modelInstance = list(self.deserializer(dataText))[0]
-            return handler(topicPrefix, modelInstance.object)
+            return handler(topicPrefix, self.getDecoded('django', body, self.decodeDjango))
         return self.subscribeRaw(topicPrefix, djangoHandler)
 
     def unsubscribe(self, handlerId):
@@ -145,23 +355,44 @@ class ZmqSubscriber(object):
         if not topicRegistry:
             logging.info('zmq.subscriber: unsubscribe %s', topicPrefix)
             self.stream.setsockopt(zmq.UNSUBSCRIBE, topicPrefix)
+            del self.handlers[topicPrefix]
+            self.handlerTrie.remove(topicPrefix)
+            self.topicRegistries.clear()
 
     def connect(self, endpoint):
         self.stream.connect(endpoint)
 
     def replay(self):
+        """
+        Replays the messages in replayPaths, merged in timestamp order
+        (see mergeLogRecords). On equal timestamps, messages from
+        earlier paths come first.
+        """
         numReplayed = 0
         numHandled = 0
+        streams = []
+        attachmentStores = []
         for replayPath in self.replayPaths:
             print '=== replaying messages from %s' % replayPath
             if replayPath == '-':
                 replayFile = sys.stdin
             else:
                 replayFile = open(replayPath, 'rb')
-            stream = LogParser(replayFile)
-            for rec in stream:
-                numReplayed += 1
-                numHandled += self.routeMessage(rec.msg)
+            streams.append(LogParser(replayFile))
+            attachmentStores.append(getLogAttachmentStore(replayPath))
+
+        for i, rec in mergeLogRecords(streams):
+            try:
+                msg = attachmentStores[i].getFullMessage(rec)
+            except (IOError, OSError), e:
+                print ('warning: could not load attachments for record at offset %d of %s: %s'
+                       % (rec.offset, self.replayPaths[i], e))
+                continue
+            numReplayed += 1
+            numHandled += self.routeMessage(msg)
+
+            if numReplayed % 10000 == 0:
+                print 'replayed %d messages, %d handled' % (numReplayed, numHandled)
 
-                if numReplayed % 10000 == 0:
-                    print 'replayed %d messages, %d handled' % (numReplayed, numHandled)
+        if self.handlerPool:
+            self.handlerPool.join()
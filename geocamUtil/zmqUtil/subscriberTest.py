@@ -0,0 +1,156 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import unittest
+import threading
+
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+
+from geocamUtil.zmqUtil.subscriber import ZmqSubscriber
+from geocamUtil.zmqUtil.codec import encodeBody
+
+
+class SubscriberTest(unittest.TestCase):
+    def test_gaps(self):
+        gaps = []
+        subscriber = ZmqSubscriber('subscriberTest',
+                                   gapCallback=lambda *args: gaps.append(args))
+        for seq in (0, 1, 2, 5, 6):
+            subscriber.checkSequence('a.b:{"module": "m1", "seq": %d}' % seq)
+        for seq in (0, 1, 0, 1):
+            subscriber.checkSequence('a.c:{"seq": %d, "module": "m2"}' % seq)
+        subscriber.checkSequence('a.d:{"x": 1}')
+        self.assertEqual(gaps, [('m1', 'a.b', 3, 2)])
+        self.assertEqual((subscriber.numLost, subscriber.numGaps, subscriber.numResets),
+                         (2, 1, 1))
+        stats = subscriber.getStats()
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['gaps'], 1)
+
+    def test_nestedSeq(self):
+        gaps = []
+        subscriber = ZmqSubscriber('subscriberTest',
+                                   gapCallback=lambda *args: gaps.append(args))
+        for seq in (0, 1, 2):
+            obj = {'data': {'fields': {'seq': 86 + seq, 'module': 'x'}},
+                   'module': 'm1',
+                   'seq': seq}
+            subscriber.checkSequence('a.b:' + encodeBody(obj))
+        # seq and module are only read from the start of the body
+        subscriber.checkSequence('a.b:{"data": {"seq": 9, "module": "x"}}')
+        self.assertEqual(gaps, [])
+        self.assertEqual(subscriber.numResets, 0)
+        self.assertEqual(subscriber.lastSeq, {('m1', 'a.b'): 2})
+
+    def test_routing(self):
+        subscriber = ZmqSubscriber('subscriberTest')
+        context = zmq.Context()
+        subscriber.stream = ZMQStream(context.socket(zmq.SUB))
+        try:
+            received = []
+
+            def handler(name):
+                return lambda topic, body: received.append((name, topic, body))
+
+            subscriber.subscribeRaw('a', handler('a'))
+            abId = subscriber.subscribeRaw('a.b', handler('ab'))
+            subscriber.subscribeRaw('a.b', handler('ab2'))
+            subscriber.subscribeRaw('c', handler('c'))
+
+            self.assertEqual(subscriber.routeMessage('a.b.c:x'), 1)
+            self.assertEqual(sorted(received), [('a', 'a.b.c', 'x'),
+                                                ('ab', 'a.b.c', 'x'),
+                                                ('ab2', 'a.b.c', 'x')])
+            self.assertEqual(subscriber.routeMessage('b:x'), 0)
+
+            # unsubscribing must invalidate the cached dispatch for a.b.c
+            del received[:]
+            subscriber.unsubscribe(abId)
+            subscriber.routeMessage('a.b.c:y')
+            self.assertEqual(sorted(received), [('a', 'a.b.c', 'y'),
+                                                ('ab2', 'a.b.c', 'y')])
+            self.assertEqual(len(subscriber.handlerTrie), 3)
+        finally:
+            subscriber.stream.close()
+            context.term()
+
+    def test_sharedDecode(self):
+        from django.contrib.contenttypes.models import ContentType
+
+        subscriber = ZmqSubscriber('subscriberTest')
+        context = zmq.Context()
+        subscriber.stream = ZMQStream(context.socket(zmq.SUB))
+        try:
+            received = []
+
+            def handler(topic, obj):
+                received.append(obj)
+
+            for _i in xrange(2):
+                subscriber.subscribeJson('contenttypes', handler)
+                subscriber.subscribeDjango('contenttypes', handler)
+            body = ('{"module": "m", "data": {"model": "contenttypes.contenttype", "pk": 7,'
+                    ' "fields": {"app_label": "a", "model": "m7"}}}')
+            subscriber.routeMessage('contenttypes.contenttype:' + body)
+            objs = [obj for obj in received if not isinstance(obj, ContentType)]
+            instances = [obj for obj in received if isinstance(obj, ContentType)]
+            self.assertEqual(len(objs), 2)
+            self.assertTrue(objs[0] is objs[1])
+            self.assertEqual(objs[0].data.fields.model, 'm7')
+            self.assertEqual(len(instances), 2)
+            self.assertTrue(instances[0] is instances[1])
+            self.assertEqual((instances[0].pk, instances[0].model), (7, 'm7'))
+
+            # the next message is decoded again
+            subscriber.routeMessage('contenttypes.contenttype:' + body)
+            self.assertFalse(received[-1] is instances[0])
+        finally:
+            subscriber.stream.close()
+            context.term()
+
+    def test_threaded(self):
+        subscriber = ZmqSubscriber('subscriberTest', handlerThreads=3, handlerQueueSize=2)
+        context = zmq.Context()
+        subscriber.stream = ZMQStream(context.socket(zmq.SUB))
+        try:
+            received = []
+            threadNames = set()
+
+            def handler(topic, obj):
+                threadNames.add(threading.currentThread().name)
+                received.append((obj.key, obj.n))
+
+            subscriber.subscribeJson('a', handler, threaded=True,
+                                     orderKey=lambda topic, obj: obj.key)
+            for n in xrange(100):
+                subscriber.routeMessage('a.%d:{"key": %d, "n": %d}' % (n % 7, n % 5, n))
+            subscriber.handlerPool.join()
+
+            self.assertEqual(len(received), 100)
+            for key in xrange(5):
+                ns = [n for k, n in received if k == key]
+                self.assertEqual(ns, range(key, 100, 5))
+            self.assertFalse(threading.currentThread().name in threadNames)
+            self.assertEqual(subscriber.getStats()['handlerPool']['queued'], 0)
+        finally:
+            subscriber.handlerPool.stop()
+            subscriber.stream.close()
+            context.term()
+
+
+if __name__ == '__main__':
+    unittest.main()
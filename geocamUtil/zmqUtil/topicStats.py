@@ -0,0 +1,168 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import time
+
+from geocamUtil.zmqUtil.util import getTimestamp
+from geocamUtil.zmqUtil.codec import getEnvelopeFields
+
+DEFAULT_PREFIX_DEPTH = 2
+RATE_WINDOWS_SECONDS = (1, 10, 60)
+HISTORY_SECONDS = max(RATE_WINDOWS_SECONDS) + 1
+
+# latency histogram bucket i counts latencies in [2^(i-1), 2^i) msecs,
+# with bucket 0 for < 1 msec and the last bucket for anything longer
+NUM_LATENCY_BUCKETS = 18
+LATENCY_BUCKET_LIMITS_MSECS = [2 ** i for i in xrange(NUM_LATENCY_BUCKETS - 1)]
+
+MAX_CACHED_TOPICS = 10000
+
+
+class TopicCounter(object):
+    """
+    Traffic counters for one topic prefix.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+
+        # ring buffers of per-second counts, indexed by (second % HISTORY_SECONDS)
+        self.seconds = [None] * HISTORY_SECONDS
+        self.secondCounts = [0] * HISTORY_SECONDS
+        self.secondBytes = [0] * HISTORY_SECONDS
+
+        self.latencyCounts = [0] * NUM_LATENCY_BUCKETS
+        self.numNegativeLatency = 0
+        self.numLatency = 0
+        self.latencySumUs = 0
+        self.latencyMaxUs = 0
+
+    def add(self, second, size):
+        self.count += 1
+        self.bytes += size
+        i = second % HISTORY_SECONDS
+        if self.seconds[i] != second:
+            self.seconds[i] = second
+            self.secondCounts[i] = 0
+            self.secondBytes[i] = 0
+        self.secondCounts[i] += 1
+        self.secondBytes[i] += size
+
+    def addLatency(self, latencyUs):
+        if latencyUs < 0:
+            # publisher clock is ahead of ours
+            self.numNegativeLatency += 1
+            return
+        self.numLatency += 1
+        self.latencySumUs += latencyUs
+        if latencyUs > self.latencyMaxUs:
+            self.latencyMaxUs = latencyUs
+        bucket = min((latencyUs // 1000).bit_length(), NUM_LATENCY_BUCKETS - 1)
+        self.latencyCounts[bucket] += 1
+
+    def getRates(self, second):
+        result = {}
+        for window in RATE_WINDOWS_SECONDS:
+            count = 0
+            size = 0
+            for i in xrange(HISTORY_SECONDS):
+                bucketSecond = self.seconds[i]
+                if bucketSecond is not None and second - window < bucketSecond <= second:
+                    count += self.secondCounts[i]
+                    size += self.secondBytes[i]
+            result['%ds' % window] = {'msgsPerSec': float(count) / window,
+                                      'bytesPerSec': float(size) / window}
+        return result
+
+    def getLatency(self):
+        if self.numLatency:
+            meanMsecs = self.latencySumUs / 1000.0 / self.numLatency
+        else:
+            meanMsecs = None
+        return {'count': self.numLatency,
+                'negativeCount': self.numNegativeLatency,
+                'meanMsecs': meanMsecs,
+                'maxMsecs': self.latencyMaxUs / 1000.0,
+                'bucketLimitsMsecs': LATENCY_BUCKET_LIMITS_MSECS,
+                'bucketCounts': self.latencyCounts}
+
+    def getStats(self, second):
+        return {'count': self.count,
+                'bytes': self.bytes,
+                'rates': self.getRates(second),
+                'latency': self.getLatency()}
+
+
+class TopicStats(object):
+    """
+    Collects message count, byte count and message rate statistics for
+    the traffic through zmqCentral, grouped by topic prefix. The prefix
+    of a topic is its first *prefixDepth* dot-separated components, so
+    with the default depth of 2, 'dds.Resolve.RESOLVE_CAM' is counted
+    under 'dds.Resolve'.
+
+    Rates are computed over sliding windows (see RATE_WINDOWS_SECONDS).
+    For messages with the top-level 'timestamp' envelope field that
+    ZmqPublisher stamps on each message (see getEnvelopeFields()), in
+    any codec, TopicStats also keeps a histogram of the
+    latency between the publisher and central, which includes any
+    clock offset between the two hosts.
+    """
+
+    def __init__(self, prefixDepth=DEFAULT_PREFIX_DEPTH):
+        self.prefixDepth = prefixDepth
+        self.counters = {}
+        self.topicCounters = {}
+        self.startTime = time.time()
+
+    def getCounter(self, topic):
+        counter = self.topicCounters.get(topic, None)
+        if counter is None:
+            prefix = '.'.join(topic.split('.', self.prefixDepth)[:self.prefixDepth])
+            counter = self.counters.get(prefix, None)
+            if counter is None:
+                counter = TopicCounter()
+                self.counters[prefix] = counter
+            if len(self.topicCounters) >= MAX_CACHED_TOPICS:
+                self.topicCounters.clear()
+            self.topicCounters[topic] = counter
+        return counter
+
+    def addMessage(self, msg, checkLatency=True, now=None, size=None):
+        if now is None:
+            now = getTimestamp()
+        if size is None:
+            size = len(msg)
+        colonIndex = msg.find(':')
+        counter = self.getCounter(msg[:colonIndex])
+        counter.add(now // 1000000, size)
+        if checkLatency:
+            timestamp = getEnvelopeFields(msg, colonIndex + 1).get('timestamp', None)
+            if timestamp is not None:
+                try:
+                    counter.addLatency(now - int(timestamp))
+                except (ValueError, TypeError):
+                    pass
+
+    def getStats(self, now=None):
+        if now is None:
+            now = getTimestamp()
+        second = now // 1000000
+        return {'timestamp': str(now),
+                'uptimeSecs': time.time() - self.startTime,
+                'topics': dict([(prefix, counter.getStats(second))
+                                for prefix, counter in self.counters.iteritems()])}
@@ -0,0 +1,83 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import unittest
+
+from geocamUtil.zmqUtil import codec
+from geocamUtil.zmqUtil.codec import getCodec, encodeBody
+from geocamUtil.zmqUtil.topicStats import TopicStats
+
+START_TIMESTAMP = 1342172466000000
+
+
+class TopicStatsTest(unittest.TestCase):
+    def test_counts(self):
+        stats = TopicStats(prefixDepth=2)
+        for i in xrange(100):
+            now = START_TIMESTAMP + i * 100000
+            stats.addMessage('a.b.c%d:{"i": %d}' % (i % 2, i), now=now)
+            stats.addMessage('a.d:{}', now=now)
+        result = stats.getStats(now=START_TIMESTAMP + 9999999)
+        self.assertEqual(sorted(result['topics'].keys()), ['a.b', 'a.d'])
+        ab = result['topics']['a.b']
+        self.assertEqual(ab['count'], 100)
+        self.assertEqual(ab['rates']['1s']['msgsPerSec'], 10)
+        self.assertEqual(ab['rates']['10s']['msgsPerSec'], 10)
+        self.assertEqual(ab['rates']['60s']['msgsPerSec'], 100 / 60.0)
+
+        # rates decay as the window slides past the traffic
+        result = stats.getStats(now=START_TIMESTAMP + 15000000)
+        self.assertEqual(result['topics']['a.b']['rates']['10s']['msgsPerSec'], 4)
+
+    def test_latency(self):
+        stats = TopicStats()
+        now = START_TIMESTAMP
+        for latencyMsecs in (0.5, 1.5, 3, 3, 1000):
+            stats.addMessage('a.b:{"timestamp": "%d"}' % (now - latencyMsecs * 1000), now=now)
+        stats.addMessage('a.b:{"timestamp": "%d"}' % (now + 5), now=now)
+        stats.addMessage('a.b:{"x": 1}', now=now)
+        latency = stats.getStats(now=now)['topics']['a.b']['latency']
+        self.assertEqual(latency['count'], 5)
+        self.assertEqual(latency['negativeCount'], 1)
+        self.assertEqual(latency['maxMsecs'], 1000)
+        self.assertEqual(latency['bucketCounts'][:3], [1, 1, 2])
+        self.assertEqual(latency['bucketCounts'][10], 1)
+
+    def test_nestedTimestamp(self):
+        stats = TopicStats()
+        now = START_TIMESTAMP
+        obj = {'data': {'timestamp': str(now - 10000000)},
+               'timestamp': str(now - 2000)}
+        stats.addMessage('a.b:' + encodeBody(obj), now=now)
+        # a nested timestamp without a top-level one is ignored
+        stats.addMessage('a.b:{"data": {"timestamp": "%d"}}' % now, now=now)
+        latency = stats.getStats(now=now)['topics']['a.b']['latency']
+        self.assertEqual(latency['count'], 1)
+        self.assertEqual(latency['maxMsecs'], 2)
+
+    @unittest.skipIf(codec.msgpack is None, 'msgpack module not installed')
+    def test_codecLatency(self):
+        stats = TopicStats()
+        now = START_TIMESTAMP
+        obj = {'data': {'timestamp': '0'}, 'timestamp': str(now - 3000)}
+        stats.addMessage('a.b:' + encodeBody(obj, getCodec('msgpack')), now=now)
+        latency = stats.getStats(now=now)['topics']['a.b']['latency']
+        self.assertEqual(latency['count'], 1)
+        self.assertEqual(latency['maxMsecs'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
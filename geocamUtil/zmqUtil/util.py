@@ -16,18 +16,54 @@
 # specific language governing permissions and limitations under the License.
 #__END_LICENSE__
 
+import os
 import re
 import time
+import zlib
+import mmap
+import uuid
+import heapq
+import bisect
 import platform
 import datetime
+import calendar
 import email.parser
 
+import zmq
 from zmq.eventloop import ioloop
 
+from geocamUtil import anyjson as json
+
 DEFAULT_CENTRAL_RPC_PORT = 7814
 DEFAULT_CENTRAL_SUBSCRIBE_PORT = 7815
 DEFAULT_CENTRAL_PUBLISH_PORT = 7816
 
+RECORD_SENTINEL = '@@@'
+BLOCK_SENTINEL = '@@Z'
+MAX_HEADER_FIELD_LENGTH = 4096
+# long enough for headers with attachment store references
+HEADER_PEEK_BYTES = 96
+MAX_TOPIC_LENGTH = 1024
+
+# default high-water mark (max queued messages) for publish and
+# subscribe sockets. beyond this zmq drops messages instead of letting
+# the queue grow without limit.
+DEFAULT_HIGH_WATER_MARK = 10000
+
+SLOW_BUSY_FRACTION = 0.9
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+# a message log index gets an entry every N records or every T seconds,
+# whichever comes first
+INDEX_SUFFIX = '.index'
+TOPIC_INDEX_SUFFIX = '.topics'
+DEFAULT_INDEX_EVERY_RECORDS = 1000
+DEFAULT_INDEX_EVERY_SECONDS = 10
+
+# large logs with an index can be split into ranges of about this size
+# to be processed in parallel, see getLogRanges()
+DEFAULT_CHUNK_BYTES = 256 * 1024 * 1024
+
 
 def getTimestamp(posixTime=None):
     if posixTime is None:
@@ -48,6 +84,26 @@ def getTimestampFields(timestampStr):
     return timestampSeconds, timestampMicroseconds
 
 
+def parseTimestampArg(text):
+    """
+    Parses a timestamp given on the command line, either in
+    microseconds since the epoch (the log record format) or as a UTC
+    time like '2012-07-13T10:00:00' or '2012-07-13 10:00:00.5'. Raises
+    ValueError if neither matches.
+    """
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    text = text.replace(' ', 'T').rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            dt = datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        return calendar.timegm(dt.timetuple()) * 1000000 + dt.microsecond
+    raise ValueError('could not parse timestamp "%s"' % text)
+
+
 def getShortHostName():
     node = platform.node()
     return node.split('.', 1)[0]
@@ -107,6 +163,31 @@ def parseMessageBody(body):
         return {'json': body, 'attachments': []}
 
 
+def formatMessageBody(jsonText, attachments):
+    """
+    The inverse of parseMessageBody(). *attachments* is a list of dicts
+    with 'filename', 'contentType' and 'data' fields.
+    """
+    if not attachments:
+        return jsonText
+    boundary = str(uuid.uuid4())
+    parts = ['Content-Type: multipart/mixed; boundary="%s"\n\n' % boundary,
+             '--%s\n' % boundary,
+             'Content-Disposition: inline\n',
+             'Content-Type: application/json; charset="utf-8"\n\n',
+             jsonText,
+             '\n']
+    for attachment in attachments:
+        parts += ['--%s\n' % boundary,
+                  'Content-Disposition: attachment; filename="%s"\n' % attachment['filename'],
+                  'Content-Type: %s\n' % attachment['contentType'],
+                  'Content-Transfer-Encoding: binary\n\n',
+                  attachment['data'],
+                  '\n']
+    parts.append('--%s--\n' % boundary)
+    return ''.join(parts)
+
+
 def parseMessage(msg):
     topic, body = msg.split(':', 1)
     parsed = parseMessageBody(body)
@@ -114,48 +195,719 @@ def parseMessage(msg):
     return parsed
 
 
+def getFrameBytes(frame):
+    """
+    Returns the contents of a message frame received with either
+    copy=True (a string) or copy=False (a zmq.Frame) as a string.
+    """
+    if isinstance(frame, str):
+        return frame
+    return frame.bytes
+
+
+def getFrameData(frame):
+    """
+    Like getFrameBytes(), but for a zmq.Frame, returns a memoryview that
+    shares memory with the frame instead of copying it.
+    """
+    if isinstance(frame, str):
+        return frame
+    return frame.buffer
+
+
+def formatMultipartMessage(topic, jsonText, attachments=None):
+    """
+    Returns the frames of a message in the multipart wire format:
+
+     * A topic frame 'topic:'. Including the colon means that zmq topic
+       subscriptions match the first frame of a multipart message the
+       same way as they match a single-frame message.
+     * A body frame with the JSON text.
+     * For messages with attachments, a manifest frame with a JSON list
+       of {'filename', 'contentType'} dicts, followed by one frame of
+       raw data for each attachment.
+
+    Unlike the single-frame format (see formatMessageBody()), the
+    attachments don't need to be MIME-encoded, and receivers only need
+    to look at the frames they are interested in.
+    """
+    frames = [topic + ':', jsonText]
+    if attachments:
+        manifest = [{'filename': attachment['filename'],
+                     'contentType': attachment['contentType']}
+                    for attachment in attachments]
+        frames.append(json.dumps(manifest))
+        frames += [attachment['data'] for attachment in attachments]
+    return frames
+
+
+def parseMultipartMessage(frames):
+    """
+    The inverse of formatMultipartMessage(). Returns a dict with
+    'topic', 'json' and 'attachments' fields, where 'attachments' is a
+    list of dicts with 'filename', 'contentType' and 'data' fields. If
+    the frames were received with copy=False, the attachment data are
+    buffers that share memory with the frames.
+    """
+    topicFrame = getFrameBytes(frames[0])
+    if len(frames) < 2 or topicFrame[-1:] != ':':
+        raise ValueError('malformed multipart message')
+    attachments = []
+    if len(frames) > 2:
+        manifest = json.loads(getFrameBytes(frames[2]))
+        if len(manifest) != len(frames) - 3:
+            raise ValueError('multipart message manifest lists %d attachments but has %d attachment frames'
+                             % (len(manifest), len(frames) - 3))
+        for entry, frame in zip(manifest, frames[3:]):
+            attachments.append({'filename': entry['filename'].encode('utf-8'),
+                                'contentType': entry['contentType'].encode('utf-8'),
+                                'data': getFrameData(frame)})
+    return {'topic': topicFrame[:-1],
+            'json': getFrameBytes(frames[1]),
+            'attachments': attachments}
+
+
+def joinMultipartMessage(frames):
+    """
+    Converts a message in the multipart wire format to the equivalent
+    single-frame message.
+    """
+    parsed = parseMultipartMessage(frames)
+    return '%s:%s' % (parsed['topic'],
+                      formatMessageBody(parsed['json'],
+                                        [dict(attachment, data=memoryview(attachment['data']).tobytes())
+                                         for attachment in parsed['attachments']]))
+
+
 def zmqLoop():
     ioloop.IOLoop.instance().start()
 
 
+def hasBacklog(stream):
+    """
+    Returns True if more messages are already waiting on the socket of
+    ZMQStream *stream*.
+    """
+    return bool(stream.socket.getsockopt(zmq.EVENTS) & zmq.POLLIN)
+
+
+class LoadMeter(object):
+    """
+    Tracks how hard a message consumer is working, to detect consumers
+    that can't keep up. Call add() after handling each batch of
+    messages. A consumer is reported as slow if it spends more than
+    SLOW_BUSY_FRACTION of its time in message handlers, at which point
+    messages pile up in the zmq queue and are dropped once the queue
+    reaches its high-water mark. The fraction of batches that found
+    more messages already waiting is reported as well; it is high
+    during any burst, so on its own it doesn't mean the consumer is
+    slow.
+    """
+
+    def __init__(self):
+        self.numMessages = 0
+        self.numDropped = 0
+        self.periodStart = time.time()
+        self.periodBusySecs = 0.0
+        self.periodBatches = 0
+        self.periodBacklogged = 0
+
+    def add(self, startTime, endTime, numMessages=1, backlogged=False):
+        self.numMessages += numMessages
+        self.periodBusySecs += endTime - startTime
+        self.periodBatches += 1
+        if backlogged:
+            self.periodBacklogged += 1
+
+    def addDropped(self, numDropped):
+        self.numDropped += numDropped
+
+    def getStats(self):
+        """
+        Returns stats for the period since the last getStats() call.
+        """
+        now = time.time()
+        elapsed = max(now - self.periodStart, 1e-6)
+        busyFraction = min(self.periodBusySecs / elapsed, 1.0)
+        if self.periodBatches:
+            backlogFraction = float(self.periodBacklogged) / self.periodBatches
+        else:
+            backlogFraction = 0.0
+        self.periodStart = now
+        self.periodBusySecs = 0.0
+        self.periodBatches = 0
+        self.periodBacklogged = 0
+        return {'messages': self.numMessages,
+                'dropped': self.numDropped,
+                'busyFraction': busyFraction,
+                'backlogFraction': backlogFraction,
+                'slow': busyFraction > SLOW_BUSY_FRACTION}
+
+
 class LogRecord(object):
-    def __init__(self, timestamp, attachmentsPath, msg):
+    """
+    A message log record. Records produced by LogParser in header-only
+    mode have a msgSize and topic but no msg.
+    """
+
+    # there can be millions of these, keep them small and cheap to build
+    __slots__ = ('timestamp', 'attachmentsPath', 'msg', 'offset', 'msgSize', '_topic')
+
+    def __init__(self, timestamp, attachmentsPath, msg, offset=None, msgSize=None, topic=None):
         self.timestamp = timestamp
         self.attachmentsPath = attachmentsPath
         self.msg = msg
+        self.offset = offset
+        if msg is not None:
+            msgSize = len(msg)
+        self.msgSize = msgSize
+        self._topic = topic
+
+    def hasAttachments(self):
+        return self.attachmentsPath != '-'
+
+    @property
+    def topic(self):
+        msg = self.msg
+        if msg is None:
+            return self._topic
+        colonIndex = msg.find(':', 0, MAX_TOPIC_LENGTH)
+        if colonIndex == -1:
+            return msg
+        return msg[:colonIndex]
 
     def writeTo(self, stream):
-        stream.write('@@@ %d %d %s ' % (self.timestamp, len(self.msg), self.attachmentsPath))
+        stream.write('%s %d %d %s ' % (RECORD_SENTINEL, self.timestamp, self.msgSize, self.attachmentsPath))
         stream.write(self.msg)
         stream.write('\n')
 
 
+class MmapSource(object):
+    """
+    Log data for LogParser that is entirely available up front, such as
+    a memory-mapped log file or a decompressed block.
+    """
+
+    def __init__(self, data, pos=0, baseOffset=0):
+        self.data = data
+        self.pos = pos
+        self.end = len(data)
+        self.baseOffset = baseOffset
+
+    def fill(self, minBytes=0):
+        return False
+
+
+class StreamSource(object):
+    """
+    Log data for LogParser read incrementally from a stream that can't
+    be memory-mapped, such as stdin.
+    """
+
+    def __init__(self, stream, baseOffset=0):
+        self.stream = stream
+        self.data = ''
+        self.pos = 0
+        self.end = 0
+        self.baseOffset = baseOffset
+
+    def fill(self, minBytes=0):
+        chunk = self.stream.read(max(minBytes, STREAM_CHUNK_BYTES))
+        if not chunk:
+            return False
+        # records already returned keep referring to the old string
+        self.baseOffset += self.pos
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        self.end = len(self.data)
+        return True
+
+
 class LogParser(object):
-    def __init__(self, logFile):
+    """
+    Iterates over the records in a message log. Each record is framed
+    by a header "@@@ <timestamp> <length> <attachmentsPath> " and a
+    trailing newline, and the parser uses the declared length to find
+    the end of the message, so messages may contain newlines.
+
+    Log files are memory-mapped, so only the message bodies are copied
+    out. If *headerOnly* is set, only the topic is read from each body,
+    and records have a timestamp, topic, offset and msgSize but no msg.
+
+    The parser also handles block-compressed logs (see LogWriter), in
+    which runs of records are stored as zlib-compressed blocks in the
+    form "@@Z <timestamp> <compressedLength> <rawLength> <data>". Each
+    block can be decompressed independently, so the offset of a record
+    in a block is the offset of the block.
+
+    For records with attachments, msg holds only the JSON part of the
+    message. Use AttachmentStore.getFullMessage() to rebuild the
+    message as it was originally sent.
+    """
+
+    def __init__(self, logFile, headerOnly=False):
         self.logFile = logFile
+        self.headerOnly = headerOnly
+
+    def getStartOffset(self):
+        try:
+            return self.logFile.tell()
+        except (AttributeError, IOError):
+            # not seekable, e.g. stdin
+            return 0
+
+    def getSource(self):
+        startOffset = self.getStartOffset()
+        try:
+            data = mmap.mmap(self.logFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, ValueError, EnvironmentError):
+            # not a regular file (or an empty one)
+            return StreamSource(self.logFile, startOffset)
+        return MmapSource(data, startOffset)
+
+    def parseHeader(self, data, pos, end):
+        """
+        Returns (sentinel, timestamp, size, extra, bodyStart) for the
+        frame header at *pos*, or None if the header extends past
+        *end*. Raises ValueError if the header is malformed.
+        """
+        if end - pos < 4:
+            return None
+        sentinel = data[pos:(pos + 3)]
+        if sentinel not in (RECORD_SENTINEL, BLOCK_SENTINEL) or data[pos + 3] != ' ':
+            raise ValueError('bad sentinel')
+        fields = []
+        fieldStart = pos + 4
+        for _i in xrange(3):
+            fieldEnd = data.find(' ', fieldStart, min(end, fieldStart + MAX_HEADER_FIELD_LENGTH))
+            if fieldEnd == -1:
+                if end - fieldStart < MAX_HEADER_FIELD_LENGTH:
+                    return None
+                raise ValueError('header field too long')
+            fields.append(data[fieldStart:fieldEnd])
+            fieldStart = fieldEnd + 1
+        timestamp = int(fields[0])
+        size = int(fields[1])
+        if size < 0:
+            raise ValueError('bad length')
+        return sentinel, timestamp, size, fields[2], fieldStart
+
+    def parseBlock(self, data, bodyStart, size, rawSizeStr, offset):
+        try:
+            rawSize = int(rawSizeStr)
+            raw = zlib.decompress(data[bodyStart:(bodyStart + size)])
+        except (ValueError, zlib.error):
+            print 'warning: bad compressed block at offset %d' % offset
+            return
+        if len(raw) != rawSize:
+            print 'warning: bad block length %d != %d at offset %d' % (len(raw), rawSize, offset)
+            return
+        for rec in self.iterSource(MmapSource(raw)):
+            rec.offset = offset
+            yield rec
+
+    def getTopic(self, data, bodyStart, frameEnd):
+        topicEnd = data.find(':', bodyStart, min(frameEnd, bodyStart + MAX_TOPIC_LENGTH))
+        if topicEnd == -1:
+            topicEnd = frameEnd
+        return data[bodyStart:topicEnd]
+
+    def iterSource(self, source):
+        readBodies = not self.headerOnly
+        # local names are faster in the inner loop
+        newRecord = object.__new__
+        recordClass = LogRecord
+        recordSentinel = RECORD_SENTINEL
+        peekBytes = HEADER_PEEK_BYTES
+        maxTopicLength = MAX_TOPIC_LENGTH
+        toInt = int
+        strLen = len
+        while True:
+            data, pos, end = source.data, source.pos, source.end
+            baseOffset = source.baseOffset
+
+            # fast path for plain records with short headers. this runs
+            # for nearly every record, so it builds records directly
+            # rather than through LogRecord.__init__(), and has a
+            # separate loop for each mode.
+            fastEnd = end - peekBytes
+            try:
+                if readBodies:
+                    while pos <= fastEnd:
+                        sentinel, timestampStr, sizeStr, extra, rest = data[pos:(pos + peekBytes)].split(' ', 4)
+                        bodyStart = pos + peekBytes - strLen(rest)
+                        frameEnd = bodyStart + toInt(sizeStr)
+                        if sentinel != recordSentinel or frameEnd < bodyStart or data[frameEnd] != '\n':
+                            break
+                        rec = newRecord(recordClass)
+                        rec.timestamp = toInt(timestampStr)
+                        rec.attachmentsPath = extra
+                        rec.msg = data[bodyStart:frameEnd]
+                        rec.offset = baseOffset + pos
+                        rec.msgSize = frameEnd - bodyStart
+                        pos = frameEnd + 1
+                        yield rec
+                else:
+                    while pos <= fastEnd:
+                        sentinel, timestampStr, sizeStr, extra, rest = data[pos:(pos + peekBytes)].split(' ', 4)
+                        size = toInt(sizeStr)
+                        bodyStart = pos + peekBytes - strLen(rest)
+                        frameEnd = bodyStart + size
+                        if sentinel != recordSentinel or size < 0 or data[frameEnd] != '\n':
+                            break
+                        # the topic is usually in the peeked data. if not,
+                        # look for it without copying the rest of the body.
+                        topicEnd = rest.find(':', 0, size)
+                        if topicEnd != -1:
+                            topic = rest[:topicEnd]
+                        else:
+                            topicEnd = data.find(':', bodyStart, bodyStart + maxTopicLength)
+                            if topicEnd == -1 or topicEnd > frameEnd:
+                                topicEnd = frameEnd
+                            topic = data[bodyStart:topicEnd]
+                        rec = newRecord(recordClass)
+                        rec.timestamp = toInt(timestampStr)
+                        rec.attachmentsPath = extra
+                        rec.msg = None
+                        rec.offset = baseOffset + pos
+                        rec.msgSize = size
+                        rec._topic = topic
+                        pos = frameEnd + 1
+                        yield rec
+            except (ValueError, IndexError):
+                pass
+            source.pos = pos
+
+            # slow path for blocks, records near or past the end of the
+            # data read so far, and errors
+            try:
+                header = self.parseHeader(data, pos, end)
+                if header is not None:
+                    sentinel, timestamp, size, extra, bodyStart = header
+                    frameEnd = bodyStart + size
+                    if frameEnd < end and data[frameEnd] != '\n':
+                        raise ValueError('bad message length')
+            except ValueError, e:
+                print 'warning: %s in record at offset %d' % (e, baseOffset + pos)
+                # skip ahead to what looks like the next record
+                nextPos = data.find('\n@@', pos + 1, end)
+                if nextPos != -1:
+                    source.pos = nextPos + 1
+                else:
+                    source.pos = max(pos + 1, end - 2)
+                    if not source.fill():
+                        break
+                continue
+
+            if header is None or frameEnd >= end:
+                if header is None:
+                    minBytes = 0
+                else:
+                    minBytes = frameEnd + 1 - end
+                if source.fill(minBytes):
+                    continue
+                if pos < end:
+                    print 'warning: truncated record at offset %d' % (baseOffset + pos)
+                break
+
+            source.pos = frameEnd + 1
+            offset = baseOffset + pos
+            if sentinel == BLOCK_SENTINEL:
+                for rec in self.parseBlock(data, bodyStart, size, extra, offset):
+                    yield rec
+            elif readBodies:
+                yield recordClass(timestamp, extra, data[bodyStart:frameEnd], offset)
+            else:
+                yield recordClass(timestamp, extra, None, offset, size,
+                                  self.getTopic(data, bodyStart, frameEnd))
 
     def __iter__(self):
-        for lineNum, line in enumerate(self.logFile):
+        return self.iterSource(self.getSource())
+
+
+def getIndexPath(logPath):
+    return logPath + INDEX_SUFFIX
+
+
+class LogIndexWriter(object):
+    """
+    Writes the sidecar index for a message log. Each line of the index
+    has the form "<timestamp> <offset>", where offset is the byte
+    offset of the start of the record with that timestamp. To keep the
+    index small, entries are only written every *everyRecords* records
+    or every *everySeconds* seconds of log time.
+    """
+
+    def __init__(self, indexFile,
+                 everyRecords=DEFAULT_INDEX_EVERY_RECORDS,
+                 everySeconds=DEFAULT_INDEX_EVERY_SECONDS):
+        self.indexFile = indexFile
+        self.everyRecords = everyRecords
+        self.everyMicroseconds = int(everySeconds * 1000000)
+        self.numSinceEntry = None
+        self.lastEntryTimestamp = None
+
+    def add(self, timestamp, offset):
+        """
+        Call once for each record written to the log, in order.
+        """
+        if (self.numSinceEntry is None
+                or self.numSinceEntry >= self.everyRecords
+                or timestamp - self.lastEntryTimestamp >= self.everyMicroseconds):
+            self.indexFile.write('%d %d\n' % (timestamp, offset))
+            self.numSinceEntry = 0
+            self.lastEntryTimestamp = timestamp
+        self.numSinceEntry += 1
+
+    def flush(self):
+        self.indexFile.flush()
+
+    def close(self):
+        self.indexFile.close()
+
+
+class LogIndex(object):
+    def __init__(self, timestamps=None, offsets=None):
+        self.timestamps = timestamps or []
+        self.offsets = offsets or []
+
+    @classmethod
+    def read(cls, indexPath):
+        timestamps = []
+        offsets = []
+        for line in open(indexPath, 'rb'):
             try:
-                sentinel, timestampStr, msgSizeStr, attachmentsPath, msg = line.split(' ', 4)
-                timestamp = int(timestampStr)
-                msgSize = int(msgSizeStr)
+                timestampStr, offsetStr = line.split()
+                timestamps.append(int(timestampStr))
+                offsets.append(int(offsetStr))
             except ValueError:
-                print 'warning: bad log line parse in line %d' % (lineNum + 1)
-                print line
-                continue
-            msg = msg[:-1]  # chop newline
-            if sentinel != '@@@':
-                print 'warning: bad sentinel in line %d' % (lineNum + 1)
-                print line
-                continue
-            if len(msg) != msgSize:
-                print 'warning: bad message length %d != %d in line %d' % (len(msg), msgSize, lineNum + 1)
-                print line
-                continue
-            if attachmentsPath != '-':
-                print 'warning: zmqPlayback can not handle attachments in line %d' % (lineNum + 1)
-                print line
-                continue
+                # partial last line if the log is still being written
+                break
+        return cls(timestamps, offsets)
+
+    def findOffset(self, timestamp):
+        """
+        Returns the offset of an indexed record no later than the first
+        record with the specified timestamp or later.
+        """
+        i = bisect.bisect_left(self.timestamps, timestamp)
+        if i == 0:
+            return 0
+        return self.offsets[i - 1]
+
+
+def buildLogIndex(logPath,
+                  everyRecords=DEFAULT_INDEX_EVERY_RECORDS,
+                  everySeconds=DEFAULT_INDEX_EVERY_SECONDS):
+    """
+    Writes an index for an existing message log that doesn't have one.
+    """
+    indexWriter = LogIndexWriter(open(getIndexPath(logPath), 'wb'),
+                                 everyRecords, everySeconds)
+    logFile = open(logPath, 'rb')
+    for rec in LogParser(logFile):
+        indexWriter.add(rec.timestamp, rec.offset)
+    logFile.close()
+    indexWriter.close()
+
 
-            yield LogRecord(timestamp, attachmentsPath, msg)
+def getTopicIndexPath(logPath):
+    return logPath + TOPIC_INDEX_SUFFIX
+
+
+class TopicIndex(object):
+    """
+    The topic index of a message log lists each topic in the log with
+    its message count and first and last timestamps, so that tools like
+    zmqGrep can skip logs that can't contain the messages they want.
+    It is stored as JSON next to the log, along with the size of the
+    log when it was written. An index whose size doesn't match the log
+    is out of date and is ignored.
+    """
+
+    def __init__(self, topics=None, size=None):
+        # topic -> [count, firstTimestamp, lastTimestamp]
+        self.topics = topics or {}
+        self.size = size
+
+    def add(self, topic, timestamp):
+        entry = self.topics.get(topic)
+        if entry is None:
+            self.topics[topic] = [1, timestamp, timestamp]
+        else:
+            entry[0] += 1
+            if timestamp < entry[1]:
+                entry[1] = timestamp
+            elif timestamp > entry[2]:
+                entry[2] = timestamp
+
+    def mayContain(self, prefix, startTimestamp=None, endTimestamp=None):
+        """
+        Returns True if the log may contain messages whose text starts
+        with *prefix* and whose timestamps are in [startTimestamp,
+        endTimestamp). If *prefix* runs past the topic into the body,
+        only its topic part is checked.
+        """
+        colonIndex = prefix.find(':')
+        if colonIndex == -1:
+            isTopicMatch = lambda topic: topic.startswith(prefix)
+        else:
+            topicPrefix = prefix[:colonIndex]
+            isTopicMatch = lambda topic: topic == topicPrefix
+        for topic, (_count, first, last) in self.topics.iteritems():
+            if (isTopicMatch(topic)
+                    and (startTimestamp is None or last >= startTimestamp)
+                    and (endTimestamp is None or first < endTimestamp)):
+                return True
+        return False
+
+    @classmethod
+    def read(cls, logPath):
+        """
+        Returns the topic index for the log at *logPath*, or None if
+        there is no up-to-date index.
+        """
+        try:
+            indexData = json.loads(open(getTopicIndexPath(logPath), 'rb').read())
+            if indexData['size'] != os.path.getsize(logPath):
+                return None
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return cls(dict([(topic.encode('utf-8'), entry)
+                         for topic, entry in indexData['topics'].iteritems()]),
+                   indexData['size'])
+
+    def write(self, logPath, size):
+        indexPath = getTopicIndexPath(logPath)
+        # write then rename so readers never see a partial index
+        tmpPath = indexPath + '.tmp'
+        tmpFile = open(tmpPath, 'wb')
+        tmpFile.write(json.dumps({'size': size, 'topics': self.topics}, sort_keys=True))
+        tmpFile.close()
+        os.rename(tmpPath, indexPath)
+        self.size = size
+
+
+def buildTopicIndex(logPath):
+    """
+    Writes a topic index for an existing message log and returns it.
+    """
+    size = os.path.getsize(logPath)
+    index = TopicIndex()
+    logFile = open(logPath, 'rb')
+    for rec in LogParser(logFile):
+        index.add(rec.topic, rec.timestamp)
+    logFile.close()
+    index.write(logPath, size)
+    return index
+
+
+def getLogRanges(logPath, chunkBytes=DEFAULT_CHUNK_BYTES):
+    """
+    Splits a log into (logPath, startOffset, endOffset) byte ranges of
+    at least *chunkBytes* bytes that can be processed separately. Ranges
+    start at record offsets from the log index, so a log without an
+    index is a single range. endOffset is None for the last range.
+    """
+    indexPath = getIndexPath(logPath)
+    size = os.path.getsize(logPath)
+    if size <= chunkBytes or not os.path.exists(indexPath):
+        return [(logPath, 0, None)]
+    starts = [0]
+    for offset in LogIndex.read(indexPath).offsets:
+        if offset - starts[-1] >= chunkBytes and offset < size:
+            starts.append(offset)
+    ends = starts[1:] + [None]
+    return [(logPath, start, end) for start, end in zip(starts, ends)]
+
+
+class LogReader(object):
+    """
+    Random access to a message log by timestamp. Uses the sidecar index
+    written by zmqCentral if there is one, otherwise falls back to
+    scanning from the start of the log.
+
+    Example usage:
+
+    reader = LogReader('zmqCentral-messages-2012-07-13-10-00-00.txt')
+    for rec in reader.range(t0, t1):
+        print rec.msg
+    reader.close()
+    """
+
+    def __init__(self, logPath):
+        self.logPath = logPath
+        self.logFile = open(logPath, 'rb')
+        indexPath = getIndexPath(logPath)
+        if os.path.exists(indexPath):
+            self.index = LogIndex.read(indexPath)
+        else:
+            self.index = LogIndex()
+
+    def __iter__(self):
+        self.logFile.seek(0)
+        return iter(LogParser(self.logFile))
+
+    def seek(self, timestamp):
+        """
+        Returns an iterator over records starting with the first record
+        whose timestamp is *timestamp* or later.
+        """
+        self.logFile.seek(self.index.findOffset(timestamp))
+        found = False
+        for rec in LogParser(self.logFile):
+            if found or rec.timestamp >= timestamp:
+                found = True
+                yield rec
+
+    def range(self, startTimestamp, endTimestamp):
+        """
+        Returns an iterator over records with startTimestamp <=
+        timestamp < endTimestamp.
+        """
+        for rec in self.seek(startTimestamp):
+            if rec.timestamp >= endTimestamp:
+                break
+            yield rec
+
+    def close(self):
+        self.logFile.close()
+
+
+def mergeLogRecords(recordStreams, priorities=None):
+    """
+    Merges several streams of log records, each in timestamp order,
+    into one stream in timestamp order, for example to replay the logs
+    of several zmqCentral instances together. Yields (i, rec) pairs,
+    where i is the index of the stream that *rec* came from.
+
+    Only the next record of each stream is kept in memory. When records
+    from several streams have the same timestamp, the one from the
+    stream with the lowest value in *priorities* comes first. By
+    default, earlier streams win.
+    """
+    if priorities is None:
+        priorities = range(len(recordStreams))
+    iterators = [iter(stream) for stream in recordStreams]
+    heap = []
+    for i, iterator in enumerate(iterators):
+        rec = next(iterator, None)
+        if rec is not None:
+            heap.append((rec.timestamp, priorities[i], i, rec))
+    heapq.heapify(heap)
+
+    while len(heap) > 1:
+        _timestamp, priority, i, rec = heap[0]
+        yield i, rec
+        rec = next(iterators[i], None)
+        if rec is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (rec.timestamp, priority, i, rec))
+
+    if heap:
+        # only one stream left, no need to compare
+        _timestamp, _priority, i, rec = heap[0]
+        yield i, rec
+        for rec in iterators[i]:
+            yield i, rec
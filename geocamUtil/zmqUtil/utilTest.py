@@ -0,0 +1,158 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import shutil
+import unittest
+import tempfile
+from cStringIO import StringIO
+
+from geocamUtil.zmqUtil.util import (LogRecord,
+                                     LogParser,
+                                     LogReader,
+                                     LogIndexWriter,
+                                     getIndexPath,
+                                     buildLogIndex,
+                                     mergeLogRecords)
+
+NUM_RECORDS = 100
+START_TIMESTAMP = 1342172466000000
+STEP_US = 1000000
+
+
+def getTestRecords():
+    return [LogRecord(START_TIMESTAMP + i * STEP_US, '-', 'test.topic%d:{"i": %d}' % (i % 3, i))
+            for i in xrange(NUM_RECORDS)]
+
+
+class LogParserTest(unittest.TestCase):
+    def getLogText(self, records):
+        out = StringIO()
+        for rec in records:
+            rec.writeTo(out)
+        return out.getvalue()
+
+    def test_newlines(self):
+        records = [LogRecord(START_TIMESTAMP, '-', 'a.b:{"text": "x\n@@@ y\n"}'),
+                   LogRecord(START_TIMESTAMP + 1, '-', 'a.c:\n')]
+        parsed = list(LogParser(StringIO(self.getLogText(records))))
+        self.assertEqual([rec.msg for rec in parsed],
+                         [rec.msg for rec in records])
+        self.assertEqual([rec.topic for rec in parsed], ['a.b', 'a.c'])
+
+    def test_headerOnly(self):
+        records = getTestRecords()
+        records.insert(1, LogRecord(START_TIMESTAMP, '-', 'notopic'))
+        parsed = list(LogParser(StringIO(self.getLogText(records)), headerOnly=True))
+        self.assertEqual([rec.msgSize for rec in parsed],
+                         [len(rec.msg) for rec in records])
+        self.assertEqual([rec.timestamp for rec in parsed],
+                         [rec.timestamp for rec in records])
+        self.assertEqual([rec.topic for rec in parsed],
+                         [rec.topic for rec in records])
+        self.assertEqual(parsed[1].topic, 'notopic')
+        self.assertEqual(parsed[0].msg, None)
+
+    def test_resync(self):
+        text = self.getLogText(getTestRecords())
+        # corrupt the length field of the third record
+        msgSize = len(getTestRecords()[2].msg)
+        lines = text.split('\n')
+        lines[2] = lines[2].replace(' %d ' % msgSize, ' %d ' % (msgSize + 1), 1)
+        parsed = list(LogParser(StringIO('garbage\n' + '\n'.join(lines))))
+        self.assertEqual(len(parsed), NUM_RECORDS - 1)
+
+
+class LogReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp('-logReaderTestDir')
+        self.logPath = os.path.join(self.tempDir, 'messages.txt')
+        logFile = open(self.logPath, 'wb')
+        index = LogIndexWriter(open(getIndexPath(self.logPath), 'wb'), everyRecords=10)
+        for rec in getTestRecords():
+            index.add(rec.timestamp, logFile.tell())
+            rec.writeTo(logFile)
+        index.close()
+        logFile.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_parseOffsets(self):
+        logFile = open(self.logPath, 'rb')
+        for rec in LogParser(logFile):
+            logFile2 = open(self.logPath, 'rb')
+            logFile2.seek(rec.offset)
+            self.assertEqual(logFile2.readline().split(' ', 1)[1].split(' ', 1)[0],
+                             str(rec.timestamp))
+            logFile2.close()
+        logFile.close()
+
+    def checkRange(self, reader):
+        t0 = START_TIMESTAMP + 25 * STEP_US
+        t1 = START_TIMESTAMP + 42 * STEP_US
+        recs = list(reader.range(t0, t1))
+        self.assertEqual([r.msg for r in recs],
+                         [r.msg for r in getTestRecords()[25:42]])
+
+    def test_range(self):
+        reader = LogReader(self.logPath)
+        self.assertEqual(len(reader.index.offsets), NUM_RECORDS / 10)
+        self.checkRange(reader)
+        reader.close()
+
+    def test_seek(self):
+        reader = LogReader(self.logPath)
+        recs = list(reader.seek(START_TIMESTAMP + 90 * STEP_US + 1))
+        self.assertEqual(len(recs), 9)
+        self.assertEqual(list(reader.seek(0))[0].timestamp, START_TIMESTAMP)
+        reader.close()
+
+    def test_noIndex(self):
+        os.unlink(getIndexPath(self.logPath))
+        reader = LogReader(self.logPath)
+        self.checkRange(reader)
+        reader.close()
+
+    def test_buildIndex(self):
+        os.unlink(getIndexPath(self.logPath))
+        buildLogIndex(self.logPath, everyRecords=7)
+        reader = LogReader(self.logPath)
+        self.assertEqual(len(reader.index.offsets), 15)
+        self.checkRange(reader)
+        reader.close()
+
+
+class MergeLogRecordsTest(unittest.TestCase):
+    def test_merge(self):
+        records = getTestRecords()
+        streams = [records[0::3], records[1::3], [], records[2::3]]
+        merged = list(mergeLogRecords(streams))
+        self.assertEqual([rec.msg for _i, rec in merged],
+                         [rec.msg for rec in records])
+        self.assertEqual([i for i, _rec in merged][:6], [0, 1, 3, 0, 1, 3])
+
+    def test_ties(self):
+        streams = [[LogRecord(START_TIMESTAMP + t, '-', 'a%d:{}' % t) for t in (0, 1, 1)],
+                   [LogRecord(START_TIMESTAMP + t, '-', 'b%d:{}' % t) for t in (1, 2)]]
+        self.assertEqual([rec.msg for _i, rec in mergeLogRecords(streams)],
+                         ['a0:{}', 'a1:{}', 'a1:{}', 'b1:{}', 'b2:{}'])
+        self.assertEqual([rec.msg for _i, rec in mergeLogRecords(streams, priorities=[1, 0])],
+                         ['a0:{}', 'b1:{}', 'a1:{}', 'a1:{}', 'b2:{}'])
+
+
+if __name__ == '__main__':
+    unittest.main()
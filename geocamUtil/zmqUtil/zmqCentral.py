@@ -22,7 +22,7 @@ import datetime
 import time
 import traceback
 import atexit
-import random
+import heapq
 
 import zmq
 from zmq.eventloop.zmqstream import ZMQStream
@@ -34,10 +34,26 @@ from geocamUtil import anyjson as json
 from geocamUtil.zmqUtil.util import (DEFAULT_CENTRAL_RPC_PORT,
                                      DEFAULT_CENTRAL_SUBSCRIBE_PORT,
                                      DEFAULT_CENTRAL_PUBLISH_PORT,
+                                     DEFAULT_INDEX_EVERY_RECORDS,
+                                     DEFAULT_INDEX_EVERY_SECONDS,
+                                     DEFAULT_HIGH_WATER_MARK,
+                                     LoadMeter,
                                      getTimestamp,
+                                     hasBacklog,
                                      parseEndpoint,
                                      hasAttachments,
-                                     parseMessage)
+                                     parseMessage,
+                                     parseMultipartMessage)
+from geocamUtil.zmqUtil.attachmentStore import AttachmentStore
+from geocamUtil.zmqUtil.codec import decodeBody, CODEC_MARKER
+from geocamUtil.zmqUtil.topicStats import TopicStats, DEFAULT_PREFIX_DEPTH
+from geocamUtil.zmqUtil.logFilter import LogFilter, parseRateSpec
+from geocamUtil.zmqUtil.logWriter import (LogWriter,
+                                          DEFAULT_FLUSH_BYTES,
+                                          DEFAULT_FLUSH_MSECS,
+                                          DEFAULT_BLOCK_BYTES,
+                                          DEFAULT_COMPRESS_LEVEL,
+                                          FSYNC_CHOICES)
 
 # pylint: disable=E1101
 
@@ -47,12 +63,24 @@ MONITOR_ENDPOINT = 'inproc://monitor'
 INJECT_ENDPOINT = 'inproc://inject'
 
 
+def isSlowSubscriber(params):
+    subscriberStats = params.get('subscriber', None)
+    return isinstance(subscriberStats, dict) and subscriberStats.get('slow', False)
+
+
 class ZmqCentral(object):
     def __init__(self, opts):
         self.opts = opts
         self.info = {}
-        self.messageLogPath = None
+        self.expiryQueue = []
         self.messageLog = None
+        self.logFilter = None
+        self.attachmentStore = None
+        self.lastValuePrefixes = ()
+        self.lastValues = {}
+        self.stats = None
+        self.statsTimer = None
+        self.loadMeter = LoadMeter()
         self.rpcStream = None
         self.disconnectTimer = None
         self.injectStream = None
@@ -74,37 +102,20 @@ class ZmqCentral(object):
                                   json.dumps({'timestamp': str(getTimestamp())})))
 
     def logMessage(self, msg, posixTime=None, attachmentDir='-'):
-        mlog = self.messageLog
-        mlog.write('@@@ %d %d %s ' % (getTimestamp(posixTime), len(msg), attachmentDir))
-        mlog.write(msg)
-        mlog.write('\n')
+        self.messageLog.write(getTimestamp(posixTime), attachmentDir, msg)
 
     def logMessageWithAttachments0(self, msg):
         parsed = parseMessage(msg)
         posixTime = time.time()
 
-        # construct attachment directory
-        dt = datetime.datetime.utcfromtimestamp(posixTime)
-        dateText = dt.strftime('%Y-%m-%d')
-        timeText = dt.strftime('%H-%M-%S') + '.%06d' % dt.microsecond
-        uniq = '%08x' % random.getrandbits(32)
-        attachmentSuffix = os.path.join('attachments',
-                                        dateText,
-                                        timeText,
-                                        parsed['topic'],
-                                        uniq)
-        attachmentPath = os.path.join(self.logDir, attachmentSuffix)
-        os.makedirs(attachmentPath)
-
-        # write attachments to attachment directory
-        for attachment in parsed['attachments']:
-            fullName = os.path.join(attachmentPath, attachment.get_filename())
-            open(fullName, 'wb').write(attachment.get_payload())
-
-        # log message with a pointer to the attachment directory
+        # write attachments to the content-addressed store. attachments
+        # that publishers send repeatedly are only stored once.
+        attachmentRef = self.attachmentStore.storeAttachments(parsed['attachments'])
+
+        # log message with a pointer to the attachments
         self.logMessage(':'.join((parsed['topic'], parsed['json'])),
                         posixTime,
-                        attachmentSuffix)
+                        attachmentRef)
 
     def logMessageWithAttachments(self, msg):
         try:
@@ -112,6 +123,13 @@ class ZmqCentral(object):
         except:  # pylint: disable=W0702
             self.logException('logging message with attachments')
 
+    def logMessageWithAttachmentData(self, msg, attachments):
+        try:
+            attachmentRef = self.attachmentStore.storeAttachmentData(attachments)
+            self.logMessage(msg, None, attachmentRef)
+        except:  # pylint: disable=W0702
+            self.logException('logging message with attachments')
+
     def handleHeartbeat(self, params):
         moduleName = params['module'].encode('utf-8')
         now = getTimestamp()
@@ -124,14 +142,65 @@ class ZmqCentral(object):
         else:
             self.announceConnect(moduleName, params)
 
+        if isSlowSubscriber(params) and not (oldInfo and isSlowSubscriber(oldInfo)):
+            logging.warning('module %s subscriber is falling behind: %s',
+                            moduleName, params['subscriber'])
+
         self.info[moduleName] = params
         keepalive = params.get('keepalive', DEFAULT_KEEPALIVE_US)
         params['timeout'] = now + keepalive
+        if oldInfo is None or oldInfo.get('timeout', None) is None:
+            # later heartbeats just push back the timeout, and
+            # handleDisconnectTimer() reschedules the module lazily
+            heapq.heappush(self.expiryQueue, (params['timeout'], moduleName))
         return 'ok'
 
     def handleInfo(self):
         return self.info
 
+    def handleStats(self):
+        result = self.stats.getStats()
+        result['monitor'] = self.loadMeter.getStats()
+        slowSubscribers = []
+        numDropped = 0
+        for moduleName, params in self.info.iteritems():
+            if isSlowSubscriber(params):
+                slowSubscribers.append(moduleName)
+            subscriberStats = params.get('subscriber', None)
+            if isinstance(subscriberStats, dict):
+                numDropped += subscriberStats.get('dropped', 0)
+        result['slowSubscribers'] = sorted(slowSubscribers)
+        result['subscriberDropped'] = numDropped
+        if self.logFilter:
+            result['logFilter'] = {'logged': self.logFilter.numLogged,
+                                   'dropped': self.logFilter.numDropped}
+        return result
+
+    def publishStats(self):
+        self.injectStream.send('central.stats:%s' % json.dumps(self.handleStats()))
+
+    def cacheLastValue(self, msg):
+        colonIndex = msg.find(':')
+        topic = msg[:colonIndex]
+        if topic.startswith(self.lastValuePrefixes):
+            self.lastValues[topic] = msg
+
+    def handleSnapshot(self, params):
+        """
+        Returns the latest cached message body for each topic matching
+        one of params['prefixes'], as a dict topic -> body.
+        """
+        prefixes = tuple([prefix.encode('utf-8') for prefix in params.get('prefixes', [''])])
+        result = {}
+        for topic, msg in self.lastValues.iteritems():
+            if topic.startswith(prefixes):
+                body = msg[(len(topic) + 1):]
+                if body.startswith(CODEC_MARKER):
+                    # the RPC response is JSON, so re-encode binary bodies
+                    body = json.dumps(decodeBody(body))
+                result[topic] = body
+        return result
+
     def logException(self, whileClause):
         errClass, errObject, errTB = sys.exc_info()[:3]
         errText = '%s.%s: %s' % (errClass.__module__,
@@ -143,17 +212,62 @@ class ZmqCentral(object):
 
     def handleMessages(self, messages):
         for msg in messages:
-            if self.messageLog:
-                if hasAttachments(msg):
-                    self.logMessageWithAttachments(msg)
-                else:
-                    self.logMessage(msg)
-            if msg.startswith('central.heartbeat.'):
-                try:
-                    _topic, body = msg.split(':', 1)
-                    self.handleHeartbeat(json.loads(body))
-                except:  # pylint: disable=W0702
-                    self.logException('handling heartbeat')
+            self.handleMessage(msg)
+
+    def handleFrames(self, frames):
+        """
+        Handles a message from the monitor socket, received with
+        copy=False. The forwarder device passes messages through
+        without touching them; this is only a tap for logging and
+        bookkeeping, so for multipart messages it avoids copying the
+        attachment frames.
+        """
+        startTime = time.time()
+        if len(frames) == 1:
+            self.handleMessage(frames[0].bytes)
+        else:
+            try:
+                parsed = parseMultipartMessage(frames)
+            except:  # pylint: disable=W0702
+                self.logException('parsing multipart message')
+            else:
+                self.handleMessage('%s:%s' % (parsed['topic'], parsed['json']),
+                                   parsed['attachments'],
+                                   sum([len(frame) for frame in frames]))
+        backlogged = self.monStream is not None and hasBacklog(self.monStream)
+        self.loadMeter.add(startTime, time.time(), backlogged=backlogged)
+
+    def handleMessage(self, msg, attachments=None, size=None):
+        """
+        Handles a message. For a multipart message, *msg* is the message
+        without its attachments and *attachments* is a list of
+        attachment dicts (see parseMultipartMessage()).
+        """
+        if attachments is None:
+            legacyAttachments = hasAttachments(msg)
+            msgHasAttachments = legacyAttachments
+        else:
+            legacyAttachments = False
+            msgHasAttachments = bool(attachments)
+        if self.messageLog and (self.logFilter is None
+                                or self.logFilter.shouldLog(msg[:msg.find(':')],
+                                                            getTimestamp())):
+            if legacyAttachments:
+                self.logMessageWithAttachments(msg)
+            elif msgHasAttachments:
+                self.logMessageWithAttachmentData(msg, attachments)
+            else:
+                self.logMessage(msg)
+        if self.lastValuePrefixes and not msgHasAttachments:
+            self.cacheLastValue(msg)
+        if self.stats:
+            self.stats.addMessage(msg, checkLatency=not legacyAttachments, size=size)
+        if msg.startswith('central.heartbeat.'):
+            try:
+                _topic, body = msg.split(':', 1)
+                self.handleHeartbeat(decodeBody(body))
+            except:  # pylint: disable=W0702
+                self.logException('handling heartbeat')
 
     def handleRpcCall(self, messages):
         for msg in messages:
@@ -166,9 +280,13 @@ class ZmqCentral(object):
 
             try:
                 method = call['method']
-                _params = call['params']
+                params = call['params']
                 if method == 'info':
                     result = self.handleInfo()
+                elif method == 'snapshot':
+                    result = self.handleSnapshot(params)
+                elif method == 'stats':
+                    result = self.handleStats()
                 else:
                     raise ValueError('unknown method %s' % method)
                 self.rpcStream.send(json.dumps({'result': result,
@@ -185,15 +303,24 @@ class ZmqCentral(object):
                                                 'id': callId}))
 
     def handleDisconnectTimer(self):
+        # expiryQueue is a heap with one entry per module that sends
+        # heartbeats, so we only look at modules whose last known
+        # timeout has passed
         now = getTimestamp()
-        disconnectModules = []
-        for moduleName, entry in self.info.iteritems():
+        queue = self.expiryQueue
+        while queue and queue[0][0] < now:
+            _scheduled, moduleName = heapq.heappop(queue)
+            entry = self.info.get(moduleName, None)
+            if entry is None:
+                continue
             timeout = entry.get('timeout', None)
-            if timeout is not None and now > timeout:
-                disconnectModules.append(moduleName)
-        for moduleName in disconnectModules:
-            self.announceDisconnect(moduleName)
-            del self.info[moduleName]
+            if timeout is None:
+                continue
+            if now > timeout:
+                self.announceDisconnect(moduleName)
+                del self.info[moduleName]
+            else:
+                heapq.heappush(queue, (timeout, moduleName))
 
     def readyLog(self, pathTemplate, timestamp):
         if '%s' in pathTemplate:
@@ -220,9 +347,8 @@ class ZmqCentral(object):
         # open log files
         now = datetime.datetime.utcnow()
         self.logDir = os.path.abspath(self.opts.logDir)
-        if self.opts.messageLog != 'none':
-            self.messageLogPath = self.readyLog(self.opts.messageLog, now)
-            self.messageLog = open(self.messageLogPath, 'a')
+        self.lastValuePrefixes = tuple(self.opts.cacheTopic)
+        self.stats = TopicStats(self.opts.statsDepth)
         if self.opts.consoleLog != 'none':
             self.consoleLogPath = self.readyLog(self.opts.consoleLog, now)
 
@@ -263,6 +389,32 @@ class ZmqCentral(object):
             os.dup2(nullFd, 2)
 
         try:
+            # start the message log writer thread (after daemonizing,
+            # since threads don't survive fork)
+            if self.opts.messageLog != 'none':
+                if (self.opts.logInclude or self.opts.logExclude
+                        or self.opts.logDecimate or self.opts.logMaxRate):
+                    self.logFilter = LogFilter(include=self.opts.logInclude,
+                                               exclude=self.opts.logExclude,
+                                               decimate=[parseRateSpec(spec)
+                                                         for spec in self.opts.logDecimate],
+                                               maxRate=[parseRateSpec(spec)
+                                                        for spec in self.opts.logMaxRate])
+                self.messageLog = LogWriter(self.logDir,
+                                            self.opts.messageLog,
+                                            flushBytes=self.opts.logFlushBytes,
+                                            flushMsecs=self.opts.logFlushMsecs,
+                                            fsync=self.opts.logFsync,
+                                            rotateBytes=self.opts.logRotateBytes,
+                                            rotateHourly=self.opts.logRotateHourly,
+                                            compress=self.opts.logCompress,
+                                            compressLevel=self.opts.logCompressLevel,
+                                            blockBytes=self.opts.logBlockBytes,
+                                            indexEveryRecords=self.opts.indexEveryRecords,
+                                            indexEverySeconds=self.opts.indexEverySeconds)
+                self.messageLog.start(getTimestamp())
+                self.attachmentStore = AttachmentStore(self.logDir)
+
             # set up zmq
             self.context = zmq.Context.instance()
             self.rpcStream = ZMQStream(self.context.socket(zmq.REP))
@@ -274,7 +426,8 @@ class ZmqCentral(object):
             self.forwarder.setsockopt_in(zmq.IDENTITY, THIS_MODULE)
             self.forwarder.setsockopt_out(zmq.IDENTITY, THIS_MODULE)
             self.forwarder.setsockopt_in(zmq.SUBSCRIBE, '')
-            # self.forwarder.setsockopt_out(zmq.HWM, self.opts.highWaterMark)
+            self.forwarder.setsockopt_in(zmq.RCVHWM, self.opts.recvHighWaterMark)
+            self.forwarder.setsockopt_out(zmq.SNDHWM, self.opts.sendHighWaterMark)
             self.forwarder.bind_in(self.opts.subscribeEndpoint)
             logging.info('bound subscribeEndpoint %s', self.opts.subscribeEndpoint)
             self.forwarder.bind_in(INJECT_ENDPOINT)
@@ -294,9 +447,10 @@ class ZmqCentral(object):
             time.sleep(0.1)  # wait for forwarder to bind sockets
 
             self.monStream = ZMQStream(self.context.socket(zmq.SUB))
+            self.monStream.setsockopt(zmq.RCVHWM, self.opts.recvHighWaterMark)
             self.monStream.setsockopt(zmq.SUBSCRIBE, '')
             self.monStream.connect(MONITOR_ENDPOINT)
-            self.monStream.on_recv(self.handleMessages)
+            self.monStream.on_recv(self.handleFrames, copy=False)
 
             self.injectStream = ZMQStream(self.context.socket(zmq.PUB))
             self.injectStream.connect(INJECT_ENDPOINT)
@@ -304,6 +458,11 @@ class ZmqCentral(object):
             self.disconnectTimer = ioloop.PeriodicCallback(self.handleDisconnectTimer, 5000)
             self.disconnectTimer.start()
 
+            if self.opts.statsPeriodMsecs > 0:
+                self.statsTimer = ioloop.PeriodicCallback(self.publishStats,
+                                                          self.opts.statsPeriodMsecs)
+                self.statsTimer.start()
+
         except:  # pylint: disable=W0702
             errClass, errObject, errTB = sys.exc_info()[:3]
             errText = '%s.%s: %s' % (errClass.__module__,
@@ -318,6 +477,9 @@ class ZmqCentral(object):
         if self.messageLog:
             self.messageLog.close()
             self.messageLog = None
+        if self.statsTimer:
+            self.statsTimer.stop()
+            self.statsTimer = None
 
 
 def main():
@@ -339,21 +501,80 @@ def main():
                       default=[],
                       action='append',
                       help='Non-central-aware publisher to subscribe to (format "<moduleName>@<endpoint>"; can specify multiple times)')
+    parser.add_option('--cacheTopic',
+                      default=[],
+                      action='append',
+                      help='Remember the latest message for topics with this prefix, for the "snapshot" RPC method (can specify multiple times)')
+    parser.add_option('--statsDepth',
+                      default=DEFAULT_PREFIX_DEPTH, type='int',
+                      help='Number of dot-separated topic components to group traffic statistics by [%default]')
+    parser.add_option('--statsPeriodMsecs',
+                      default=10000, type='int',
+                      help='Period for publishing traffic statistics on the central.stats topic, or 0 to disable [%default]')
     parser.add_option('-d', '--logDir',
                       default='log',
                       help='Directory to place logs in [%default]')
     parser.add_option('-m', '--messageLog',
                       default='zmqCentral-messages-%s.txt',
                       help='Log file for message traffic, or "none" [%default]')
+    parser.add_option('--logFlushBytes',
+                      default=DEFAULT_FLUSH_BYTES, type='int',
+                      help='Write buffered message log records when this many bytes are pending [%default]')
+    parser.add_option('--logFlushMsecs',
+                      default=DEFAULT_FLUSH_MSECS, type='int',
+                      help='Write buffered message log records at least this often [%default]')
+    parser.add_option('--logFsync',
+                      default='none', choices=FSYNC_CHOICES,
+                      help='When to fsync the message log: %s [%%default]' % ', '.join(FSYNC_CHOICES))
+    parser.add_option('--logRotateBytes',
+                      default=0, type='int',
+                      help='Start a new message log segment when the current one reaches this size, or 0 for no limit [%default]')
+    parser.add_option('--logRotateHourly',
+                      action='store_true', default=False,
+                      help='Start a new message log segment every hour')
+    parser.add_option('--logCompress',
+                      action='store_true', default=False,
+                      help='Write the message log as independently compressed blocks')
+    parser.add_option('--logCompressLevel',
+                      default=DEFAULT_COMPRESS_LEVEL, type='int',
+                      help='zlib compression level for --logCompress [%default]')
+    parser.add_option('--logBlockBytes',
+                      default=DEFAULT_BLOCK_BYTES, type='int',
+                      help='Amount of message data per compressed block for --logCompress [%default]')
+    parser.add_option('--logInclude',
+                      default=[],
+                      action='append',
+                      help='Log topics with this prefix; if specified, unmatched topics are not logged (can specify multiple times)')
+    parser.add_option('--logExclude',
+                      default=[],
+                      action='append',
+                      help='Do not log topics with this prefix; the longest matching include/exclude prefix wins (can specify multiple times)')
+    parser.add_option('--logDecimate',
+                      default=[],
+                      action='append',
+                      help='Log only 1 of every N messages on each topic matching a prefix (format "<topicPrefix>:<N>"; can specify multiple times)')
+    parser.add_option('--logMaxRate',
+                      default=[],
+                      action='append',
+                      help='Log at most N messages per second on each topic matching a prefix (format "<topicPrefix>:<N>"; can specify multiple times)')
+    parser.add_option('--indexEveryRecords',
+                      default=DEFAULT_INDEX_EVERY_RECORDS, type='int',
+                      help='Add a message log index entry at least every N records, or 0 for no index [%default]')
+    parser.add_option('--indexEverySeconds',
+                      default=DEFAULT_INDEX_EVERY_SECONDS, type='float',
+                      help='Add a message log index entry at least every N seconds [%default]')
     parser.add_option('-c', '--consoleLog',
                       default='zmqCentral-console-%s.txt',
                       help='Log file for debugging zmqCentral [%default]')
     parser.add_option('-f', '--foreground',
                       action='store_true', default=False,
                       help='Do not daemonize zmqCentral on startup')
-    #parser.add_option('--highWaterMark',
-    #                  default=10000, type='int',
-    #                  help='High-water mark for publish socket (see 0MQ docs) [%default]')
+    parser.add_option('--sendHighWaterMark',
+                      default=DEFAULT_HIGH_WATER_MARK, type='int',
+                      help='High-water mark for messages queued to each subscriber (see 0MQ docs) [%default]')
+    parser.add_option('--recvHighWaterMark',
+                      default=DEFAULT_HIGH_WATER_MARK, type='int',
+                      help='High-water mark for messages queued from each publisher (see 0MQ docs) [%default]')
     opts, args = parser.parse_args()
     if args:
         parser.error('expected no args')
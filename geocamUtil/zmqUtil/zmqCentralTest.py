@@ -0,0 +1,120 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import unittest
+
+import zmq
+
+from geocamUtil.zmqUtil import zmqCentral
+from geocamUtil.zmqUtil.zmqCentral import ZmqCentral
+from geocamUtil.zmqUtil.topicStats import TopicStats
+
+
+class FakeStream(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+class ZmqCentralTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000000000
+        self.oldGetTimestamp = zmqCentral.getTimestamp
+        zmqCentral.getTimestamp = lambda posixTime=None: self.now
+        self.central = ZmqCentral(None)
+        self.central.injectStream = FakeStream()
+
+    def tearDown(self):
+        zmqCentral.getTimestamp = self.oldGetTimestamp
+
+    def getAnnouncements(self, prefix):
+        return [msg.split(':', 1)[0] for msg in self.central.injectStream.sent
+                if msg.startswith(prefix)]
+
+    def test_keepalive(self):
+        central = self.central
+        central.handleHeartbeat({'module': u'a', 'keepalive': 10})
+        central.handleHeartbeat({'module': u'b', 'keepalive': 20})
+        self.assertEqual(self.getAnnouncements('central.connect.'),
+                         ['central.connect.a', 'central.connect.b'])
+
+        self.now += 15
+        central.handleHeartbeat({'module': u'a', 'keepalive': 10})
+        central.handleDisconnectTimer()
+        self.assertEqual(sorted(central.info.keys()), ['a', 'b'])
+
+        self.now += 10
+        central.handleDisconnectTimer()
+        self.assertEqual(sorted(central.info.keys()), ['a'])
+        self.assertEqual(self.getAnnouncements('central.disconnect.'),
+                         ['central.disconnect.b'])
+
+        self.now += 10
+        central.handleDisconnectTimer()
+        self.assertEqual(central.info, {})
+        self.assertEqual(central.expiryQueue, [])
+
+    def test_reconnect(self):
+        central = self.central
+        central.handleHeartbeat({'module': u'a', 'keepalive': 10})
+        self.now += 20
+        central.handleDisconnectTimer()
+        central.handleHeartbeat({'module': u'a', 'keepalive': 10})
+        self.now += 5
+        central.handleDisconnectTimer()
+        self.assertEqual(central.info.keys(), ['a'])
+        self.assertEqual(len(central.expiryQueue), 1)
+
+    def test_snapshot(self):
+        central = self.central
+        central.lastValuePrefixes = ('state.', 'status.')
+        central.handleMessages(['state.a:1', 'state.b:2', 'state.a:3',
+                                'status.c:4', 'sensor.d:5'])
+        self.assertEqual(central.handleSnapshot({'prefixes': [u'state.']}),
+                         {'state.a': '3', 'state.b': '2'})
+        self.assertEqual(central.handleSnapshot({}),
+                         {'state.a': '3', 'state.b': '2', 'status.c': '4'})
+
+    def test_multipart(self):
+        central = self.central
+        central.lastValuePrefixes = ('state.',)
+        central.handleFrames([zmq.Frame('state.a:1')])
+        central.handleFrames([zmq.Frame('state.a:'), zmq.Frame('2')])
+        central.handleFrames([zmq.Frame('state.b:'), zmq.Frame('3'),
+                              zmq.Frame('[{"filename": "x", "contentType": "text/plain"}]'),
+                              zmq.Frame('xyz')])
+        central.handleFrames([zmq.Frame('central.heartbeat.a:'),
+                              zmq.Frame('{"module": "a", "keepalive": 10}')])
+        self.assertEqual(central.handleSnapshot({}), {'state.a': '2'})
+        self.assertEqual(central.info.keys(), ['a'])
+
+    def test_slowSubscriber(self):
+        central = self.central
+        central.stats = TopicStats()
+        central.handleHeartbeat({'module': u'a',
+                                 'subscriber': {'slow': False, 'dropped': 0}})
+        central.handleHeartbeat({'module': u'b',
+                                 'subscriber': {'slow': True, 'dropped': 5}})
+        central.handleHeartbeat({'module': u'c'})
+        stats = central.handleStats()
+        self.assertEqual(stats['slowSubscribers'], ['b'])
+        self.assertEqual(stats['subscriberDropped'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
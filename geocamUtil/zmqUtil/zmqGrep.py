@@ -15,15 +15,152 @@
 # specific language governing permissions and limitations under the License.
 #__END_LICENSE__
 
+import os
+import re
+import sys
 import logging
 
 from zmq.eventloop import ioloop
 ioloop.install()
 
-from geocamUtil.zmqUtil.util import zmqLoop
+from geocamUtil.zmqUtil.util import (zmqLoop,
+                                     LogReader,
+                                     TopicIndex,
+                                     parseTimestampArg)
 from geocamUtil.zmqUtil.subscriber import ZmqSubscriber
+from geocamUtil.zmqUtil.codec import decodeBody
 from geocamUtil import anyjson as json
 
+PREDICATE_REGEX = re.compile(r'^([\w.\-]+)\s*(==|=|!=|<=|>=|<|>)\s*(.*)$')
+MISSING = object()
+
+
+class FieldPredicate(object):
+    """
+    A condition on a field of a JSON message, parsed from text like
+    'data.fields.depth>=0.5' or 'module=resolveBridge'. The field name
+    is a dotted path into the message, with numbers indexing lists. The
+    value is parsed as JSON if possible and is a string otherwise.
+    Messages without the field don't match.
+    """
+
+    def __init__(self, text):
+        match = PREDICATE_REGEX.match(text)
+        if not match:
+            raise ValueError('could not parse condition "%s"' % text)
+        fieldPath, self.op, valueText = match.groups()
+        self.fieldPath = fieldPath.split('.')
+        try:
+            self.value = json.loads(valueText)
+        except ValueError:
+            self.value = valueText
+
+    def getField(self, obj):
+        for part in self.fieldPath:
+            if isinstance(obj, dict):
+                obj = obj.get(part, MISSING)
+            elif isinstance(obj, list) and part.isdigit() and int(part) < len(obj):
+                obj = obj[int(part)]
+            else:
+                return MISSING
+        return obj
+
+    def __call__(self, obj):
+        fieldValue = self.getField(obj)
+        if fieldValue is MISSING:
+            return False
+        if self.op in ('=', '=='):
+            return fieldValue == self.value
+        if self.op == '!=':
+            return fieldValue != self.value
+        if not isComparable(fieldValue, self.value):
+            return False
+        if self.op == '<':
+            return fieldValue < self.value
+        if self.op == '<=':
+            return fieldValue <= self.value
+        if self.op == '>':
+            return fieldValue > self.value
+        return fieldValue >= self.value
+
+
+def isNumber(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+def isComparable(a, b):
+    return ((isNumber(a) and isNumber(b))
+            or (isinstance(a, basestring) and isinstance(b, basestring)))
+
+
+def matchesPredicates(body, predicates):
+    if not predicates:
+        return True
+    try:
+        obj = decodeBody(body)
+    except ValueError:
+        return False
+    for predicate in predicates:
+        if not predicate(obj):
+            return False
+    return True
+
+
+def grepLog(logPath, prefix, handler,
+            startTimestamp=None, endTimestamp=None, predicates=(),
+            writeIndex=False):
+    """
+    Calls handler(topic, body) for the messages in the log at *logPath*
+    that start with *prefix*, have timestamps in [startTimestamp,
+    endTimestamp) and match all *predicates*. Returns False if the
+    log's topic index shows that it has no such messages, so it was
+    skipped, or True otherwise.
+
+    Logs without an up-to-date topic index are scanned in full. If
+    *writeIndex* is set, the index is written as well, to speed up
+    later searches.
+    """
+    topicIndex = TopicIndex.read(logPath)
+    if topicIndex is not None and not topicIndex.mayContain(prefix, startTimestamp, endTimestamp):
+        return False
+
+    reader = LogReader(logPath)
+    if topicIndex is None and writeIndex:
+        # building the index takes a full scan
+        newIndex = TopicIndex()
+        logSize = os.path.getsize(logPath)
+        records = iter(reader)
+    else:
+        newIndex = None
+        if startTimestamp is None:
+            records = iter(reader)
+        else:
+            records = reader.seek(startTimestamp)
+
+    for rec in records:
+        if newIndex is not None:
+            newIndex.add(rec.topic, rec.timestamp)
+        elif endTimestamp is not None and rec.timestamp >= endTimestamp:
+            break
+        # records hold the whole message, so match the prefix against it
+        # directly. without a ':' this is the same as matching the topic.
+        if not rec.msg.startswith(prefix):
+            continue
+        if ((startTimestamp is not None and rec.timestamp < startTimestamp)
+                or (endTimestamp is not None and rec.timestamp >= endTimestamp)):
+            continue
+        topic, body = rec.msg.split(':', 1)
+        if matchesPredicates(body, predicates):
+            handler(topic, body)
+    reader.close()
+
+    if newIndex is not None:
+        try:
+            newIndex.write(logPath, logSize)
+        except (IOError, OSError), e:
+            logging.warning('could not write topic index for %s: %s', logPath, e)
+    return True
+
 
 def handleMessagePretty(topic, obj):
     print topic
@@ -34,25 +171,81 @@ def handleMessageSimple(topic, body):
     print '%s: %s' % (topic, body)
 
 
+def getRawHandler(opts):
+    if opts.pretty:
+        return lambda topic, body: handleMessagePretty(topic, decodeBody(body))
+    else:
+        return handleMessageSimple
+
+
+def grepLogs(opts, prefix, logPaths, predicates):
+    handler = getRawHandler(opts)
+    startTimestamp = None
+    if opts.start:
+        startTimestamp = parseTimestampArg(opts.start)
+    endTimestamp = None
+    if opts.end:
+        endTimestamp = parseTimestampArg(opts.end)
+
+    numSkipped = 0
+    for logPath in logPaths:
+        if not grepLog(logPath, prefix, handler, startTimestamp, endTimestamp, predicates,
+                       opts.writeIndex):
+            numSkipped += 1
+    print >> sys.stderr, ('searched %d logs, skipped %d using topic indexes'
+                          % (len(logPaths) - numSkipped, numSkipped))
+
+
 def main():
     import optparse
-    parser = optparse.OptionParser('usage: %prog <prefix>')
+    parser = optparse.OptionParser('usage: %prog <prefix> [<messages.txt> ...]\n\n'
+                                   'Prints messages from the bus, or from message logs if any are specified.')
     parser.add_option('-p', '--pretty',
                       action='store_true', default=False,
                       help='Pretty-print JSON objects')
+    parser.add_option('-w', '--where',
+                      action='append', default=[],
+                      help='Only print JSON messages with a matching field, like "data.pk=12" or "lat>37.4" (can specify multiple times)')
+    parser.add_option('--start',
+                      help='With logs, only print messages at this time or later (microseconds since the epoch, or UTC like 2012-07-13T10:00:00)')
+    parser.add_option('--end',
+                      help='With logs, only print messages before this time')
+    parser.add_option('--writeIndex',
+                      action='store_true', default=False,
+                      help='Write topic indexes for logs that are missing them, to speed up later searches')
     ZmqSubscriber.addOptions(parser, 'zmqGrep')
     opts, args = parser.parse_args()
-    if len(args) != 1:
-        parser.error('expected exactly 1 arg')
+    if len(args) < 1:
+        parser.error('expected a topic prefix')
+    try:
+        predicates = [FieldPredicate(text) for text in opts.where]
+        for timeOpt in ('start', 'end'):
+            if getattr(opts, timeOpt):
+                parseTimestampArg(getattr(opts, timeOpt))
+    except ValueError, e:
+        parser.error(str(e))
     logging.basicConfig(level=logging.DEBUG)
 
+    topic = args[0]
+    if len(args) > 1:
+        grepLogs(opts, topic, args[1:], predicates)
+        return
+    if opts.start or opts.end or opts.writeIndex:
+        parser.error('--start, --end and --writeIndex require log files')
+
     # set up networking
     s = ZmqSubscriber(**ZmqSubscriber.getOptionValues(opts))
     s.start()
 
     # subscribe to the message we want
-    topic = args[0]
-    if opts.pretty:
+    if predicates:
+        rawHandler = getRawHandler(opts)
+
+        def handleMatchingMessage(topic, body):
+            if matchesPredicates(body, predicates):
+                rawHandler(topic, body)
+        s.subscribeRaw(topic, handleMatchingMessage)
+    elif opts.pretty:
         s.subscribeJson(topic, handleMessagePretty)
     else:
         s.subscribeRaw(topic, handleMessageSimple)
@@ -0,0 +1,98 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from geocamUtil.zmqUtil.util import TopicIndex, getTopicIndexPath
+from geocamUtil.zmqUtil.logWriter import LogWriter
+from geocamUtil.zmqUtil.zmqGrep import FieldPredicate, grepLog
+
+START_TIMESTAMP = 1342170000000000
+
+
+class ZmqGrepTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp('-zmqGrepTestDir')
+        self.logPaths = []
+        for logNum, topics in enumerate((('a.x', 'b'), ('b',))):
+            logPath = 'messages%d.txt' % logNum
+            writer = LogWriter(self.tempDir, logPath)
+            writer.start(START_TIMESTAMP)
+            for i in xrange(100):
+                writer.write(START_TIMESTAMP + i, '-',
+                             '%s:{"i": %d, "data": {"even": %s}}'
+                             % (topics[i % len(topics)], i, ['true', 'false'][i % 3 != 0]))
+            writer.close()
+            self.logPaths.append(os.path.join(self.tempDir, logPath))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def grep(self, logNum, prefix, startTimestamp=None, endTimestamp=None, predicates=(),
+             writeIndex=False):
+        matches = []
+        searched = grepLog(self.logPaths[logNum], prefix,
+                           lambda topic, body: matches.append(topic),
+                           startTimestamp, endTimestamp, predicates, writeIndex)
+        return searched, len(matches)
+
+    def test_topicIndex(self):
+        index = TopicIndex.read(self.logPaths[0])
+        self.assertEqual(index.topics, {'a.x': [50, START_TIMESTAMP, START_TIMESTAMP + 98],
+                                        'b': [50, START_TIMESTAMP + 1, START_TIMESTAMP + 99]})
+        self.assertEqual(self.grep(1, 'a.'), (False, 0))
+        self.assertEqual(self.grep(0, 'a.'), (True, 50))
+        self.assertEqual(self.grep(0, 'a.x:'), (True, 50))
+        self.assertEqual(self.grep(0, 'a.', START_TIMESTAMP + 99), (False, 0))
+        self.assertEqual(self.grep(0, 'a.', START_TIMESTAMP + 10, START_TIMESTAMP + 20), (True, 5))
+
+    def test_noTopicIndex(self):
+        indexPath = getTopicIndexPath(self.logPaths[1])
+        os.unlink(indexPath)
+        self.assertEqual(self.grep(1, 'a.'), (True, 0))
+        self.assertFalse(os.path.exists(indexPath))
+        # with writeIndex, the search writes the missing index
+        self.assertEqual(self.grep(1, 'a.', writeIndex=True), (True, 0))
+        self.assertEqual(TopicIndex.read(self.logPaths[1]).topics.keys(), ['b'])
+        self.assertEqual(self.grep(1, 'a.'), (False, 0))
+
+    def test_bodyPrefix(self):
+        # a prefix that runs into the body must not skip the log once
+        # the index exists
+        os.unlink(getTopicIndexPath(self.logPaths[1]))
+        for _i in xrange(2):
+            self.assertEqual(self.grep(1, 'b:{"i": 5,', writeIndex=True), (True, 1))
+        self.assertEqual(self.grep(1, 'b.c:{"i": 5'), (False, 0))
+        self.assertEqual(self.grep(0, 'a:{"i": 0'), (False, 0))
+        self.assertEqual(self.grep(0, 'a.x:{"i": 0,'), (True, 1))
+
+    def test_predicates(self):
+        self.assertEqual(self.grep(1, 'b', predicates=[FieldPredicate('data.even=true')]),
+                         (True, 34))
+        self.assertEqual(self.grep(1, 'b', predicates=[FieldPredicate('i >= 90'),
+                                                       FieldPredicate('data.even!=true')]),
+                         (True, 6))
+        self.assertFalse(FieldPredicate('i<"x"')({'i': 1}))
+        self.assertFalse(FieldPredicate('missing.field=1')({'i': 1}))
+        self.assertTrue(FieldPredicate('list.1=b')({'list': ['a', 'b']}))
+        self.assertRaises(ValueError, FieldPredicate, 'no operator')
+
+
+if __name__ == '__main__':
+    unittest.main()
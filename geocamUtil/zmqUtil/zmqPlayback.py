@@ -16,69 +16,277 @@
 #__END_LICENSE__
 
 import sys
+import time
 import logging
 
+import zmq
 from zmq.eventloop import ioloop
 ioloop.install()
+from zmq.eventloop.zmqstream import ZMQStream
 
-from geocamUtil.zmqUtil.util import zmqLoop, LogParser
+from geocamUtil import anyjson as json
+from geocamUtil.zmqUtil.util import (zmqLoop,
+                                     LogReader,
+                                     mergeLogRecords,
+                                     parseTimestampArg)
 from geocamUtil.zmqUtil.publisher import ZmqPublisher
+from geocamUtil.zmqUtil.attachmentStore import getLogAttachmentStore
+
+# max records handled per ioloop callback, so that RPC calls and other
+# events get a turn even when playing back as fast as possible
+MAX_RECORDS_PER_CALLBACK = 1000
 
 
 class ZmqPlayback(object):
-    def __init__(self, logPath, opts):
-        self.logPath = logPath
-        self.logFile = None
-        self.log = None
+    """
+    Publishes the messages in one or more message logs, merged in
+    timestamp order.
+
+    With a nonzero *speed* (opts.speed), messages are paced to
+    reproduce their original timing, sped up by that factor. Playback
+    is driven by ioloop timeouts, so the process stays responsive, and
+    if opts.rpcEndpoint is set it can be controlled over RPC with the
+    methods 'status', 'pause', 'resume', 'seek' ({"timestamp": ts})
+    and 'setSpeed' ({"speed": x}).
+    """
+
+    def __init__(self, logPaths, opts):
+        self.logPaths = logPaths
         self.opts = opts
         self.publisher = ZmqPublisher(**ZmqPublisher.getOptionValues(opts))
         self.publishTimer = None
+        self.rpcStream = None
         print 'topics:', self.opts.topic
 
+        self.speed = opts.speed
+        self.startTimestamp = None
+        if opts.start:
+            self.startTimestamp = parseTimestampArg(opts.start)
+        self.endTimestamp = None
+        if opts.end:
+            self.endTimestamp = parseTimestampArg(opts.end)
+
+        self.readers = []
+        self.attachmentStores = [getLogAttachmentStore(logPath) for logPath in self.logPaths]
+        self.records = None
+        self.nextRecord = None
+        self.paused = False
+        self.playTimeout = None
+        self.messageCount = 0
+
+        # wall clock time at which the record with anchorTimestamp is
+        # due. see setAnchor().
+        self.anchorTime = None
+        self.anchorTimestamp = None
+
     def start(self):
         self.publisher.start()
 
+        if self.opts.rpcEndpoint:
+            self.rpcStream = ZMQStream(self.publisher.context.socket(zmq.REP))
+            self.rpcStream.bind(self.opts.rpcEndpoint)
+            logging.info('bound rpcEndpoint %s', self.opts.rpcEndpoint)
+            self.rpcStream.on_recv(self.handleRpcCall)
+
+        self.openLogs(self.startTimestamp)
+
         # the delay gives a chance to connect to central before publishing
-        self.publishTimer = ioloop.DelayedCallback(self.playLog, 100)
+        self.publishTimer = ioloop.DelayedCallback(self.schedulePlay, 100)
         self.publishTimer.start()
 
-    def playLog(self):
-        self.logFile = open(self.logPath, 'rb')
-        self.log = LogParser(self.logFile)
-        i = 0
-        for rec in self.log:
-            topicMatch = False
-            if self.opts.topic:
-                for topic in self.opts.topic:
-                    if rec.msg.startswith(topic):
-                        topicMatch = True
-                        break
-            else:
-                topicMatch = True
-
-            if topicMatch:
-                self.publisher.pubStream.send(rec.msg)
-                if i % 100 == 0:
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
-                i += 1
+    def openLogs(self, timestamp):
+        """
+        Positions playback at the first record with *timestamp* or
+        later, using the log indexes, or at the start of the logs if
+        *timestamp* is None.
+        """
+        for reader in self.readers:
+            reader.close()
+        self.readers = [LogReader(logPath) for logPath in self.logPaths]
+        if timestamp is None:
+            streams = self.readers
+        else:
+            streams = [reader.seek(timestamp) for reader in self.readers]
+        self.records = mergeLogRecords(streams)
+        self.nextRecord = next(self.records, None)
+        self.setAnchor()
+
+    def setAnchor(self):
+        """
+        Makes the next record due now. Called whenever playback starts
+        or the timing changes, so that time spent paused doesn't count.
+        """
+        self.anchorTime = time.time()
+        if self.nextRecord is None:
+            self.anchorTimestamp = None
+        else:
+            self.anchorTimestamp = self.nextRecord[1].timestamp
+
+    def schedulePlay(self, delay=0):
+        self.cancelPlay()
+        self.playTimeout = ioloop.IOLoop.instance().add_timeout(time.time() + delay,
+                                                                self.playSome)
+
+    def cancelPlay(self):
+        if self.playTimeout is not None:
+            ioloop.IOLoop.instance().remove_timeout(self.playTimeout)
+            self.playTimeout = None
+
+    def isTopicMatch(self, rec):
+        if not self.opts.topic:
+            return True
+        for topic in self.opts.topic:
+            if rec.msg.startswith(topic):
+                return True
+        return False
+
+    def playSome(self):
+        """
+        Publishes the records that are due, then schedules itself for
+        the next one.
+        """
+        self.playTimeout = None
+        if self.paused:
+            return
+
+        numHandled = 0
+        while self.nextRecord is not None:
+            logIndex, rec = self.nextRecord
+            if self.endTimestamp is not None and rec.timestamp >= self.endTimestamp:
+                self.nextRecord = None
+                break
+            if numHandled >= MAX_RECORDS_PER_CALLBACK:
+                self.schedulePlay()
+                return
+            if self.speed > 0:
+                dueTime = (self.anchorTime
+                           + (rec.timestamp - self.anchorTimestamp) / 1e6 / self.speed)
+                delay = dueTime - time.time()
+                if delay > 0:
+                    self.schedulePlay(delay)
+                    return
+
+            if self.isTopicMatch(rec):
+                self.publishRecord(logIndex, rec)
+            numHandled += 1
+            self.nextRecord = next(self.records, None)
+
         print
-        print 'message count:', i
+        print 'message count:', self.messageCount
+
+    def publishRecord(self, logIndex, rec):
+        try:
+            msg = self.attachmentStores[logIndex].getFullMessage(rec)
+        except (IOError, OSError), e:
+            print ('warning: could not load attachments for record at offset %d of %s: %s'
+                   % (rec.offset, self.logPaths[logIndex], e))
+            return
+        self.publisher.pubStream.send(msg)
+        if self.messageCount % 100 == 0:
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        self.messageCount += 1
+
+    def getStatus(self):
+        if self.nextRecord is None:
+            position = None
+        else:
+            position = str(self.nextRecord[1].timestamp)
+        return {'paused': self.paused,
+                'speed': self.speed,
+                'position': position,
+                'finished': self.nextRecord is None,
+                'messageCount': self.messageCount}
+
+    def pause(self):
+        self.paused = True
+        self.cancelPlay()
+
+    def resume(self):
+        self.paused = False
+        self.setAnchor()
+        self.schedulePlay()
+
+    def seek(self, timestamp):
+        self.openLogs(timestamp)
+        if not self.paused:
+            self.schedulePlay()
+
+    def setSpeed(self, speed):
+        if speed < 0:
+            raise ValueError('speed must be >= 0')
+        self.speed = speed
+        self.setAnchor()
+        if not self.paused:
+            self.schedulePlay()
+
+    def handleRpcCall(self, messages):
+        for msg in messages:
+            try:
+                call = json.loads(msg)
+                callId = call['id']
+            except:  # pylint: disable=W0702
+                self.rpcStream.send(json.dumps({'result': None,
+                                                'error': 'malformed request'}))
+                continue
+
+            try:
+                method = call['method']
+                params = call.get('params', {})
+                if method == 'pause':
+                    self.pause()
+                elif method == 'resume':
+                    self.resume()
+                elif method == 'seek':
+                    self.seek(parseTimestampArg(str(params['timestamp'])))
+                elif method == 'setSpeed':
+                    self.setSpeed(float(params['speed']))
+                elif method != 'status':
+                    raise ValueError('unknown method %s' % method)
+                self.rpcStream.send(json.dumps({'result': self.getStatus(),
+                                                'error': None,
+                                                'id': callId}))
+            except:  # pylint: disable=W0702
+                logging.exception('handling rpc message')
+                errClass, errObject = sys.exc_info()[:2]
+                errText = '%s.%s: %s' % (errClass.__module__,
+                                         errClass.__name__,
+                                         str(errObject))
+                self.rpcStream.send(json.dumps({'result': None,
+                                                'error': errText,
+                                                'id': callId}))
 
 
 def main():
     import optparse
-    parser = optparse.OptionParser('usage: %prog <zmqCentral-messages-xxx.txt>')
+    parser = optparse.OptionParser('usage: %prog <zmqCentral-messages-xxx.txt> [<more-messages.txt> ...]')
     parser.add_option('-t', '--topic',
                       action='append',
                       help='Only print specified topics, can specify multiple times')
+    parser.add_option('--speed',
+                      default=0, type='float',
+                      help='Play back at this multiple of the original message timing, or as fast as possible if 0 [%default]')
+    parser.add_option('--start',
+                      help='Start with the first message at this time (microseconds since the epoch, or UTC like 2012-07-13T10:00:00)')
+    parser.add_option('--end',
+                      help='Stop before the first message at this time')
+    parser.add_option('--rpcEndpoint',
+                      help='Endpoint to listen on for playback control RPC requests, e.g. tcp://127.0.0.1:7817')
     ZmqPublisher.addOptions(parser, 'zmqPlayback')
     opts, args = parser.parse_args()
-    if len(args) != 1:
-        parser.error('expected exactly 1 arg')
+    if len(args) == 0:
+        parser.error('expected at least 1 log file argument')
+    if opts.speed < 0:
+        parser.error('--speed must be >= 0')
+    for timeOpt in ('start', 'end'):
+        try:
+            if getattr(opts, timeOpt):
+                parseTimestampArg(getattr(opts, timeOpt))
+        except ValueError, e:
+            parser.error('--%s: %s' % (timeOpt, e))
     logging.basicConfig(level=logging.DEBUG)
 
-    pb = ZmqPlayback(args[0], opts)
+    pb = ZmqPlayback(args, opts)
     pb.start()
 
     zmqLoop()
@@ -15,46 +15,304 @@
 # specific language governing permissions and limitations under the License.
 #__END_LICENSE__
 
+import os
+import shutil
 import logging
+import tempfile
+import multiprocessing
+from operator import itemgetter
+from collections import OrderedDict
 
-from geocamUtil.zmqUtil.util import LogParser
+from geocamUtil.zmqUtil.util import (LogParser,
+                                     LogIndexWriter,
+                                     RECORD_SENTINEL,
+                                     DEFAULT_CHUNK_BYTES,
+                                     getIndexPath,
+                                     getLogRanges,
+                                     mergeLogRecords)
 
+DEFAULT_MAX_OPEN_FILES = 256
+# file descriptors held by an IndexedLogFile (the log and its index),
+# and by an input log being parsed (the file and LogParser's memory
+# map of it, which has its own descriptor)
+FDS_PER_OUTPUT = 2
+FDS_PER_INPUT = 2
+MIN_MAX_OPEN_FILES = FDS_PER_OUTPUT + 2 * FDS_PER_INPUT
+DEFAULT_MEMORY_BYTES = 128 * 1024 * 1024
+TMP_DIR_PREFIX = '.zmqSortLogs-'
 
-def sortLogs(opts, logPaths):
-    outFiles = {}
 
-    i = 0
-    for logPath in logPaths:
-        print '=== processing %s' % logPath
-        logFile = open(logPath, 'rb')
-        logStream = LogParser(logFile)
-        for rec in logStream:
-            topic, _body = rec.msg.split(':', 1)
+def getOutputPath(outputDir, topic):
+    return os.path.join(outputDir, '%s-zmq-messages.txt' % topic)
+
+
+def getRecordText(rec):
+    return '%s %d %d %s %s\n' % (RECORD_SENTINEL, rec.timestamp, rec.msgSize,
+                                 rec.attachmentsPath, rec.msg)
+
+
+class IndexedLogFile(object):
+    """
+    Writes records to a message log along with its sidecar index (see
+    LogIndexWriter). With *mode* 'ab', appends to an existing log.
+    """
+
+    def __init__(self, path, mode='wb'):
+        self.path = path
+        self.logFile = open(path, mode)
+        self.logFile.seek(0, os.SEEK_END)
+        self.offset = self.logFile.tell()
+        self.index = LogIndexWriter(open(getIndexPath(path), mode))
+
+    def write(self, timestamp, recordText):
+        self.index.add(timestamp, self.offset)
+        self.logFile.write(recordText)
+        self.offset += len(recordText)
+
+    def close(self):
+        self.logFile.close()
+        self.index.close()
+
+
+class HandlePool(object):
+    """
+    Keeps IndexedLogFiles open for appending, using at most *maxOpen*
+    file descriptors, and closes the least recently used one to make
+    room for another.
+    """
+
+    def __init__(self, maxOpen=DEFAULT_MAX_OPEN_FILES):
+        self.maxHandles = max(1, maxOpen // FDS_PER_OUTPUT)
+        self.handles = OrderedDict()
+        self.created = set()
+
+    def get(self, path):
+        handle = self.handles.pop(path, None)
+        if handle is None:
+            if len(self.handles) >= self.maxHandles:
+                _oldestPath, oldest = self.handles.popitem(last=False)
+                oldest.close()
+            if path in self.created:
+                handle = IndexedLogFile(path, 'ab')
+            else:
+                handle = IndexedLogFile(path, 'wb')
+                self.created.add(path)
+        self.handles[path] = handle
+        return handle
+
+    def closeAll(self):
+        for handle in self.handles.itervalues():
+            handle.close()
+        self.handles.clear()
+
+
+class TopicSplitter(object):
+    """
+    Splits records by topic into run files in *workDir*. Records are
+    buffered in memory, and when *memoryBytes* bytes are pending they
+    are spilled to disk.
+
+    If *sort* is set, each spill writes a new run per topic, sorted by
+    timestamp, and the runs are merged later. Otherwise each topic has
+    a single run in input order, appended to through a HandlePool.
+    """
 
-            outFile = outFiles.get(topic)
-            if outFile is None:
-                outPath = '%s-zmq-messages.txt' % topic
-                outFile = open(outPath, 'wb')
-                outFiles[topic] = outFile
+    def __init__(self, workDir, sort=False,
+                 memoryBytes=DEFAULT_MEMORY_BYTES,
+                 maxOpen=DEFAULT_MAX_OPEN_FILES):
+        self.workDir = workDir
+        self.sort = sort
+        self.memoryBytes = memoryBytes
+        self.handles = HandlePool(maxOpen)
+        self.buffers = {}
+        self.pendingBytes = 0
+        self.numSpills = 0
 
-            rec.writeTo(outFile)
-            i += 1
+        # topic -> run paths, in order
+        self.runs = {}
+        self.topicIds = {}
+
+    def add(self, rec):
+        topic = rec.topic
+        buf = self.buffers.get(topic)
+        if buf is None:
+            buf = []
+            self.buffers[topic] = buf
+        text = getRecordText(rec)
+        buf.append((rec.timestamp, text))
+        self.pendingBytes += len(text)
+        if self.pendingBytes >= self.memoryBytes:
+            self.spill()
+
+    def getRunPath(self, topic, runNum):
+        topicId = self.topicIds.get(topic)
+        if topicId is None:
+            topicId = len(self.topicIds)
+            self.topicIds[topic] = topicId
+        return os.path.join(self.workDir, '%d.%d' % (topicId, runNum))
+
+    def spill(self):
+        for topic, buf in self.buffers.iteritems():
+            if self.sort:
+                # stable, so records with equal timestamps stay in
+                # input order
+                buf.sort(key=itemgetter(0))
+                out = IndexedLogFile(self.getRunPath(topic, self.numSpills))
+            else:
+                out = self.handles.get(self.getRunPath(topic, 0))
+            for timestamp, text in buf:
+                out.write(timestamp, text)
+            runs = self.runs.setdefault(topic, [])
+            if self.sort:
+                out.close()
+                runs.append(out.path)
+            elif not runs:
+                runs.append(out.path)
+        self.buffers = {}
+        self.pendingBytes = 0
+        self.numSpills += 1
+
+    def close(self):
+        """
+        Spills any pending records and returns a dict mapping topics to
+        their run paths.
+        """
+        self.spill()
+        self.handles.closeAll()
+        return self.runs
+
+
+def splitLogRange(task):
+    """
+    Splits one range of a log (see getLogRanges()) into runs with a
+    TopicSplitter. Runs in a worker process.
+    """
+    logPath, startOffset, endOffset, workDir, sort, memoryBytes, maxOpen = task
+    print '=== processing %s from offset %d' % (logPath, startOffset)
+    os.makedirs(workDir)
+    # leave room for the input log
+    splitter = TopicSplitter(workDir, sort, memoryBytes, maxOpen - FDS_PER_INPUT)
+    logFile = open(logPath, 'rb')
+    logFile.seek(startOffset)
+    for rec in LogParser(logFile):
+        if endOffset is not None and rec.offset >= endOffset:
+            break
+        splitter.add(rec)
+    logFile.close()
+    return splitter.close()
+
+
+def removeRun(runPath):
+    os.unlink(runPath)
+    os.unlink(getIndexPath(runPath))
+
+
+def copyRuns(runPaths, outPath, sort):
+    """
+    Writes the records in *runPaths* to *outPath*, merged by timestamp
+    if *sort* is set, or one run after another otherwise.
+    """
+    out = IndexedLogFile(outPath)
+    runFiles = [open(runPath, 'rb') for runPath in runPaths]
+    if sort:
+        records = (rec for _i, rec in mergeLogRecords([LogParser(runFile)
+                                                       for runFile in runFiles]))
+    else:
+        records = (rec for runFile in runFiles for rec in LogParser(runFile))
+    for rec in records:
+        out.write(rec.timestamp, getRecordText(rec))
+    for runFile in runFiles:
+        runFile.close()
+    out.close()
+    for runPath in runPaths:
+        removeRun(runPath)
+
+
+def writeTopic(outPath, runPaths, sort, maxOpen, tmpDir):
+    """
+    Combines the runs for a topic into its output log, using at most
+    *maxOpen* file descriptors.
+    """
+    # combine in several passes if there are too many runs to open at
+    # once. combined runs go first to keep input order.
+    maxRuns = (maxOpen - FDS_PER_OUTPUT) // FDS_PER_INPUT
+    numMerges = 0
+    while len(runPaths) > maxRuns:
+        mergedPath = os.path.join(tmpDir, 'merged%d' % numMerges)
+        copyRuns(runPaths[:maxRuns], mergedPath, sort)
+        runPaths = [mergedPath] + runPaths[maxRuns:]
+        numMerges += 1
+
+    if len(runPaths) == 1:
+        os.rename(runPaths[0], outPath)
+        os.rename(getIndexPath(runPaths[0]), getIndexPath(outPath))
+    else:
+        copyRuns(runPaths, outPath, sort)
+
+
+def sortLogs(opts, logPaths):
+    """
+    Splits the messages in *logPaths* into one indexed log per topic in
+    opts.outputDir. Ranges of the input logs are split in parallel on
+    opts.jobs processes, and the pieces for each topic are then
+    combined in input order, or in timestamp order if opts.sort is set.
+    """
+    tmpDir = tempfile.mkdtemp(dir=opts.outputDir, prefix=TMP_DIR_PREFIX)
+    try:
+        tasks = []
+        for logPath in logPaths:
+            for _logPath, startOffset, endOffset in getLogRanges(logPath, opts.chunkBytes):
+                tasks.append((logPath, startOffset, endOffset,
+                              os.path.join(tmpDir, str(len(tasks))),
+                              opts.sort, opts.memoryBytes, opts.maxOpenFiles))
 
-            if (i + 1) % 10000 == 0:
-                print 'processed %d records, %d topics found so far' % (i + 1, len(outFiles))
+        if opts.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(opts.jobs, len(tasks)))
+            results = pool.map(splitLogRange, tasks)
+            pool.close()
+            pool.join()
+        else:
+            results = [splitLogRange(task) for task in tasks]
 
-        logFile.close()
+        topicRuns = {}
+        for runs in results:
+            for topic, runPaths in runs.iteritems():
+                topicRuns.setdefault(topic, []).extend(runPaths)
 
-    for outFile in outFiles.itervalues():
-        outFile.close()
+        print 'writing %d topics' % len(topicRuns)
+        for topic, runPaths in sorted(topicRuns.iteritems()):
+            writeTopic(getOutputPath(opts.outputDir, topic), runPaths,
+                       opts.sort, opts.maxOpenFiles, tmpDir)
+    finally:
+        shutil.rmtree(tmpDir)
 
 
 def main():
     import optparse
     parser = optparse.OptionParser('usage: %prog <messages1.txt> <messages2.txt> ...')
+    parser.add_option('-o', '--outputDir',
+                      default='.',
+                      help='Directory to write the per-topic logs to [%default]')
+    parser.add_option('--sort',
+                      action='store_true', default=False,
+                      help='Sort the messages of each topic by timestamp, instead of keeping them in input order')
+    parser.add_option('-j', '--jobs',
+                      default=multiprocessing.cpu_count(), type='int',
+                      help='Number of processes to split logs with [%default]')
+    parser.add_option('--chunkBytes',
+                      default=DEFAULT_CHUNK_BYTES, type='int',
+                      help='Split indexed logs into ranges of this size to process in parallel [%default]')
+    parser.add_option('--memoryBytes',
+                      default=DEFAULT_MEMORY_BYTES, type='int',
+                      help='Messages to buffer in memory per process before writing them out [%default]')
+    parser.add_option('--maxOpenFiles',
+                      default=DEFAULT_MAX_OPEN_FILES, type='int',
+                      help='Max files to keep open per process, counting indexes and memory maps [%default]')
     opts, args = parser.parse_args()
     if len(args) == 0:
         parser.error('expected at least 1 log file argument')
+    if opts.maxOpenFiles < MIN_MAX_OPEN_FILES:
+        parser.error('--maxOpenFiles must be at least %d' % MIN_MAX_OPEN_FILES)
     logging.basicConfig(level=logging.DEBUG)
 
     sortLogs(opts, args)
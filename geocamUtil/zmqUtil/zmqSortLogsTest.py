@@ -0,0 +1,124 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import sys
+import shutil
+import resource
+import tempfile
+import unittest
+import subprocess
+
+from geocamUtil.zmqUtil.util import LogRecord, LogReader, buildLogIndex
+from geocamUtil.zmqUtil.zmqSortLogs import sortLogs
+
+START_TIMESTAMP = 1342173600000000
+NUM_TOPICS = 5
+
+
+class Options(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class ZmqSortLogsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='zmqSortLogsTest')
+        self.outputDir = os.path.join(self.tmpDir, 'out')
+        os.mkdir(self.outputDir)
+        # two logs covering the same time, each slightly out of order
+        self.logPaths = []
+        for logNum in xrange(2):
+            logPath = os.path.join(self.tmpDir, 'messages%d.txt' % logNum)
+            logFile = open(logPath, 'wb')
+            for i in xrange(200):
+                timestamp = START_TIMESTAMP + (i ^ 1) * 1000 + logNum
+                LogRecord(timestamp, '-', 't%d:{"log": %d, "i": %d}'
+                          % (i % NUM_TOPICS, logNum, i)).writeTo(logFile)
+            logFile.close()
+            buildLogIndex(logPath, everyRecords=10)
+            self.logPaths.append(logPath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def sortLogs(self, sort, jobs=1):
+        sortLogs(Options(outputDir=self.outputDir, sort=sort, jobs=jobs,
+                         chunkBytes=1000, memoryBytes=2000, maxOpenFiles=6),
+                 self.logPaths)
+        self.assertEqual(len(os.listdir(self.outputDir)), NUM_TOPICS * 2)
+        return [list(LogReader(os.path.join(self.outputDir, 't%d-zmq-messages.txt' % topicNum)))
+                for topicNum in xrange(NUM_TOPICS)]
+
+    def test_inputOrder(self):
+        topicRecords = self.sortLogs(sort=False)
+        expected = [r'{"log": %d, "i": %d}' % (logNum, i)
+                    for logNum in xrange(2) for i in xrange(3, 200, NUM_TOPICS)]
+        self.assertEqual([rec.msg.split(':', 1)[1] for rec in topicRecords[3]], expected)
+
+    def test_sort(self):
+        for jobs in (1, 2):
+            topicRecords = self.sortLogs(sort=True, jobs=jobs)
+            for records in topicRecords:
+                timestamps = [rec.timestamp for rec in records]
+                self.assertEqual(len(timestamps), 80)
+                self.assertEqual(timestamps, sorted(timestamps))
+
+            # the outputs are indexed
+            reader = LogReader(os.path.join(self.outputDir, 't0-zmq-messages.txt'))
+            self.assertTrue(reader.index.offsets)
+            # t0 has i = 100 from each log at (100 ^ 1) msecs
+            self.assertEqual([rec.timestamp for rec in reader.range(START_TIMESTAMP + 100000,
+                                                                    START_TIMESTAMP + 102000)],
+                             [START_TIMESTAMP + 101000, START_TIMESTAMP + 101001])
+            reader.close()
+
+    def test_fileLimit(self):
+        # many small logs give each topic more runs than can be open at
+        # once. run in a child process with a file descriptor limit just
+        # above --maxOpenFiles.
+        maxOpenFiles = 8
+        logPaths = []
+        for logNum in xrange(30):
+            logPath = os.path.join(self.tmpDir, 'many%02d.txt' % logNum)
+            logFile = open(logPath, 'wb')
+            for i in xrange(10):
+                LogRecord(START_TIMESTAMP + i * 1000, '-', 't%d:{"log": %d, "i": %d}'
+                          % (i % 2, logNum, i)).writeTo(logFile)
+            logFile.close()
+            logPaths.append(logPath)
+
+        def setFileLimit():
+            # stdin, stdout and stderr, plus a few spare for the interpreter
+            limit = maxOpenFiles + 6
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, limit))
+
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        for sortArgs in ([], ['--sort']):
+            for name in os.listdir(self.outputDir):
+                os.unlink(os.path.join(self.outputDir, name))
+            subprocess.check_call([sys.executable, '-m', 'geocamUtil.zmqUtil.zmqSortLogs',
+                                   '-j', '1', '--maxOpenFiles', str(maxOpenFiles),
+                                   '-o', self.outputDir] + sortArgs + logPaths,
+                                  preexec_fn=setFileLimit, close_fds=True, env=env)
+            records = list(LogReader(os.path.join(self.outputDir, 't1-zmq-messages.txt')))
+            self.assertEqual(len(records), 150)
+            if not sortArgs:
+                self.assertEqual(records[-1].msg, 't1:{"log": 29, "i": 9}')
+
+
+if __name__ == '__main__':
+    unittest.main()
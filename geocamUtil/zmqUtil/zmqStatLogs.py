@@ -16,49 +16,221 @@
 # specific language governing permissions and limitations under the License.
 #__END_LICENSE__
 
+import sys
+import array
 import logging
-from collections import defaultdict
 import datetime
+import multiprocessing
+from collections import defaultdict
 
-from geocamUtil.zmqUtil.util import LogParser
+from geocamUtil import anyjson as json
+from geocamUtil.zmqUtil.util import (LogParser, getLogRanges, parseTimestampArg,
+                                     DEFAULT_CHUNK_BYTES)
 
-MSECS_PER_HOUR = 3600 * 1000000
+SECONDS_PER_HOUR = 3600
+US_PER_SECOND = 1000000
 
 
-def statLogs(opts, logPaths):
-    i = 0
+def statLogRange(logRange, startTimestamp=None, endTimestamp=None):
+    """
+    Scans one range of a log (see getLogRanges()) and returns its
+    counts. Only the record headers and topics are read, not the
+    message bodies. Records outside [startTimestamp, endTimestamp) are
+    skipped, whether or not the log is indexed.
+
+    Message counts are kept per second so that counts from ranges,
+    segments and logs that cover the same second can be added up before
+    finding the peak rate. They are returned as an array of counts for
+    each hour, which is much smaller than a dict for busy logs.
+    """
+    logPath, startOffset, endOffset = logRange
+    seconds = {}
+    topicCounts = defaultdict(int)
+    topicBytes = defaultdict(int)
+    logFile = open(logPath, 'rb')
+    logFile.seek(startOffset)
+    for rec in LogParser(logFile, headerOnly=True):
+        if endOffset is not None and rec.offset >= endOffset:
+            break
+        timestamp = rec.timestamp
+        if ((startTimestamp is not None and timestamp < startTimestamp)
+                or (endTimestamp is not None and timestamp >= endTimestamp)):
+            continue
+        hour, second = divmod(timestamp // US_PER_SECOND, SECONDS_PER_HOUR)
+        hourCounts = seconds.get(hour)
+        if hourCounts is None:
+            hourCounts = seconds[hour] = array.array('l', [0]) * SECONDS_PER_HOUR
+        hourCounts[second] += 1
+        topic = rec.topic
+        topicCounts[topic] += 1
+        topicBytes[topic] += rec.msgSize
+    logFile.close()
+
+    return {'logPath': logPath,
+            'seconds': seconds,
+            'topics': dict([(topic, (count, topicBytes[topic]))
+                            for topic, count in topicCounts.iteritems()])}
+
+
+def statLogRangeStar(args):
+    return statLogRange(*args)
+
+
+class LogStats(object):
+    """
+    Accumulates the counts for one log, or for all logs.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.topics = {}
+
+    def add(self, counts):
+        for hour, hourCounts in counts['seconds'].iteritems():
+            ourCounts = self.seconds.get(hour)
+            if ourCounts is None:
+                self.seconds[hour] = array.array('l', hourCounts)
+            else:
+                for second, count in enumerate(hourCounts):
+                    if count:
+                        ourCounts[second] += count
+        for topic, (count, size) in counts['topics'].iteritems():
+            topicCounts = self.topics.setdefault(topic, [0, 0])
+            topicCounts[0] += count
+            topicCounts[1] += size
+
+    def getPeak(self):
+        """
+        Returns the second with the most messages and its count. On ties
+        the earliest second wins.
+        """
+        peakSecond = None
+        peakCount = 0
+        for hour in sorted(self.seconds):
+            hourCounts = self.seconds[hour]
+            count = max(hourCounts)
+            if count > peakCount:
+                peakSecond = hour * SECONDS_PER_HOUR + hourCounts.index(count)
+                peakCount = count
+        return peakSecond, peakCount
+
+    def getResult(self):
+        peakSecond, peakCount = self.getPeak()
+        if peakSecond is None:
+            peakTime = None
+        else:
+            peakTime = (datetime.datetime.utcfromtimestamp(peakSecond)
+                        .strftime('%Y-%m-%d %H:%M:%S'))
+        hours = dict([(hour, sum(hourCounts))
+                      for hour, hourCounts in self.seconds.iteritems()])
+        return {'count': sum(hours.itervalues()),
+                'bytes': sum([size for _count, size in self.topics.itervalues()]),
+                'peak': {'msgsPerSec': peakCount,
+                         'time': peakTime},
+                'hours': dict([(getHourString(hour), count)
+                               for hour, count in hours.iteritems() if count]),
+                'topics': dict([(topic, {'count': count, 'bytes': size})
+                                for topic, (count, size) in self.topics.iteritems()])}
+
+
+def getHourString(hour):
+    return datetime.datetime.utcfromtimestamp(hour * SECONDS_PER_HOUR).strftime('%Y-%m-%d %H:00')
+
+
+def getLogStats(logPaths, jobs=1, chunkBytes=DEFAULT_CHUNK_BYTES, quiet=True,
+                startTimestamp=None, endTimestamp=None):
+    """
+    Returns message counts per hour and per topic and the peak message
+    rate for each log in *logPaths* and for all of them together, for
+    messages in [startTimestamp, endTimestamp). Ranges of the logs are
+    scanned on a pool of *jobs* processes.
+    """
+    logRanges = []
+    for logPath in logPaths:
+        logRanges.extend(getLogRanges(logPath, chunkBytes))
+    jobArgs = [(logRange, startTimestamp, endTimestamp) for logRange in logRanges]
+
+    if jobs > 1 and len(logRanges) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(logRanges)))
+        results = pool.imap_unordered(statLogRangeStar, jobArgs)
+    else:
+        pool = None
+        results = (statLogRange(*args) for args in jobArgs)
+
+    logStats = dict([(logPath, LogStats()) for logPath in logPaths])
+    for i, counts in enumerate(results):
+        logStats[counts['logPath']].add(counts)
+        if not quiet:
+            print >> sys.stderr, 'scanned %d of %d ranges' % (i + 1, len(logRanges))
+    if pool:
+        pool.close()
+        pool.join()
+
+    # logs from several instances, or segments that meet mid-second,
+    # can cover the same seconds, so the total peak comes from the
+    # merged per-second counts
+    total = LogStats()
+    files = []
     for logPath in logPaths:
-        count = defaultdict(int)
-        print '=== compiling statistics on %s' % logPath
-        logFile = open(logPath, 'rb')
-        logStream = LogParser(logFile)
-        for rec in logStream:
-            bucket = int(rec.timestamp / MSECS_PER_HOUR)
-            count[bucket] += 1
-            i += 1
-
-            if i % 10000 == 0:
-                if not opts.quiet:
-                    print 'processed %d records' % i
-
-        buckets = sorted(count.keys())
-        minBucket = buckets[0]
-        maxBucket = buckets[-1]
+        stats = logStats[logPath]
+        total.add({'seconds': stats.seconds, 'topics': stats.topics})
+        result = stats.getResult()
+        result['path'] = logPath
+        files.append(result)
+    return {'files': files,
+            'total': total.getResult()}
 
+
+def printStats(stats):
+    hours = stats['hours']
+    if hours:
         print
-        total = 0
-        for bucket in xrange(minBucket, maxBucket + 1):
-            posixTimeStamp = bucket * 3600
-            utcDt = datetime.datetime.utcfromtimestamp(posixTimeStamp)
+        hourKeys = sorted([datetime.datetime.strptime(hour, '%Y-%m-%d %H:00')
+                           for hour in hours])
+        utcDt = hourKeys[0]
+        while utcDt <= hourKeys[-1]:
             timeString = utcDt.strftime('%Y-%m-%d %H:00')
             if timeString.endswith('00:00'):
                 print
-            print '%s %6d' % (timeString, count[bucket])
-            total += count[bucket]
-        print
-        print 'Total: %d' % total
+            print '%s %6d' % (timeString, hours.get(timeString, 0))
+            utcDt += datetime.timedelta(hours=1)
 
-        logFile.close()
+    print
+    print '%-40s %10s %14s' % ('topic', 'messages', 'bytes')
+    for topic, counts in sorted(stats['topics'].iteritems(),
+                                key=lambda item: -item[1]['bytes']):
+        print '%-40s %10d %14d' % (topic, counts['count'], counts['bytes'])
+
+    print
+    print 'Total: %d messages, %d bytes' % (stats['count'], stats['bytes'])
+    if stats['peak']['time']:
+        print 'Peak: %d messages/s at %s' % (stats['peak']['msgsPerSec'], stats['peak']['time'])
+
+
+def statLogs(opts, logPaths):
+    startTimestamp = None
+    if opts.start:
+        startTimestamp = parseTimestampArg(opts.start)
+    endTimestamp = None
+    if opts.end:
+        endTimestamp = parseTimestampArg(opts.end)
+    stats = getLogStats(logPaths,
+                        jobs=opts.jobs,
+                        chunkBytes=opts.chunkBytes,
+                        quiet=opts.quiet or opts.json,
+                        startTimestamp=startTimestamp,
+                        endTimestamp=endTimestamp)
+    if opts.json:
+        print json.dumps(stats, sort_keys=True, indent=4)
+        return
+
+    for fileStats in stats['files']:
+        print '=== statistics on %s' % fileStats['path']
+        printStats(fileStats)
+        print
+    if len(logPaths) > 1:
+        print '=== all logs'
+        printStats(stats['total'])
 
 
 def main():
@@ -67,9 +239,28 @@ def main():
     parser.add_option('-q', '--quiet',
                       action='store_true', default=False,
                       help='Reduce debug output')
+    parser.add_option('-j', '--jobs',
+                      default=multiprocessing.cpu_count(), type='int',
+                      help='Number of processes to scan logs with [%default]')
+    parser.add_option('--chunkBytes',
+                      default=DEFAULT_CHUNK_BYTES, type='int',
+                      help='Split indexed logs into ranges of this size to scan in parallel [%default]')
+    parser.add_option('--json',
+                      action='store_true', default=False,
+                      help='Print statistics as JSON')
+    parser.add_option('--start',
+                      help='Only count messages at this time or later (microseconds since the epoch, or UTC like 2012-07-13T10:00:00)')
+    parser.add_option('--end',
+                      help='Only count messages before this time')
     opts, args = parser.parse_args()
     if len(args) == 0:
         parser.error('expected at least 1 log file argument')
+    try:
+        for timeOpt in ('start', 'end'):
+            if getattr(opts, timeOpt):
+                parseTimestampArg(getattr(opts, timeOpt))
+    except ValueError, e:
+        parser.error(str(e))
     logging.basicConfig(level=logging.DEBUG)
 
     statLogs(opts, args)
@@ -0,0 +1,93 @@
+#__BEGIN_LICENSE__
+# Copyright (c) 2017, United States Government, as represented by the
+# Administrator of the National Aeronautics and Space Administration.
+# All rights reserved.
+#
+# The GeoRef platform is licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+#__END_LICENSE__
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from geocamUtil.zmqUtil.util import LogRecord, buildLogIndex, getIndexPath, getLogRanges
+from geocamUtil.zmqUtil.zmqStatLogs import getLogStats
+
+START_TIMESTAMP = 1342173600000000
+
+
+class ZmqStatLogsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp(prefix='zmqStatLogsTest')
+        self.logPath = os.path.join(self.tmpDir, 'messages.txt')
+        logFile = open(self.logPath, 'wb')
+        # 3 messages per second, except for 7 in second 10
+        for i in xrange(90):
+            LogRecord(START_TIMESTAMP + (i // 3) * 1000000, '-',
+                      'a.b:{"i": %d}' % i).writeTo(logFile)
+            if i // 3 == 10 and i % 3 == 0:
+                for _j in xrange(4):
+                    LogRecord(START_TIMESTAMP + 10500000, '-', 'c:{}').writeTo(logFile)
+        logFile.close()
+        buildLogIndex(self.logPath, everyRecords=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_stats(self):
+        ranges = getLogRanges(self.logPath, chunkBytes=200)
+        self.assertTrue(len(ranges) > 5)
+        for jobs, chunkBytes in ((1, 1000000), (1, 200), (3, 200)):
+            stats = getLogStats([self.logPath], jobs=jobs, chunkBytes=chunkBytes)
+            total = stats['total']
+            self.assertEqual(total['count'], 94)
+            self.assertEqual(total['topics']['c'], {'count': 4, 'bytes': 16})
+            self.assertEqual(total['topics']['a.b']['count'], 90)
+            self.assertEqual(total['hours'], {'2012-07-13 10:00': 94})
+            self.assertEqual(total['peak'], {'msgsPerSec': 7, 'time': '2012-07-13 10:00:10'})
+            self.assertEqual(stats['files'][0]['path'], self.logPath)
+
+    def test_mergedPeak(self):
+        # a second instance logging 2 messages per second over the same
+        # time, with a burst of 7 in second 20. neither log has more than
+        # 7 messages in any second, but together they have 10 in second
+        # 20.
+        otherPath = os.path.join(self.tmpDir, 'messages2.txt')
+        logFile = open(otherPath, 'wb')
+        for i in xrange(60):
+            second = i // 2
+            if second == 20:
+                second = 19
+            LogRecord(START_TIMESTAMP + second * 1000000, '-', 'd:{}').writeTo(logFile)
+        for _j in xrange(7):
+            LogRecord(START_TIMESTAMP + 20000000, '-', 'd:{}').writeTo(logFile)
+        logFile.close()
+
+        for jobs, chunkBytes in ((1, 1000000), (3, 200)):
+            stats = getLogStats([self.logPath, otherPath], jobs=jobs, chunkBytes=chunkBytes)
+            self.assertEqual(stats['files'][1]['peak'], {'msgsPerSec': 7, 'time': '2012-07-13 10:00:20'})
+            self.assertEqual(stats['total']['count'], 161)
+            self.assertEqual(stats['total']['peak'], {'msgsPerSec': 10, 'time': '2012-07-13 10:00:20'})
+
+    def test_timeRange(self):
+        os.unlink(getIndexPath(self.logPath))
+        stats = getLogStats([self.logPath],
+                            startTimestamp=START_TIMESTAMP + 10500000,
+                            endTimestamp=START_TIMESTAMP + 12000000)
+        total = stats['total']
+        self.assertEqual(total['count'], 7)
+        self.assertEqual(total['topics']['c']['count'], 4)
+        self.assertEqual(total['peak'], {'msgsPerSec': 4, 'time': '2012-07-13 10:00:10'})
+
+
+if __name__ == '__main__':
+    unittest.main()